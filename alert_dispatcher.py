@@ -0,0 +1,222 @@
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+from metrics import REGISTRY
+from pipeline import BoundedQueue
+from resilience import Backoff, CircuitOpen, get_breakers
+
+
+class SmtpConnection:
+    """
+    One authenticated SMTP session that is reused across alerts.
+
+    The session is checked with NOOP only when it has been idle for
+    ``noop_after`` seconds (servers drop idle clients), and is reopened
+    (connect, STARTTLS, login) whenever it is missing or dead.
+    """
+
+    def __init__(self, email_cfg, timeout=30, noop_after=30, registry=REGISTRY):
+        self.host = email_cfg.get('smtp_server')
+        self.port = email_cfg.get('smtp_port')
+        self.use_tls = email_cfg.get('use_tls')
+        self.username = email_cfg.get('username')
+        self.password = email_cfg.get('password')
+        self.timeout = timeout
+        self.noop_after = noop_after
+        self.server = None
+        self.last_used = 0.0
+        self.connects = registry.counter('alerts.smtp_connects')
+
+    def _alive(self):
+        if self.server is None:
+            return False
+        if time.monotonic() - self.last_used < self.noop_after:
+            return True
+        try:
+            return self.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def ensure(self):
+        if self._alive():
+            return self.server
+        self.close()
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                server.starttls()
+            if self.username:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+        self.connects.inc()
+        return server
+
+    def send(self, msg):
+        self.ensure().send_message(msg)
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                self.server.close()
+            self.server = None
+
+
+class AlertDispatcher:
+    """
+    Sends alert emails from a background thread.
+
+    ``submit()`` only enqueues, so sampling never waits for SMTP. The worker
+    keeps one logged-in connection per SMTP account and reuses it for every
+    alert; a connection error drops the connection and the alert is retried
+    with jittered exponential backoff (``base_backoff`` doubling up to
+    ``max_backoff``) up to ``max_retries`` times. Permanent rejections (5xx)
+    are not retried. Each SMTP server has a circuit breaker (resilience.py):
+    while it is open, alerts wait for the next trial instead of each paying
+    a connect timeout. Connections idle for ``idle_timeout`` are closed.
+
+    Exported metrics: ``alerts.queue_depth``, ``alerts.sent``,
+    ``alerts.failed``, ``alerts.retries``, ``alerts.smtp_connects`` and
+    ``alerts.send_seconds``.
+    """
+
+    def __init__(self, maxsize=1000, max_retries=5, base_backoff=1, max_backoff=60,
+                 idle_timeout=60, breakers=None, registry=REGISTRY):
+        # A burst of alerts should never block sampling; the newest matter most
+        self.queue = BoundedQueue(maxsize, 'drop_oldest', name='alerts', registry=registry)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+        self.breakers = breakers
+        self.registry = registry
+        self._connections = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.sent = registry.counter('alerts.sent')
+        self.failed = registry.counter('alerts.failed')
+        self.retries = registry.counter('alerts.retries')
+        self.latency = registry.histogram('alerts.send_seconds')
+
+    @classmethod
+    def from_config(cls, config):
+        opts = ((config or {}).get('email') or {}).get('dispatcher') or {}
+        return cls(
+            maxsize=opts.get('queue_size', 1000),
+            max_retries=opts.get('max_retries', 5),
+            base_backoff=opts.get('base_backoff', 1),
+            max_backoff=opts.get('max_backoff', 60),
+            idle_timeout=opts.get('idle_timeout', 60),
+            breakers=get_breakers(config),
+        )
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=10):
+        """Send what is already queued (within ``timeout``), then close every connection."""
+        self.queue.close()
+        if self._thread:
+            self._thread.join(timeout)
+        self._stop.set()
+
+    def submit(self, email_cfg, subject, body, source='alerts'):
+        """Queue one alert email. Returns False if email is disabled or the dispatcher stopped."""
+        if not email_cfg or not email_cfg.get('enabled'):
+            return False
+        msg = EmailMessage()
+        msg['Subject'] = subject
+        msg['From'] = email_cfg.get('from_addr')
+        msg['To'] = email_cfg.get('to_addr')
+        msg.set_content(body)
+        self.start()
+        return self.queue.put((email_cfg, msg, source))
+
+    def _connection(self, email_cfg):
+        key = (email_cfg.get('smtp_server'), email_cfg.get('smtp_port'), email_cfg.get('username'))
+        conn = self._connections.get(key)
+        if conn is None:
+            conn = self._connections[key] = SmtpConnection(email_cfg, registry=self.registry)
+        return conn
+
+    def _run(self):
+        while True:
+            item = self.queue.get(timeout=self.idle_timeout)
+            if item is None:
+                if self.queue.closed:
+                    break
+                self._close_connections()
+                continue
+            self._deliver(*item)
+        self._close_connections()
+
+    def _deliver(self, email_cfg, msg, source):
+        conn = self._connection(email_cfg)
+        breaker = (self.breakers or get_breakers()).breaker(f"smtp.{conn.host}:{conn.port}")
+        backoff = Backoff(self.base_backoff, self.max_backoff)
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            try:
+                breaker.before()
+                conn.send(msg)
+            except CircuitOpen as e:
+                error = e
+            except smtplib.SMTPResponseException as e:
+                conn.close()
+                if 500 <= e.smtp_code < 600:
+                    # The server is up; it just won't take this message
+                    breaker.success()
+                    print(f"[{source}]   > Email rejected by server ({e.smtp_code}): {e.smtp_error!r}")
+                    break
+                breaker.failure()
+                error = e
+            except (smtplib.SMTPException, OSError) as e:
+                conn.close()
+                breaker.failure()
+                error = e
+            else:
+                breaker.success()
+                self.latency.observe(time.monotonic() - started)
+                self.sent.inc()
+                print(f"[{source}]   > Email alert sent to {msg['To']}")
+                return True
+            if attempt == self.max_retries or self._stop.is_set():
+                print(f"[{source}]   > Failed to send email: {error}")
+                break
+            self.retries.inc()
+            # While the circuit is open there's no point trying before its next trial
+            delay = max(backoff.next(), breaker.retry_in())
+            print(f"[{source}]   > Email send failed ({error}), retrying in {delay:.0f}s")
+            if self._stop.wait(delay):
+                break
+        self.failed.inc()
+        return False
+
+    def _close_connections(self):
+        for conn in self._connections.values():
+            conn.close()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher(config=None):
+    """Process-wide AlertDispatcher, created from config.json's ``email.dispatcher`` section on first use."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = AlertDispatcher.from_config(config)
+            _dispatcher.start()
+        return _dispatcher
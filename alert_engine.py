@@ -0,0 +1,224 @@
+import threading
+import time
+from datetime import datetime
+
+from metrics import REGISTRY
+
+
+class AlertState:
+    """Alert bookkeeping for one (device, metric)."""
+
+    def __init__(self):
+        self.active = False
+        self.raised_at = None
+        self.cleared_at = None
+        self.last_notified = None   # time.time() of the last immediate email
+        self.limit = None
+        self.value = None
+        self.peak = None
+        self.samples = 0            # samples in breach since the last digest
+        self.suppressed = 0         # raises folded into the digest by the cooldown
+        self.changed = False        # anything worth reporting since the last digest
+        self.condition = False      # a boolean rule rather than a value/limit pair
+        self.threshold = None       # (metric, kind, threshold) of a static condition rule
+
+
+class AlertEngine:
+    """
+    Turns per-sample threshold checks into a handful of emails.
+
+      - hysteresis: an alert raises when a value goes above its limit and
+        only clears once it drops to ``limit - clear_margin`` or below, so a
+        value hovering around the limit doesn't flap
+      - cooldown: after an immediate email for a (device, metric), raises
+        within ``cooldown`` seconds are not emailed on their own
+      - digest: every ``digest_interval`` seconds, one email summarizes all
+        devices' ongoing alerts, clears and suppressed raises
+
+    The first breach of a (device, metric) is always emailed immediately.
+    ``clear_margin`` maps metric -> absolute margin; metrics without one use
+    ``default_margin`` (a fraction of the limit). Other matched rules
+    (``reading['conditions']``, see rules.py) are tracked the same way by
+    rule name, raising while they match. Static ones (danger levels, "below"
+    rules; ``reading['condition_limits']``) clear with the same margin on
+    the far side of their threshold; windowed ones clear once they stop
+    matching.
+    """
+
+    def __init__(self, cooldown=900, digest_interval=3600, clear_margin=None,
+                 default_margin=0.02, registry=REGISTRY):
+        self.cooldown = cooldown
+        self.digest_interval = digest_interval
+        self.clear_margin = clear_margin or {}
+        self.default_margin = default_margin
+        self._states = {}
+        self._lock = threading.Lock()
+        self._last_digest = time.time()
+        self.raised = registry.counter('alerts.raised')
+        self.cleared = registry.counter('alerts.cleared')
+        self.suppressed = registry.counter('alerts.suppressed')
+        self.digests = registry.counter('alerts.digests')
+
+    @classmethod
+    def from_config(cls, config):
+        opts = (config or {}).get('alerts') or {}
+        return cls(
+            cooldown=opts.get('cooldown', 900),
+            digest_interval=opts.get('digest_interval', 3600),
+            clear_margin=opts.get('clear_margin'),
+            default_margin=opts.get('default_margin', 0.02),
+        )
+
+    def _margin(self, metric, limit):
+        if metric in self.clear_margin:
+            return float(self.clear_margin[metric])
+        return abs(limit) * self.default_margin
+
+    def _state(self, device, key, condition=False):
+        state = self._states.get((device, key))
+        if state is None:
+            state = self._states[(device, key)] = AlertState()
+            state.condition = condition
+        return state
+
+    def _step(self, state, value, breached, cleared, now):
+        state.value = value
+        if state.active:
+            if cleared:
+                state.active = False
+                state.cleared_at = now
+                state.changed = True
+                self.cleared.inc()
+            else:
+                state.samples += 1
+                if value is not None:
+                    state.peak = max(state.peak, value)
+            return False
+        if not breached:
+            return False
+        state.active = True
+        state.raised_at = now
+        state.cleared_at = None
+        state.samples += 1
+        if value is not None:
+            state.peak = value if state.peak is None else max(state.peak, value)
+        state.changed = True
+        self.raised.inc()
+        if state.last_notified is not None and now - state.last_notified < self.cooldown:
+            state.suppressed += 1
+            self.suppressed.inc()
+            return False
+        state.last_notified = now
+        return True
+
+    def update(self, device, metric, value, limit, now=None):
+        """
+        Feed one sample of a metric. Returns True when the caller should send
+        an immediate alert (a raise outside the cooldown).
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            state = self._state(device, metric)
+            state.limit = limit
+            return self._step(state, value, value > limit,
+                              value <= limit - self._margin(metric, limit), now)
+
+    def update_condition(self, device, name, matched, now=None, value=None, threshold=None):
+        """
+        Feed the outcome of a boolean rule. Windowed rules (duration, rate)
+        are already debounced and clear as soon as they stop matching. Static
+        threshold rules pass their ``(metric, kind, threshold)`` and the
+        metric's current ``value``; they clear only once it is back past the
+        threshold by the clear margin, as in update().
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            state = self._state(device, name, condition=True)
+            if threshold is not None:
+                state.threshold = tuple(threshold)
+            cleared = not matched
+            if state.threshold and value is not None:
+                metric, kind, limit = state.threshold
+                margin = self._margin(metric, limit)
+                cleared = value >= limit + margin if kind == 'below' else value <= limit - margin
+            return self._step(state, None, matched, cleared, now)
+
+    def observe(self, device, reading, now=None):
+        """
+        Feed every limited metric and matched rule condition of a reading;
+        returns the metrics / rule names to alert on now.
+        """
+        limits = reading.get('limits') or {}
+        alerts = [metric for metric, limit in limits.items()
+                  if reading.get(metric) is not None
+                  and self.update(device, metric, float(reading[metric]), float(limit), now)]
+        matched = set(reading.get('conditions') or ())
+        thresholds = reading.get('condition_limits') or {}
+        with self._lock:
+            stale = [(key, state.threshold) for (dev, key), state in self._states.items()
+                     if dev == device and state.condition and state.active and key not in matched]
+        for name, threshold in stale:
+            self.update_condition(device, name, False, now, _value(reading, threshold))
+        for name in sorted(matched):
+            threshold = thresholds.get(name)
+            if self.update_condition(device, name, True, now, _value(reading, threshold), threshold):
+                alerts.append(name)
+        return alerts
+
+    def active(self):
+        with self._lock:
+            return sorted(key for key, state in self._states.items() if state.active)
+
+    def digest(self, now=None, force=False):
+        """
+        Return (subject, body) of the digest when one is due and there is
+        something to report, else None. Resets the per-digest counters.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if not force and now - self._last_digest < self.digest_interval:
+                return None
+            since = self._last_digest
+            self._last_digest = now
+            lines = {}
+            for (device, metric), state in sorted(self._states.items()):
+                if not (state.active or state.changed):
+                    continue
+                if state.condition:
+                    text = (f"{metric}: active since {_clock(state.raised_at)} ({state.samples} sample(s))"
+                            if state.active else f"{metric}: cleared at {_clock(state.cleared_at)}")
+                elif state.active:
+                    text = (f"{metric}: above {state.limit:g} since {_clock(state.raised_at)}"
+                            f" (now {state.value:g}, peak {state.peak:g}, {state.samples} sample(s) in breach)")
+                else:
+                    text = f"{metric}: cleared at {_clock(state.cleared_at)} (peak {state.peak:g})"
+                if state.suppressed:
+                    text += f", raised {state.suppressed} more time(s) during cooldown"
+                lines.setdefault(device, []).append(text)
+                state.samples = 0
+                state.suppressed = 0
+                state.changed = False
+                state.peak = state.value if state.active else None
+        if not lines:
+            return None
+        self.digests.inc()
+        alerts = sum(len(v) for v in lines.values())
+        subject = f"Alert digest: {alerts} alert(s) on {len(lines)} device(s)"
+        body = [f"ALERT DIGEST {_clock(since)} - {_clock(now)}", ""]
+        for device, entries in lines.items():
+            body.append(device)
+            body.extend(f"  - {entry}" for entry in entries)
+            body.append("")
+        body.append("This is an automated digest from your IoT Environmental Monitoring System.")
+        return subject, "\n".join(body)
+
+
+def _value(reading, threshold):
+    """The reading's value of a static condition's metric, if it has one."""
+    if threshold and reading.get(threshold[0]) is not None:
+        return float(reading[threshold[0]])
+    return None
+
+
+def _clock(epoch):
+    return datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S')
@@ -1,10 +1,15 @@
 import requests
 import time
-import json
 import os
-import smtplib
-from email.message import EmailMessage
 from datetime import datetime
+from cadence import Cadence
+from rate_limit import AdaptiveInterval
+from pipeline import default_pipeline
+from http_client import get_client
+from alert_dispatcher import get_dispatcher
+from rules import rules_for
+from config_service import get_config
+from weather_cache import get_weather_cache, location_key
 
 class WeatherSensor:
     """
@@ -21,21 +26,46 @@ class WeatherSensor:
     - Includes air quality data
     """
     
-    def __init__(self, name, api_key, interval, weather_api_key, city, country_code="IN"):
+    def __init__(self, name, api_key, interval, weather_api_key, city, country_code="IN",
+                 state_file='current_state.json', missed_tick_policy='skip', pipeline=None,
+                 channel_id=None, base_url='http://api.weatherapi.com/v1', adaptive=None):
         self.name = name
         self.api_key = api_key  # ThingSpeak API key
         self.interval = interval
         self.weather_api_key = weather_api_key  # WeatherAPI.com API key
         self.city = city
         self.country_code = country_code
+        self.state_file = state_file
+        self.missed_tick_policy = missed_tick_policy
+        # Readings are published to sink workers instead of doing I/O inline
+        self.pipeline = pipeline or default_pipeline()
+        # ThingSpeak channel id enables batched bulk uploads
+        self.channel_id = channel_id
+        self.iteration = 0
+        # Polling slows down on API failures and flat readings, speeds up on fast changes
+        self.adaptive = AdaptiveInterval.from_config(interval, adaptive)
+        # WeatherAPI's last_updated_epoch of the conditions parsed last / published last
+        self.observed = None
+        self.published = None
         
         # WeatherAPI.com endpoint (includes both weather AND air quality!)
-        self.weather_url = f"http://api.weatherapi.com/v1/current.json?key={weather_api_key}&q={city},{country_code}&aqi=yes"
+        self.weather_url = f"{base_url.rstrip('/')}/current.json?key={weather_api_key}&q={city},{country_code}&aqi=yes"
+        # Devices in the same city share one cached response, and all
+        # locations are refreshed together (bulk request) when one is due
+        self.location_key = location_key(city, country_code)
+        self.register_location()
         
         print(f" Weather Sensor '{self.name}' initialized for {self.city}, {self.country_code}")
         print(f"📡 Fetching live data from WeatherAPI.com")
         print(f"Debug - API URL: {self.weather_url}")
 
+    def register_location(self):
+        """Have the shared bulk fetcher (if any) refresh this device's location"""
+        bulk = get_weather_cache().bulk
+        if bulk is not None:
+            bulk.register(self.location_key, self.weather_api_key, f"{self.city},{self.country_code}",
+                          self.weather_url)
+
     def fetch_live_weather_data(self):
         """
         Fetch real-time weather data from WeatherAPI.com
@@ -44,58 +74,17 @@ class WeatherSensor:
             tuple: (temperature, humidity, co2_equivalent) or (None, None, None) on error
         """
         try:
-            # Fetch current weather data (includes air quality!)
-            response = requests.get(self.weather_url, timeout=10)
+            # Current weather (includes air quality!) from the shared cache;
+            # WeatherAPI is only asked once the cached conditions are due
+            status_code, data = get_weather_cache().fetch(self.weather_url, self.location_key)
             
-            if response.status_code != 200:
-                print(f"[{self.name}]  Weather API returned status code {response.status_code}")
-                if response.status_code == 403:
+            if status_code != 200:
+                print(f"[{self.name}]  Weather API returned status code {status_code}")
+                if status_code == 403:
                     print(f"[{self.name}]  API key may be invalid or not activated yet")
                 return None, None, None
             
-            data = response.json()
-            
-            # Extract temperature and humidity
-            temp = data['current']['temp_c']
-            humidity = data['current']['humidity']
-            
-            # Extract air quality data
-            co2_equivalent = 400  # Default baseline
-            
-            if 'air_quality' in data['current']:
-                aqi_data = data['current']['air_quality']
-                
-                # WeatherAPI provides US EPA standard AQI
-                us_epa_index = aqi_data.get('us-epa-index', 1)
-                
-                # Also has CO (Carbon Monoxide in μg/m3)
-                co = aqi_data.get('co', 0)
-                
-                # Convert EPA AQI to CO2 equivalent
-                # EPA Index: 1=Good, 2=Moderate, 3=Unhealthy for Sensitive, 4=Unhealthy, 5=Very Unhealthy, 6=Hazardous
-                aqi_to_co2 = {
-                    1: 400,   # Good air quality → baseline CO2
-                    2: 600,   # Moderate
-                    3: 800,   # Unhealthy for sensitive groups
-                    4: 1000,  # Unhealthy
-                    5: 1200,  # Very Unhealthy
-                    6: 1400   # Hazardous
-                }
-                co2_equivalent = aqi_to_co2.get(us_epa_index, 400)
-                
-                # Adjust based on actual CO measurement if available
-                if co > 0:
-                    # CO is in μg/m³, use it to refine CO2 estimate
-                    co2_from_co = 400 + (co / 10)
-                    co2_equivalent = max(co2_equivalent, min(1500, co2_from_co))
-                
-                print(f"[{self.name}] Air Quality Index: {us_epa_index} → CO₂ Equivalent: {co2_equivalent:.0f} ppm")
-            else:
-                print(f"[{self.name}]  Air quality data not available, using baseline CO₂")
-            
-            print(f"[{self.name}] Live data fetched: {temp}°C, {humidity}%, ~{co2_equivalent:.0f} ppm CO₂")
-            
-            return temp, humidity, co2_equivalent
+            return self.parse_weather_data(data)
             
         except requests.exceptions.Timeout:
             print(f"[{self.name}]  API request timed out")
@@ -110,38 +99,99 @@ class WeatherSensor:
             print(f"[{self.name}]  Error fetching weather data: {e}")
             return None, None, None
 
+    def parse_weather_data(self, data):
+        """
+        Readings from a WeatherAPI ``current.json`` payload
+        
+        Returns:
+            tuple: (temperature, humidity, co2_equivalent); KeyError when fields are missing
+        """
+        # The cache serves the same observation until WeatherAPI updates it
+        self.observed = data['current'].get('last_updated_epoch')
+
+        # Extract temperature and humidity
+        temp = data['current']['temp_c']
+        humidity = data['current']['humidity']
+        
+        # Extract air quality data
+        co2_equivalent = 400  # Default baseline
+        
+        if 'air_quality' in data['current']:
+            aqi_data = data['current']['air_quality']
+            
+            # WeatherAPI provides US EPA standard AQI
+            us_epa_index = aqi_data.get('us-epa-index', 1)
+            
+            # Also has CO (Carbon Monoxide in μg/m3)
+            co = aqi_data.get('co', 0)
+            
+            # Convert EPA AQI to CO2 equivalent
+            # EPA Index: 1=Good, 2=Moderate, 3=Unhealthy for Sensitive, 4=Unhealthy, 5=Very Unhealthy, 6=Hazardous
+            aqi_to_co2 = {
+                1: 400,   # Good air quality → baseline CO2
+                2: 600,   # Moderate
+                3: 800,   # Unhealthy for sensitive groups
+                4: 1000,  # Unhealthy
+                5: 1200,  # Very Unhealthy
+                6: 1400   # Hazardous
+            }
+            co2_equivalent = aqi_to_co2.get(us_epa_index, 400)
+            
+            # Adjust based on actual CO measurement if available
+            if co > 0:
+                # CO is in μg/m³, use it to refine CO2 estimate
+                co2_from_co = 400 + (co / 10)
+                co2_equivalent = max(co2_equivalent, min(1500, co2_from_co))
+            
+            print(f"[{self.name}] Air Quality Index: {us_epa_index} → CO₂ Equivalent: {co2_equivalent:.0f} ppm")
+        else:
+            print(f"[{self.name}]  Air quality data not available, using baseline CO₂")
+        
+        print(f"[{self.name}] Live data fetched: {temp}°C, {humidity}%, ~{co2_equivalent:.0f} ppm CO₂")
+        
+        return temp, humidity, co2_equivalent
+
     def _send_email_alert(self, subject: str, body: str, email_cfg: dict):
-        """Send email alert when thresholds are exceeded"""
-        if not email_cfg or not email_cfg.get('enabled'):
-            return False
+        """Queue an alert email; the shared dispatcher sends it over a persistent SMTP connection"""
+        queued = get_dispatcher().submit(email_cfg, subject, body, source=self.name)
+        if queued:
+            print(f"[{self.name}]   > Email alert queued for {email_cfg.get('to_addr')}")
+        return queued
 
-        try:
-            msg = EmailMessage()
-            msg['Subject'] = subject
-            msg['From'] = email_cfg.get('from_addr')
-            msg['To'] = email_cfg.get('to_addr')
-            msg.set_content(body)
+    def format_alert(self, reading):
+        """Subject and body of the alert email for a reading with warnings"""
+        subject = f"Environmental Alert from {self.name}"
+        body = f"""
+ENVIRONMENTAL THRESHOLD EXCEEDED
 
-            server = smtplib.SMTP(email_cfg.get('smtp_server'), email_cfg.get('smtp_port'))
-            if email_cfg.get('use_tls'):
-                server.starttls()
-            username = email_cfg.get('username')
-            password = email_cfg.get('password')
-            if username:
-                server.login(username, password)
-            server.send_message(msg)
-            server.quit()
-            print(f"[{self.name}]   Email alert sent to {email_cfg.get('to_addr')}")
-            return True
-        except Exception as e:
-            print(f"[{self.name}]    Failed to send email: {e}")
-            return False
+Device: {self.name}
+Location: {self.city}, {self.country_code}
+Time: {datetime.fromisoformat(reading['timestamp']).strftime('%Y-%m-%d %H:%M:%S')}
+Data Source: WeatherAPI.com
+
+Current Readings:
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+CO2 Level (AQI-based):  {reading['co2']:.0f} ppm
+Temperature:            {reading['temperature']}°C
+Humidity:               {reading['humidity']}%
+
+Alerts:
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+{chr(10).join(reading['warnings'])}
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+Please check the environmental conditions immediately.
+
+This is an automated alert from your IoT Environmental Monitoring System.
+        """
+        return subject, body
 
     def _send_to_thingspeak(self, co2, temp, humidity):
         """Upload data to ThingSpeak IoT platform"""
         try:
             url = f"https://api.thingspeak.com/update?api_key={self.api_key}&field1={co2:.1f}&field2={temp:.1f}&field3={humidity:.1f}"
-            response = requests.get(url, timeout=10)
+            response = get_client().get(url)
             if response.status_code == 200 and response.text != '0':
                 print(f"[{self.name}]    ThingSpeak updated (Entry ID: {response.text})")
                 return True
@@ -152,6 +202,106 @@ class WeatherSensor:
             print(f"[{self.name}]    ThingSpeak error: {e}")
             return False
 
+    def step(self):
+        """
+        One monitoring cycle: fetch, check thresholds and publish the reading.
+
+        Returns False when the weather API gave no usable data this cycle.
+        """
+        self.begin_cycle()
+        
+        # Fetch live data from API
+        temp, humidity, co2_equivalent = self.fetch_live_weather_data()
+        
+        if temp is None or humidity is None or co2_equivalent is None:
+            self.fetch_failed()
+            return False
+        
+        if not self.unchanged(temp, humidity, co2_equivalent):
+            self.process_reading(temp, humidity, co2_equivalent)
+        return True
+
+    def next_interval(self):
+        """Seconds until the next fetch (longer after failures, adaptive when configured)"""
+        return self.adaptive.interval
+
+    def fetch_failed(self):
+        """Back off after a cycle without usable data instead of retrying at the full rate"""
+        self.adaptive.failure()
+        print(f"[{self.name}]    Failed to fetch data. Retrying in {self.next_interval():.0f} seconds...")
+
+    def begin_cycle(self):
+        """Count and announce a monitoring cycle"""
+        self.iteration += 1
+        print(f"\n{'='*60}")
+        print(f"[{self.name}]   DATA FETCH #{self.iteration} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print(f"{'='*60}")
+
+    def unchanged(self, temp, humidity, co2_equivalent):
+        """
+        True when WeatherAPI has not updated the conditions since the last
+        published reading (a cache hit), which is then not published again.
+        """
+        if self.observed is None or self.observed != self.published:
+            return False
+        self.adaptive.success({'co2': co2_equivalent, 'temperature': temp, 'humidity': humidity},
+                              self.observed)
+        print(f"[{self.name}]   > No update from WeatherAPI since the last reading, nothing to publish")
+        return True
+
+    def process_reading(self, temp, humidity, co2_equivalent):
+        """Check thresholds, show the dashboard and publish one fetched reading"""
+        self.adaptive.success({'co2': co2_equivalent, 'temperature': temp, 'humidity': humidity},
+                              self.observed)
+        self.published = self.observed
+        
+        # Configuration for thresholds (parsed once, reloaded when the file changes)
+        cfg = get_config()
+        if cfg is None:
+            print(f"[{self.name}]    Could not load config.json")
+        
+        # Check thresholds (rules are compiled once per config)
+        now = time.time()
+        result = rules_for(cfg).evaluate(
+            self.name, {'co2': co2_equivalent, 'temperature': temp, 'humidity': humidity}, now)
+        status = "WARNING" if result.warnings else "Normal"
+        warnings = result.warnings
+        
+        # Display live dashboard in terminal
+        print(f"\n{'─'*60}")
+        print(f"   LIVE ENVIRONMENTAL MONITORING DASHBOARD")
+        print(f"{'─'*60}")
+        print(f"   Location     : {self.city}, {self.country_code}")
+        print(f"   CO2 Level    : {co2_equivalent:.0f} ppm")
+        print(f"   Temperature  : {temp}°C")
+        print(f"   Humidity     : {humidity}%")
+        print(f"   Status       : {status}")
+        if warnings:
+            print(f"{'─'*60}")
+            print("   ALERTS:")
+            for w in warnings:
+                print(f"      {w}")
+        print(f"{'─'*60}\n")
+        
+        # Hand the reading to the sink workers (state file, email, ThingSpeak, ...)
+        reading = {
+            'device': self.name,
+            'co2': round(co2_equivalent, 1),
+            'temperature': round(temp, 1),
+            'humidity': round(humidity, 1),
+            'status': status,
+            'warnings': warnings,
+            'limits': result.limits,
+            'conditions': result.conditions,
+            'condition_limits': result.condition_limits,
+            'timestamp': datetime.now().isoformat(),
+            'epoch': now,
+            'location': f"{self.city}, {self.country_code}",
+            'data_source': 'WeatherAPI.com'
+        }
+        self.pipeline.publish(self, reading, cfg)
+        return reading
+
     def run_simulation(self):
         """
         Main loop: Fetch live weather data at regular intervals and process it
@@ -161,120 +311,20 @@ class WeatherSensor:
         print(f"[{self.name}]    Update interval: {self.interval} seconds")
         print(f"[{self.name}]   {'='*60}\n")
         
-        iteration = 0
-        
+        # Fetches run on a fixed grid, so slow uploads/emails don't add drift
+        cadence = Cadence(self.interval, policy=self.missed_tick_policy)
+        cadence.start()
         try:
             while True:
-                iteration += 1
-                print(f"\n{'='*60}")
-                print(f"[{self.name}]   DATA FETCH #{iteration} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                print(f"{'='*60}")
-                
-                # Fetch live data from API
-                temp, humidity, co2_equivalent = self.fetch_live_weather_data()
-                
-                if temp is None or humidity is None or co2_equivalent is None:
-                    print(f"[{self.name}]    Failed to fetch data. Retrying in {self.interval} seconds...")
-                    time.sleep(self.interval)
-                    continue
-                
-                # Load configuration for thresholds
-                cfg = None
-                try:
-                    with open('config.json', 'r') as f:
-                        cfg = json.load(f)
-                except Exception as e:
-                    print(f"[{self.name}]    Could not load config: {e}")
-                
-                temp_limit = cfg.get('temperature_limit') if cfg else None
-                humid_limit = cfg.get('humidity_limit') if cfg else None
-                co2_limit = cfg.get('co2_limit', 1000) if cfg else 1000
-                email_cfg = cfg.get('email') if cfg else None
-                
-                # Check thresholds
-                status = "Normal"
-                warnings = []
-                
-                if co2_limit is not None and co2_equivalent > float(co2_limit):
-                    warnings.append(f"High CO2: {co2_equivalent:.0f} ppm > {co2_limit} ppm")
-                if temp_limit is not None and temp > float(temp_limit):
-                    warnings.append(f"High Temperature: {temp}°C > {temp_limit}°C")
-                if humid_limit is not None and humidity > float(humid_limit):
-                    warnings.append(f"High Humidity: {humidity}% > {humid_limit}%")
-                
-                if warnings:
-                    status = "WARNING"
-                
-                # Display live dashboard in terminal
-                print(f"\n{'─'*60}")
-                print(f"   LIVE ENVIRONMENTAL MONITORING DASHBOARD")
-                print(f"{'─'*60}")
-                print(f"   Location     : {self.city}, {self.country_code}")
-                print(f"   CO2 Level    : {co2_equivalent:.0f} ppm")
-                print(f"   Temperature  : {temp}°C")
-                print(f"   Humidity     : {humidity}%")
-                print(f"   Status       : {status}")
-                if warnings:
-                    print(f"{'─'*60}")
-                    print("   ALERTS:")
-                    for w in warnings:
-                        print(f"      {w}")
-                print(f"{'─'*60}\n")
-                
-                # Save current state for web dashboard
-                try:
-                    state = {
-                        'co2': round(co2_equivalent, 1),
-                        'temperature': round(temp, 1),
-                        'humidity': round(humidity, 1),
-                        'status': status,
-                        'warnings': warnings,
-                        'timestamp': datetime.now().isoformat(),
-                        'location': f"{self.city}, {self.country_code}",
-                        'data_source': 'WeatherAPI.com'
-                    }
-                    with open('current_state.json', 'w') as f:
-                        json.dump(state, f, indent=2)
-                    print(f"[{self.name}]   State saved for web dashboard")
-                except Exception as e:
-                    print(f"[{self.name}]   Failed to save state: {e}")
-                
-                # Send email alerts if thresholds exceeded
-                if warnings and email_cfg and email_cfg.get('enabled'):
-                    subject = f"Environmental Alert from {self.name}"
-                    body = f"""
-ENVIRONMENTAL THRESHOLD EXCEEDED
-
-Device: {self.name}
-Location: {self.city}, {self.country_code}
-Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-Data Source: WeatherAPI.com
-
-Current Readings:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-CO2 Level (AQI-based):  {co2_equivalent:.0f} ppm
-Temperature:            {temp}°C
-Humidity:               {humidity}%
-
-Alerts:
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-{chr(10).join(warnings)}
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-Please check the environmental conditions immediately.
-
-This is an automated alert from your IoT Environmental Monitoring System.
-                    """
-                    self._send_email_alert(subject, body, email_cfg)
-                
-                # Upload to ThingSpeak
-                self._send_to_thingspeak(co2_equivalent, temp, humidity)
-                
-                # Wait for next update
-                print(f"\n[{self.name}]   Waiting {self.interval} seconds until next update...")
-                print(f"{'='*60}\n")
-                time.sleep(self.interval)
+                cadence.mark_sample()
+                fetched = self.step()
+                cadence.set_interval(self.next_interval())
+                wait = cadence.time_until_next()
+                if fetched:
+                    # Wait for next update
+                    print(f"\n[{self.name}]   Waiting {wait:.1f} seconds until next update...")
+                    print(f"{'='*60}\n")
+                time.sleep(wait)
                 
         except KeyboardInterrupt:
             print(f"\n\n{'='*60}")
@@ -0,0 +1,448 @@
+import asyncio
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit
+
+from requests.structures import CaseInsensitiveDict
+
+from alert_dispatcher import get_dispatcher
+from config_service import get_config_service
+from api_weather_device import WeatherSensor
+from http_client import get_client
+from metrics import REGISTRY
+from orchestrator import DeviceRunner, build_sensor, devices_from_config, reconfigure_runners
+from pipeline import default_pipeline
+from rate_limit import RateLimited, get_rate_limiter
+from resilience import get_breakers
+from weather_cache import get_weather_cache
+
+try:
+    import aiohttp
+except ImportError:  # optional: AsyncHttpClient below needs only the stdlib
+    aiohttp = None
+
+
+class _ConnectionClosed(ConnectionError):
+    """The server closed the connection before answering."""
+
+
+class AsyncHttpClient:
+    """
+    Keep-alive HTTP/1.1 client on asyncio streams, for when aiohttp is not
+    installed.
+
+    Idle connections are pooled per (scheme, host, port) and at most
+    ``pool_maxsize`` requests per host are in flight; the rest wait on the
+    event loop, not in a thread. Responses come back as ``(status, headers,
+    body bytes)``. Requests share HttpClient's per-host rate limits and
+    circuit breakers, and latency and errors go to the same
+    ``http.<host>.latency_seconds`` / ``http.<host>.errors`` metrics.
+    """
+
+    def __init__(self, connect_timeout=5, read_timeout=10, pool_maxsize=32, rate_limiter=None,
+                 breakers=None, registry=REGISTRY):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_maxsize = pool_maxsize
+        self.rate_limiter = rate_limiter
+        self.breakers = breakers
+        self.registry = registry
+        self._idle = {}      # (scheme, host, port) -> [(reader, writer)]
+        self._slots = {}     # (scheme, host, port) -> Semaphore(pool_maxsize)
+        self._ssl = None
+
+    async def request(self, method, url, headers=None, body=None):
+        host = urlsplit(url).hostname or 'unknown'
+        limiter = self.rate_limiter or get_rate_limiter()
+        breaker = (self.breakers or get_breakers()).breaker(host)
+        breaker.before()
+        try:
+            wait = limiter.reserve(host)
+        except RateLimited:
+            breaker.abandon()
+            raise
+        if wait:
+            await asyncio.sleep(wait)
+        started = time.monotonic()
+        try:
+            response = await self._request(method, url, headers, body)
+        except (OSError, asyncio.TimeoutError):
+            self.registry.counter(f"http.{host}.errors").inc()
+            breaker.failure()
+            raise
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        except Exception:
+            # Anything else the client raises (aiohttp.ClientError, a bad
+            # response...) still counts, or a half-open trial would never report
+            self.registry.counter(f"http.{host}.errors").inc()
+            breaker.failure()
+            raise
+        finally:
+            self.registry.histogram(f"http.{host}.latency_seconds").observe(time.monotonic() - started)
+        limiter.response(host, response[0], response[1])
+        if response[0] >= 500:
+            breaker.failure()
+        else:
+            breaker.success()
+        return response
+
+    async def get(self, url, headers=None):
+        return await self.request('GET', url, headers=headers)
+
+    async def _request(self, method, url, headers, body):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        target = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        slots = self._slots.get(key)
+        if slots is None:
+            slots = self._slots[key] = asyncio.Semaphore(self.pool_maxsize)
+        async with slots:
+            return await asyncio.wait_for(self._send(key, method, parts.netloc, target, headers, body),
+                                          self.connect_timeout + self.read_timeout)
+
+    async def _send(self, key, method, netloc, target, headers, body):
+        idle = self._idle.setdefault(key, [])
+        while True:
+            reused = bool(idle)
+            reader, writer = idle.pop() if reused else await self._connect(key)
+            try:
+                status, response_headers, data, keep_alive = await self._exchange(
+                    reader, writer, method, netloc, target, headers, body)
+            except _ConnectionClosed:
+                writer.close()
+                if reused:
+                    continue    # an idle keep-alive connection the server had dropped
+                raise
+            except asyncio.IncompleteReadError as e:
+                writer.close()
+                raise ConnectionError(f"response truncated: {e}") from e
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                idle.append((reader, writer))
+            else:
+                writer.close()
+            return status, response_headers, data
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        context = None
+        if scheme == 'https':
+            if self._ssl is None:
+                self._ssl = ssl.create_default_context()
+            context = self._ssl
+        return await asyncio.wait_for(asyncio.open_connection(host, port, ssl=context), self.connect_timeout)
+
+    async def _exchange(self, reader, writer, method, netloc, target, headers, body):
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {netloc}",
+                 'Accept-Encoding: identity', 'Connection: keep-alive']
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        if body is not None:
+            lines.append(f"Content-Length: {len(body)}")
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise _ConnectionClosed('connection closed by server')
+        version, status = status_line.decode('latin-1').split(None, 2)[:2]
+        status = int(status)
+        response_headers = CaseInsensitiveDict()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip()] = value.strip()
+
+        keep_alive = version == 'HTTP/1.1' and response_headers.get('Connection', '').lower() != 'close'
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            data = b''
+        elif 'chunked' in response_headers.get('Transfer-Encoding', '').lower():
+            data = await self._read_chunked(reader)
+        elif 'Content-Length' in response_headers:
+            data = await reader.readexactly(int(response_headers['Content-Length']))
+        else:
+            data = await reader.read()     # body runs until the server closes
+            keep_alive = False
+        return status, response_headers, data, keep_alive
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError('response truncated in chunked body')
+            size = int(line.split(b';')[0].strip(), 16)
+            if size == 0:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass                   # trailers
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    async def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+
+class AiohttpClient(AsyncHttpClient):
+    """AsyncHttpClient's interface on an aiohttp session (used when aiohttp is installed)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._session = None
+
+    async def _request(self, method, url, headers, body):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=0, limit_per_host=self.pool_maxsize),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout))
+        try:
+            async with self._session.request(method, url, headers=headers, data=body) as response:
+                return response.status, response.headers, await response.read()
+        except aiohttp.ClientError as e:
+            # Callers handle network failures as OSError, whichever client is in use
+            raise ConnectionError(str(e)) from e
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def async_http_client(config=None):
+    """
+    Async HTTP client configured from config.json's ``http`` section:
+    aiohttp when installed (unless ``orchestrator.http_backend`` is
+    ``"stdlib"``), else AsyncHttpClient.
+    """
+    opts = (config or {}).get('http') or {}
+    backend = ((config or {}).get('orchestrator') or {}).get('http_backend', 'auto')
+    cls = AiohttpClient if aiohttp is not None and backend != 'stdlib' else AsyncHttpClient
+    return cls(
+        connect_timeout=opts.get('connect_timeout', 5),
+        read_timeout=opts.get('read_timeout', 10),
+        pool_maxsize=opts.get('async_pool_maxsize', 32),
+        rate_limiter=get_rate_limiter(config),
+        breakers=get_breakers(config),
+    )
+
+
+class AsyncWeatherSensor(WeatherSensor):
+    """WeatherSensor whose monitoring cycle is a coroutine, for AsyncRuntime."""
+
+    def register_location(self):
+        """Nothing to do: the event loop fetches locations itself, the threaded bulk fetcher is not used."""
+
+    async def astep(self, runtime):
+        """``step()`` without blocking the event loop; returns False when no data came back."""
+        self.begin_cycle()
+        temp, humidity, co2_equivalent = await self.afetch_live_weather_data(runtime.http)
+        if temp is None or humidity is None or co2_equivalent is None:
+            self.fetch_failed()
+            return False
+        if self.unchanged(temp, humidity, co2_equivalent):
+            return True
+        # Rules, dashboard and publish (which may wait on a full sink queue) run off the loop
+        await runtime.offload(self.process_reading, temp, humidity, co2_equivalent)
+        return True
+
+    async def afetch_live_weather_data(self, http):
+        """``fetch_live_weather_data()`` over the non-blocking client ``http``."""
+        try:
+            status_code, data = await get_weather_cache().fetch_async(
+                self.weather_url, self.location_key, http.get)
+            if status_code != 200:
+                print(f"[{self.name}]  Weather API returned status code {status_code}")
+                if status_code == 403:
+                    print(f"[{self.name}]  API key may be invalid or not activated yet")
+                return None, None, None
+            return self.parse_weather_data(data)
+        except asyncio.TimeoutError:
+            print(f"[{self.name}]  API request timed out")
+            return None, None, None
+        except OSError as e:
+            print(f"[{self.name}]  Network error: {e}")
+            return None, None, None
+        except KeyError as e:
+            print(f"[{self.name}]  Unexpected API response format: {e}")
+            return None, None, None
+        except Exception as e:
+            print(f"[{self.name}]  Error fetching weather data: {e}")
+            return None, None, None
+
+
+class AsyncRuntime:
+    """
+    Runs every device from one asyncio event loop (``orchestrator.mode: "async"``).
+
+    Weather devices are coroutines whose WeatherAPI requests go through a
+    non-blocking HTTP client, so thousands of them can wait on the network
+    without a thread each. What still blocks runs on a small executor: the
+    rules/dashboard/publish half of a weather cycle, device construction and
+    whole CSV steps (file reads). SMTP, ThingSpeak and the state/history
+    files already run on the pipeline sink and alert dispatcher threads.
+
+    Scheduling matches DeviceOrchestrator: fixed-grid cadences, first
+    samples spread over each interval, exponential backoff between restarts
+    of a crashed device. ``async.wake_lag_seconds`` is how late devices
+    start relative to their deadlines, ``async.cycle_seconds`` the time from
+    deadline to the end of the cycle. Device settings edited in config.json
+    are applied from each device's next cycle, as in the orchestrator.
+    """
+
+    def __init__(self, specs, pipeline=None, http=None, executor_workers=8, restart_backoff=5,
+                 max_restart_backoff=300, metrics_file='metrics.json', metrics_interval=10,
+                 config_service=None, default_type='weather', registry=REGISTRY):
+        self.runners = [DeviceRunner(spec) for spec in specs]
+        self.config_service = config_service
+        self.default_type = default_type
+        self.pipeline = pipeline or default_pipeline()
+        self.http = http or async_http_client()
+        self.executor_workers = executor_workers
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.registry = registry
+        self.executor = None
+        self._loop = None
+        self._tasks = []
+        self.wake_lag = registry.histogram('async.wake_lag_seconds')
+        self.cycle_seconds = registry.histogram('async.cycle_seconds')
+        self.devices = registry.gauge('async.devices')
+
+    @classmethod
+    def from_config(cls, config, default_type='weather'):
+        """Create a runtime from config.json (``devices`` + ``orchestrator`` sections)."""
+        opts = config.get('orchestrator') or {}
+        # Sinks still use the shared blocking clients from their own threads
+        get_client(config)
+        get_dispatcher(config)
+        get_weather_cache(config)
+        return cls(
+            devices_from_config(config, default_type),
+            http=async_http_client(config),
+            executor_workers=opts.get('executor_workers', opts.get('max_workers', 8)),
+            restart_backoff=opts.get('restart_backoff', 5),
+            max_restart_backoff=opts.get('max_restart_backoff', 300),
+            metrics_file=opts.get('metrics_file', 'metrics.json'),
+            metrics_interval=opts.get('metrics_interval', 10),
+            pipeline=default_pipeline(config),
+            config_service=get_config_service(),
+            default_type=default_type,
+        )
+
+    def _config_changed(self, config, changed):
+        # Called on the config watcher thread; runners pick the spec up on the loop
+        reconfigure_runners(self.runners, config, self.default_type, 'AsyncRuntime')
+
+    async def offload(self, fn, *args):
+        """Run blocking ``fn(*args)`` on the executor and await its result."""
+        return await self._loop.run_in_executor(self.executor, partial(fn, *args))
+
+    async def run(self, duration=None):
+        """Drive the devices until cancelled (or for ``duration`` seconds), then shut down."""
+        self._loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.executor_workers, thread_name_prefix='async-offload')
+        client = type(self.http).__name__
+        print(f"[AsyncRuntime]   > Starting {len(self.runners)} device(s) on one event loop ({client})")
+        # Spread first samples over each device's interval, like the orchestrator
+        now = time.monotonic()
+        count = len(self.runners)
+        self._tasks = [asyncio.ensure_future(self._drive(runner, now + runner.interval * i / count))
+                       for i, runner in enumerate(self.runners)]
+        if self.metrics_file:
+            self._tasks.append(asyncio.ensure_future(self._dump_metrics()))
+        self.devices.set(count)
+        if self.config_service is not None:
+            self.config_service.get()
+            self.config_service.subscribe(self._config_changed)
+            self.config_service.start()
+        try:
+            if duration is None:
+                await asyncio.gather(*self._tasks)
+            else:
+                await asyncio.sleep(duration)
+        finally:
+            if self.config_service is not None:
+                self.config_service.unsubscribe(self._config_changed)
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self.http.close()
+            self.executor.shutdown(wait=True)
+            # Let the sinks flush what the devices already published, and the emails they queued
+            self.pipeline.stop()
+            get_dispatcher().stop()
+
+    def stop(self):
+        """Cancel every device; safe to call from another thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(lambda: [task.cancel() for task in self._tasks])
+
+    def status(self):
+        """Snapshot of every device's scheduling state."""
+        return [{
+            'name': r.name,
+            'type': r.spec['type'],
+            'interval': r.interval,
+            'running': r.running,
+            'crashes': r.crashes,
+            'restarts': r.restarts,
+            'last_error': r.last_error,
+        } for r in self.runners]
+
+    async def _dump_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            try:
+                await self.offload(self.registry.dump, self.metrics_file)
+            except OSError as e:
+                print(f"[AsyncRuntime]   > Failed to write {self.metrics_file}: {e}")
+
+    async def _drive(self, runner, first):
+        deadline = runner.cadence.start(first)
+        while True:
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.wake_lag.observe(max(0.0, time.monotonic() - deadline))
+            runner.running = True
+            runner.apply_pending()
+            runner.cadence.mark_sample()
+            try:
+                if runner.sensor is None:
+                    if runner.crashes:
+                        runner.restarts += 1
+                        print(f"[AsyncRuntime]   > Restarting device '{runner.name}'")
+                    runner.sensor = await self.offload(build_sensor, runner.spec, self.pipeline,
+                                                       AsyncWeatherSensor)
+                if isinstance(runner.sensor, AsyncWeatherSensor):
+                    await runner.sensor.astep(self)
+                else:
+                    await self.offload(runner.sensor.step)
+            except Exception as e:
+                runner.crashes += 1
+                runner.last_error = f"{type(e).__name__}: {e}"
+                runner.sensor = None
+                runner.running = False
+                backoff = min(self.max_restart_backoff, self.restart_backoff * 2 ** (runner.crashes - 1))
+                print(f"[AsyncRuntime]   > Device '{runner.name}' crashed ({e}); restarting in {backoff:.0f}s")
+                # Re-anchor the cadence grid at the restart time
+                deadline = runner.cadence.start(time.monotonic() + backoff)
+                continue
+            runner.crashes = 0
+            runner.running = False
+            runner.follow_sensor()
+            self.cycle_seconds.observe(time.monotonic() - deadline)
+            # Next deadline is on the device's fixed grid, not "interval after this step"
+            deadline = runner.cadence.next_deadline()
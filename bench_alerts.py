@@ -0,0 +1,83 @@
+"""
+Offline check of the alert dispatcher against the local SMTP stub.
+
+Sends the same alerts once the old way (new connection + login per alert,
+inline in the caller) and once through AlertDispatcher, and reports
+alerts/sec and how long the caller - the sampling loop - was blocked per
+alert. The stub adds a connect/login delay to stand in for the TLS handshake
+and authentication of a real provider.
+
+    python bench_alerts.py [alerts] [handshake_ms]
+"""
+import smtplib
+import sys
+import time
+from email.message import EmailMessage
+
+from alert_dispatcher import AlertDispatcher
+from stub_servers import SmtpStub
+
+alerts = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+handshake = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+
+
+def email_cfg(stub):
+    host, port = stub.url
+    return {'enabled': True, 'smtp_server': host, 'smtp_port': port, 'use_tls': False,
+            'from_addr': 'sensor@example.com', 'to_addr': 'ops@example.com',
+            'username': 'sensor', 'password': 'secret'}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+print(f"--- {alerts} alert(s), {handshake * 1000:.0f} ms connect/login latency ---")
+
+# 1. One connection per alert, sent inline (the old _send_email_alert)
+with SmtpStub() as stub:
+    stub.connect_latency = handshake
+    cfg = email_cfg(stub)
+    blocked = []
+    started = time.perf_counter()
+    for i in range(alerts):
+        t = time.perf_counter()
+        msg = EmailMessage()
+        msg['Subject'] = f"Alert {i}"
+        msg['From'] = cfg['from_addr']
+        msg['To'] = cfg['to_addr']
+        msg.set_content('threshold exceeded')
+        server = smtplib.SMTP(cfg['smtp_server'], cfg['smtp_port'])
+        server.login(cfg['username'], cfg['password'])
+        server.send_message(msg)
+        server.quit()
+        blocked.append(time.perf_counter() - t)
+    inline_time = time.perf_counter() - started
+    inline_blocked = blocked
+    inline_connections = stub.connections
+
+# 2. Background dispatcher with a persistent connection
+with SmtpStub() as stub:
+    stub.connect_latency = handshake
+    stub.close_after = 100  # force a reconnect now and then
+    cfg = email_cfg(stub)
+    dispatcher = AlertDispatcher(maxsize=alerts, base_backoff=0.05)
+    blocked = []
+    started = time.perf_counter()
+    for i in range(alerts):
+        t = time.perf_counter()
+        dispatcher.submit(cfg, f"Alert {i}", 'threshold exceeded', source='bench')
+        blocked.append(time.perf_counter() - t)
+    dispatcher.stop(timeout=60)
+    dispatched_time = time.perf_counter() - started
+    dispatched_blocked = blocked
+    delivered = len(stub.messages)
+    dispatched_connections = stub.connections
+
+print(f"Inline, new connection : {alerts / inline_time:8.1f} alerts/s, {inline_connections} connection(s), "
+      f"caller blocked p50 {percentile(inline_blocked, 0.5) * 1000:.2f} ms / p99 {percentile(inline_blocked, 0.99) * 1000:.2f} ms")
+print(f"Dispatcher, persistent : {alerts / dispatched_time:8.1f} alerts/s, {dispatched_connections} connection(s), "
+      f"caller blocked p50 {percentile(dispatched_blocked, 0.5) * 1000:.2f} ms / p99 {percentile(dispatched_blocked, 0.99) * 1000:.2f} ms")
+print(f"All alerts delivered: {'YES' if delivered == alerts else f'NO ({delivered}/{alerts})'}")
+sys.exit(0 if delivered == alerts else 1)
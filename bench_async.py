@@ -0,0 +1,172 @@
+"""
+Offline comparison of the asyncio runtime (async_runtime.py) with one
+thread per device (the model main_api.py used before the orchestrator),
+against the local WeatherAPI stub.
+
+Every device has its own location, the weather cache is disabled
+(``max_ttl`` 0) and the stub updates its conditions every second, so each
+cycle is a real request that takes ``latency_ms`` at the stub and
+publishes a new reading. Each model runs in its own process for
+``duration`` seconds; the report shows peak RSS above the process baseline,
+threads, readings published and the p50/p99 of the time from a device's
+deadline to the end of its cycle. Sensor output is discarded. The check
+fails if the asyncio runtime publishes fewer than 95% of the readings due.
+
+    python bench_async.py [devices] [interval] [duration] [latency_ms]
+"""
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+FINE_BOUNDS = tuple(round(0.001 * 1.1 ** i, 6) for i in range(110))   # 1 ms .. ~35 s, 10% steps
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(mode, url, devices, interval, duration):
+    from async_runtime import AsyncHttpClient, AsyncRuntime
+    from cadence import Cadence
+    from http_client import get_client
+    from metrics import MetricsRegistry
+    from orchestrator import build_sensor, devices_from_config
+    from pipeline import ReadingPipeline
+    from sinks import Sink
+    from weather_cache import get_weather_cache
+
+    config = {
+        'api_key': 'ts-key',
+        'update_interval': interval,
+        'adaptive_polling': {'enabled': False},
+        'http': {'pool_maxsize': 64},
+        'weather_api': {'api_key': 'k', 'base_url': f"{url}/v1",
+                        'cache': {'max_ttl': 0}, 'bulk': {'enabled': False}},
+        'devices': [{'name': f"dev{i}", 'type': 'weather', 'city': f"City{i}", 'country_code': 'C'}
+                    for i in range(devices)],
+    }
+    get_client(config)
+    get_weather_cache(config)
+    specs = devices_from_config(config, default_type='weather')
+
+    class CountingSink(Sink):
+        name = 'count'
+
+        def __init__(self):
+            self.readings = 0
+
+        def handle(self, sensor, reading, cfg):
+            self.readings += 1
+
+    counter = CountingSink()
+    pipeline = ReadingPipeline([counter])
+    pipeline.start()
+    registry = MetricsRegistry()
+    baseline = rss_mb()
+    peak = [baseline, 0]
+
+    def sample():
+        while True:
+            peak[0] = max(peak[0], rss_mb())
+            peak[1] = max(peak[1], threading.active_count())
+            time.sleep(0.25)
+
+    threading.Thread(target=sample, daemon=True).start()
+
+    if mode == 'threads':
+        cycle = registry.histogram('bench.cycle_seconds', bounds=FINE_BOUNDS)
+        stop = threading.Event()
+
+        def device(sensor, first):
+            # WeatherSensor.run_simulation's loop
+            cadence = Cadence(sensor.interval, registry=registry)
+            deadline = cadence.start(first)
+            while True:
+                delay = deadline - time.monotonic()
+                if delay > 0 and stop.wait(delay) or stop.is_set():
+                    return
+                cadence.mark_sample()
+                sensor.step()
+                cycle.observe(time.monotonic() - deadline)
+                deadline = cadence.next_deadline()
+
+        sensors = [build_sensor(spec, pipeline) for spec in specs]
+        now = time.monotonic()
+        threads = [threading.Thread(target=device, args=(s, now + interval * i / devices), daemon=True)
+                   for i, s in enumerate(sensors)]
+        for t in threads:
+            t.start()
+        time.sleep(max(0.0, now + duration - time.monotonic()))
+        stop.set()
+        for t in threads:
+            t.join()
+        get_client().close()
+    else:
+        cycle = registry.histogram('async.cycle_seconds', bounds=FINE_BOUNDS)
+        runtime = AsyncRuntime(specs, pipeline=pipeline, http=AsyncHttpClient(pool_maxsize=64, registry=registry),
+                               metrics_file=None, registry=registry)
+        asyncio.run(runtime.run(duration))
+    pipeline.stop()
+
+    expected = sum(int((duration - interval * i / devices) // interval) + 1 for i in range(devices))
+    return {
+        'rss_mb': peak[0] - baseline,
+        'threads': peak[1],
+        'readings': counter.readings,
+        'expected': expected,
+        'p50': cycle.percentile(0.5),
+        'p99': cycle.percentile(0.99),
+    }
+
+
+if len(sys.argv) > 1 and sys.argv[1] == '--child':
+    mode, url = sys.argv[2], sys.argv[3]
+    devices, interval, duration = int(sys.argv[4]), float(sys.argv[5]), float(sys.argv[6])
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    result = child(mode, url, devices, interval, duration)
+    real_stdout.write(json.dumps(result) + '\n')
+    sys.exit(0)
+
+from stub_servers import WeatherApiStub
+
+devices = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+interval = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+duration = float(sys.argv[3]) if len(sys.argv) > 3 else 30
+latency = (float(sys.argv[4]) if len(sys.argv) > 4 else 50) / 1000
+
+print(f"--- {devices} devices every {interval:g} s for {duration:g} s, {latency * 1000:.0f} ms per request ---")
+ok = True
+for mode, label in (('threads', 'Thread per device'), ('async', 'asyncio runtime')):
+    with WeatherApiStub() as stub:
+        stub.latency = latency
+        stub.update_every = 1
+        stub.server.handle_error = lambda request, address: None   # resets when a child exits
+        out = subprocess.run([sys.executable, __file__, '--child', mode, stub.url,
+                              str(devices), str(interval), str(duration)],
+                             capture_output=True, text=True)
+    if out.returncode != 0:
+        print(f"{label:18s}: failed\n{out.stderr}")
+        ok = False
+        continue
+    r = json.loads(out.stdout.strip().splitlines()[-1])
+    if mode == 'async':
+        ok &= r['readings'] >= 0.95 * r['expected']
+    print(f"{label:18s}: {r['rss_mb']:7.1f} MB RSS, {r['threads']:5d} threads, "
+          f"{r['readings']:6d}/{r['expected']} readings, "
+          f"cycle p50 {r['p50'] * 1000:7.1f} ms, p99 {r['p99'] * 1000:7.1f} ms")
+
+print(f"asyncio runtime kept up: {'YES' if ok else 'NO'}")
+sys.exit(0 if ok else 1)
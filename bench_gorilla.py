@@ -0,0 +1,104 @@
+"""
+Offline comparison of the Gorilla block format (gorilla.py) with plain CSV
+and JSON lines for archived per-device history.
+
+Two synthetic series sampled every 20 s with a few ms of scheduler jitter:
+``weather`` holds each value for 15 minutes (WeatherAPI's refresh rate),
+``sensor`` drifts a little on most samples (like data.csv). Each is stored
+as one block per day, and the report shows bytes/point, the size of a year
+per device and decode throughput, and checks the round trip.
+
+    python bench_gorilla.py [days]
+"""
+import csv
+import io
+import json
+import random
+import sys
+import time
+
+from gorilla import Encoder, iter_decode
+
+days = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+interval = 20
+points_per_day = 86400 // interval
+random.seed(42)
+
+
+def series(kind):
+    ts = 1_700_000_000_000
+    co2, temp, humid = 600.0, 22.0, 50.0
+    for i in range(days * points_per_day):
+        ts += interval * 1000 + random.randint(-3, 3)
+        if kind == 'sensor' or i % 45 == 0:
+            co2 = max(400.0, co2 + random.choice((-5, 0, 0, 5)))
+            temp = round(temp + random.choice((-0.1, 0, 0, 0.1)), 1)
+            humid = min(100.0, max(0.0, humid + random.choice((-1, 0, 0, 1))))
+        yield ts, (co2, temp, humid)
+
+
+def csv_bytes(points):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(('epoch', 'co2', 'temperature', 'humidity'))
+    for ts, values in points:
+        writer.writerow((ts / 1000, *values))
+    return buf.getvalue().encode('utf-8')
+
+
+def csv_decode(data):
+    reader = csv.reader(io.StringIO(data.decode('utf-8')))
+    next(reader)
+    return [(round(float(row[0]) * 1000), [float(v) for v in row[1:]]) for row in reader]
+
+
+def json_bytes(points):
+    return ''.join(json.dumps({'epoch': ts / 1000, 'co2': v[0], 'temperature': v[1], 'humidity': v[2]}) + '\n'
+                   for ts, v in points).encode('utf-8')
+
+
+def json_decode(data):
+    rows = [json.loads(line) for line in data.decode('utf-8').splitlines()]
+    return [(round(r['epoch'] * 1000), [r['co2'], r['temperature'], r['humidity']]) for r in rows]
+
+
+def gorilla_blocks(points, decimals):
+    blocks = []
+    for day in range(days):
+        encoder = Encoder(3, decimals)
+        for ts, values in points[day * points_per_day:(day + 1) * points_per_day]:
+            encoder.add(ts, values)
+        blocks.append(encoder.finish())
+    return blocks
+
+
+ok = True
+print(f"--- {days} day(s) x {points_per_day} points/day, 3 columns ---")
+for kind in ('weather', 'sensor'):
+    points = list(series(kind))
+    n = len(points)
+    print(f"\n{kind}:")
+    formats = (
+        ('CSV', lambda: csv_bytes(points), csv_decode),
+        ('JSON lines', lambda: json_bytes(points), json_decode),
+        ('Gorilla exact', lambda: gorilla_blocks(points, None), lambda b: list(iter_decode(b))),
+        ('Gorilla 2 dp', lambda: gorilla_blocks(points, 2), lambda b: list(iter_decode(b))),
+    )
+    for label, encode, decode in formats:
+        started = time.perf_counter()
+        data = encode()
+        encode_time = time.perf_counter() - started
+        size = len(data) if isinstance(data, bytes) else sum(len(block) for block in data)
+        started = time.perf_counter()
+        decoded = decode(data)
+        decode_time = time.perf_counter() - started
+        same = len(decoded) == n and all(
+            ts == ts2 and all(abs(a - b) < 1e-9 for a, b in zip(v, v2))
+            for (ts, v), (ts2, v2) in zip(points, decoded))
+        ok &= same
+        print(f"  {label:14s}: {size / n:6.2f} bytes/point, {size / days * 365 / 1e6:7.2f} MB/year, "
+              f"encode {n / encode_time:9.0f} pts/s, decode {n / decode_time:9.0f} pts/s"
+              f"{'' if same else '  MISMATCH'}")
+
+print(f"\nRound trip exact: {'YES' if ok else 'NO'}")
+sys.exit(0 if ok else 1)
@@ -0,0 +1,113 @@
+"""
+Offline benchmark of the SQLite history store (history_store.py).
+
+1. Sustained inserts: every device reports once per round, interleaved the
+   way the pipeline delivers them, once with a commit per reading and once
+   through HistoryStore's batched transactions.
+2. Range queries: one device with 90 days of 20-second readings among the
+   others, queried for the last hour, day and month.
+3. Compaction: raw readings older than 7 days rolled up into 1-minute and
+   1-hour buckets and moved into compressed archive blocks, then the same
+   device queried at 1-minute and 1-hour resolution from the rollup tiers
+   and at full resolution from the archive.
+
+    python bench_history.py [devices] [rounds]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from history_store import HistoryStore
+
+devices = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+interval = 20   # seconds between readings, as sampled by the sensors
+start_epoch = (time.time() - 90 * 86400) // 3600 * 3600
+
+
+def reading(device, i):
+    return {
+        'device': f"dev-{device}",
+        'co2': 400 + i % 300,
+        'temperature': 20 + (i % 10) / 10,
+        'humidity': 40 + device % 20,
+        'epoch': start_epoch + i * interval,
+    }
+
+
+workdir = tempfile.mkdtemp(prefix='bench_history_')
+total = devices * rounds
+print(f"--- {devices} device(s) x {rounds} round(s) = {total} readings ---")
+
+# 1a. One transaction per reading (what a naive sink would do), on a sample
+sample = min(total, 2000)
+store = HistoryStore(os.path.join(workdir, 'single.db'), batch_size=1)
+started = time.perf_counter()
+for n in range(sample):
+    store.add(reading(n % devices, n // devices))
+single_rate = sample / (time.perf_counter() - started)
+store.close()
+
+# 1b. Batched transactions
+store = HistoryStore(os.path.join(workdir, 'history.db'), batch_size=500, archive=True)
+started = time.perf_counter()
+for i in range(rounds):
+    for d in range(devices):
+        store.add(reading(d, i))
+store.flush()
+batch_rate = total / (time.perf_counter() - started)
+print(f"Commit per reading : {single_rate:9.0f} readings/s")
+print(f"Batched (500)      : {batch_rate:9.0f} readings/s")
+
+# 2. 90 days of 20-second readings for one device
+days = 90
+for i in range(days * 86400 // interval):
+    store.add(reading(devices, i))
+store.flush()
+end = start_epoch + days * 86400
+ok = True
+for label, span in (('hour', 3600), ('day', 86400), ('30 days', 30 * 86400)):
+    runs = 20
+    started = time.perf_counter()
+    for _ in range(runs):
+        rows = store.query(f"dev-{devices}", end - span, end)
+    elapsed = (time.perf_counter() - started) / runs
+    ok &= len(rows) == span // interval
+    print(f"Query last {label:8s}: {len(rows):6d} rows in {elapsed * 1000:7.2f} ms")
+
+db = sqlite3.connect(os.path.join(workdir, 'history.db'))
+plan = ' '.join(row[-1] for row in db.execute(
+    "EXPLAIN QUERY PLAN SELECT ts FROM readings WHERE device_id = 1 AND ts >= 0"))
+print(f"Range query plan   : {plan}")
+
+
+def db_size():
+    db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return os.path.getsize(os.path.join(workdir, 'history.db')) / 1e6
+
+
+# 3. Compaction into 1-minute / 1-hour tiers
+before = db_size()
+started = time.perf_counter()
+expired = store.compact(now=end)
+print(f"Compaction         : {expired} raw/minute rows expired in {time.perf_counter() - started:.2f} s, "
+      f"{before:.1f} MB -> {db_size():.1f} MB")
+for label, span, resolution in (('day @1m', 86400, 60), ('30 days @1h', 30 * 86400, 3600),
+                                ('90 days @1h', days * 86400, 3600)):
+    runs = 20
+    started = time.perf_counter()
+    for _ in range(runs):
+        points = store.series(f"dev-{devices}", end - span, end, resolution)
+    elapsed = (time.perf_counter() - started) / runs
+    ok &= sum(p['count'] for p in points) == span // interval
+    print(f"Series {label:12s}: {len(points):6d} points in {elapsed * 1000:7.2f} ms")
+started = time.perf_counter()
+rows = store.query(f"dev-{devices}", start_epoch, start_epoch + 30 * 86400)
+ok &= len(rows) == 30 * 86400 // interval
+print(f"Archived 30 days   : {len(rows):6d} rows in {(time.perf_counter() - started) * 1000:7.2f} ms")
+db.close()
+store.close()
+print(f"Row counts as expected: {'YES' if ok else 'NO'}")
+sys.exit(0 if ok else 1)
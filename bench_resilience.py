@@ -0,0 +1,88 @@
+"""
+Offline check of the circuit breakers (resilience.py) against the local
+WeatherAPI stub.
+
+During an outage the stub answers slower than the client's read timeout.
+Several worker threads keep polling it, first with breakers that never open
+(every call waits out the timeout), then with the default breaker. The
+report shows how long the workers sat blocked on sockets and how many calls
+failed fast. Then the stub recovers and the circuit must close on its own
+within its backoff.
+
+    python bench_resilience.py [workers] [calls_per_worker] [timeout_ms]
+"""
+import sys
+import threading
+import time
+
+import requests
+
+from http_client import HttpClient
+from metrics import MetricsRegistry
+from rate_limit import RateLimiter
+from resilience import CircuitBreakers, CircuitOpen
+from stub_servers import WeatherApiStub
+
+workers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+calls = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+timeout = (float(sys.argv[3]) if len(sys.argv) > 3 else 300) / 1000
+ok = True
+
+
+def outage(stub, breakers):
+    """Every worker polls the stalled stub; returns (seconds blocked, fast failures)."""
+    client = HttpClient(read_timeout=timeout, rate_limiter=RateLimiter({}, registry=MetricsRegistry()),
+                        breakers=breakers, registry=MetricsRegistry())
+    blocked = [0.0]
+    fast = [0]
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(calls):
+            started = time.perf_counter()
+            try:
+                client.get(f"{stub.url}/v1/current.json?key=k&q=Pune")
+            except CircuitOpen:
+                with lock:
+                    fast[0] += 1
+            except requests.exceptions.RequestException:
+                pass
+            with lock:
+                blocked[0] += time.perf_counter() - started
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return client, blocked[0], fast[0]
+
+
+print(f"--- {workers} workers x {calls} calls, {timeout * 1000:.0f} ms timeout, upstream stalled ---")
+with WeatherApiStub() as stub:
+    stub.latency = timeout * 3
+    stub.server.handle_error = lambda request, address: None   # clients hang up on timeout
+    _, plain_blocked, _ = outage(stub, CircuitBreakers(failure_threshold=10 ** 9, registry=MetricsRegistry()))
+    breakers = CircuitBreakers(base_backoff=1, max_backoff=2, registry=MetricsRegistry())
+    client, breaker_blocked, fast = outage(stub, breakers)
+    print(f"No breaker   : {plain_blocked:6.2f} s blocked on sockets")
+    print(f"With breaker : {breaker_blocked:6.2f} s blocked on sockets, {fast}/{workers * calls} calls failed fast")
+    ok &= breaker_blocked < plain_blocked / 2
+
+    # Upstream recovers: the next trial after the backoff must close the circuit
+    stub.latency = 0
+    breaker = breakers.breaker('127.0.0.1')
+    started = time.perf_counter()
+    while breaker.state != breaker.CLOSED and time.perf_counter() - started < 5:
+        try:
+            client.get(f"{stub.url}/v1/current.json?key=k&q=Pune")
+        except CircuitOpen:
+            time.sleep(0.05)
+    closed = breaker.state == breaker.CLOSED
+    ok &= closed
+    print(f"Recovery     : circuit {'closed' if closed else 'still ' + breaker.state} "
+          f"after {time.perf_counter() - started:.2f} s")
+
+print(f"Breaker failed fast and recovered: {'YES' if ok else 'NO'}")
+sys.exit(0 if ok else 1)
@@ -0,0 +1,70 @@
+"""
+Offline check of batched ThingSpeak uploads against the local stub.
+
+Uploads the same readings once with one GET per reading (the old behaviour)
+and once through ThingSpeakUploader's bulk endpoint, then checks that every
+reading arrived, in order, with its original timestamp, and reports the
+number of requests and the throughput of both.
+
+    python bench_thingspeak.py [devices] [readings_per_device]
+"""
+import sys
+import time
+
+from http_client import HttpClient
+from stub_servers import ThingSpeakStub
+from thingspeak import ThingSpeakUploader, to_update
+
+devices = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+per_device = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+start_epoch = time.time() - devices * per_device
+
+
+def readings_for(device):
+    for i in range(per_device):
+        yield {
+            'device': f"dev-{device}",
+            'co2': 400 + i,
+            'temperature': 20 + (i % 10) / 10,
+            'humidity': 40 + device % 20,
+            'epoch': start_epoch + i * 20,
+        }
+
+
+client = HttpClient()
+total = devices * per_device
+print(f"--- {devices} device(s) x {per_device} reading(s) = {total} readings ---")
+
+# 1. One request per reading
+with ThingSpeakStub() as stub:
+    started = time.perf_counter()
+    for d in range(devices):
+        for r in readings_for(d):
+            client.get(f"{stub.url}/update?api_key=key-{d}&field1={r['co2']}"
+                       f"&field2={r['temperature']}&field3={r['humidity']}")
+    single_time = time.perf_counter() - started
+    single_requests = stub.single_requests
+
+# 2. Buffered bulk uploads (no rate limit against the stub)
+with ThingSpeakStub() as stub:
+    uploader = ThingSpeakUploader(base_url=stub.url, max_batch=500, max_age=3600,
+                                  min_interval=0, client=client)
+    started = time.perf_counter()
+    for d in range(devices):
+        for r in readings_for(d):
+            uploader.add(f"{d}", f"key-{d}", r)
+    uploader.flush(force=True)
+    bulk_time = time.perf_counter() - started
+
+    ok = True
+    for d in range(devices):
+        expected = [to_update(r) for r in readings_for(d)]
+        if stub.entries.get(f"{d}") != expected:
+            ok = False
+            print(f"MISMATCH for channel {d}: got {len(stub.entries.get(f'{d}', []))} entries")
+    bulk_requests = stub.bulk_requests
+
+print(f"Per-reading GET : {single_requests:6d} requests, {total / single_time:9.0f} readings/s")
+print(f"Bulk update     : {bulk_requests:6d} requests, {total / bulk_time:9.0f} readings/s")
+print(f"Ordering and timestamps preserved: {'YES' if ok else 'NO'}")
+sys.exit(0 if ok else 1)
@@ -0,0 +1,80 @@
+"""
+Offline check of multi-location weather fetching against the local
+WeatherAPI stub (each request delayed to stand in for a WAN round trip).
+
+For each fleet size, one cycle in which every location needs fresh data:
+one GET per device in turn (the old behaviour), WeatherFetcher with bulk
+requests, and WeatherFetcher falling back to concurrent single requests
+(plan without bulk access). Every device must get its own location's
+conditions.
+
+    python bench_weather.py [latency_ms] [locations ...]
+"""
+import sys
+import time
+
+from http_client import HttpClient
+from metrics import MetricsRegistry
+from stub_servers import WeatherApiStub
+from weather_cache import WeatherCache, location_key
+from weather_fetcher import WeatherFetcher
+
+latency = (float(sys.argv[1]) if len(sys.argv) > 1 else 30) / 1000
+sizes = [int(n) for n in sys.argv[2:]] or [1, 500]
+client = HttpClient(pool_maxsize=16)
+ok = True
+
+
+def cities(count):
+    return [f"City{i},C{i % 7}" for i in range(count)]
+
+
+def cycle(stub, count, use_bulk):
+    """Cold cache, every device looks up its location once; returns (seconds, correct)."""
+    cache = WeatherCache(client=client, registry=MetricsRegistry())
+    cache.bulk = WeatherFetcher(cache, base_url=f"{stub.url}/v1", use_bulk=use_bulk, concurrency=8,
+                                client=client, registry=MetricsRegistry())
+    devices = []
+    for query in cities(count):
+        key = location_key(*query.split(','))
+        url = f"{stub.url}/v1/current.json?key=k&q={query}&aqi=yes"
+        cache.bulk.register(key, 'k', query, url)
+        devices.append((query, key, url))
+    started = time.perf_counter()
+    results = [(query, cache.fetch(url, key)) for query, key, url in devices]
+    elapsed = time.perf_counter() - started
+    cache.bulk.close()
+    correct = all(status == 200 and data['current'] == stub.conditions(query)['current']
+                  for query, (status, data) in results)
+    return elapsed, correct
+
+
+for count in sizes:
+    print(f"--- {count} location(s), {latency * 1000:.0f} ms per request ---")
+    with WeatherApiStub() as stub:
+        stub.latency = latency
+        started = time.perf_counter()
+        for query in cities(count):
+            client.get(f"{stub.url}/v1/current.json?key=k&q={query}&aqi=yes").json()
+        single_time = time.perf_counter() - started
+        single_requests = stub.requests
+
+    with WeatherApiStub() as stub:
+        stub.latency = latency
+        bulk_time, correct = cycle(stub, count, use_bulk=True)
+        ok &= correct
+        bulk_requests = stub.requests
+
+    with WeatherApiStub() as stub:
+        stub.latency = latency
+        stub.bulk_enabled = False
+        pool_time, correct = cycle(stub, count, use_bulk=True)
+        ok &= correct
+        pool_requests = stub.requests
+
+    print(f"One GET per device   : {single_requests:5d} requests, {single_time * 1000:8.0f} ms per cycle")
+    print(f"Bulk requests        : {bulk_requests:5d} requests, {bulk_time * 1000:8.0f} ms per cycle")
+    print(f"Concurrent GETs (x8) : {pool_requests:5d} requests, {pool_time * 1000:8.0f} ms per cycle")
+
+print(f"Every device got its own location: {'YES' if ok else 'NO'}")
+sys.exit(0 if ok else 1)
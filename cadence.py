@@ -0,0 +1,80 @@
+import time
+
+from metrics import REGISTRY
+
+
+class Cadence:
+    """
+    Drift-free sampling cadence on ``time.monotonic()``.
+
+    Deadlines sit on a fixed grid (start, start + interval, ...) instead of
+    "interval after the work finished", so slow HTTP/SMTP work inside a tick
+    no longer stretches the period. When a tick overruns past one or more
+    grid points, the missed-tick policy decides what happens:
+
+      - ``skip``: drop the missed ticks and wait for the next grid point
+      - ``catch_up``: run overdue ticks back-to-back (at most ``max_catch_up``
+        in a row), then skip whatever is still behind
+
+    Actual sample-to-sample jitter ``|period - interval|`` goes into the
+    shared ``cadence.jitter_seconds`` histogram; dropped ticks are counted in
+    ``cadence.missed_ticks``.
+    """
+
+    POLICIES = ('skip', 'catch_up')
+
+    def __init__(self, interval, policy='skip', max_catch_up=3, registry=REGISTRY):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown missed-tick policy '{policy}' (expected one of {self.POLICIES})")
+        self.interval = float(interval)
+        self.policy = policy
+        self.max_catch_up = max_catch_up
+        self.last_jitter = None
+        self._deadline = None
+        self._last_sample = None
+        self._behind = 0
+        self._jitter = registry.histogram('cadence.jitter_seconds')
+        self._missed = registry.counter('cadence.missed_ticks')
+
+    def start(self, now=None):
+        """Anchor (or re-anchor) the grid; returns the first deadline."""
+        self._deadline = time.monotonic() if now is None else now
+        self._last_sample = None
+        self._behind = 0
+        return self._deadline
+
+    def mark_sample(self, now=None):
+        """Record that a sample was taken now (feeds the jitter histogram)."""
+        now = time.monotonic() if now is None else now
+        if self._last_sample is not None:
+            self.last_jitter = abs((now - self._last_sample) - self.interval)
+            self._jitter.observe(self.last_jitter)
+        self._last_sample = now
+
+    def set_interval(self, interval):
+        """Change the period; the next deadline is one new interval after the current one."""
+        self.interval = float(interval)
+
+    def next_deadline(self, now=None):
+        """Advance to the next deadline according to the missed-tick policy."""
+        now = time.monotonic() if now is None else now
+        if self._deadline is None:
+            self.start(now)
+        deadline = self._deadline + self.interval
+        if deadline <= now:
+            overdue = int((now - deadline) // self.interval) + 1
+            if self.policy == 'catch_up' and self._behind < self.max_catch_up:
+                # Run the oldest overdue tick immediately, keeping the grid
+                self._behind += 1
+            else:
+                deadline += overdue * self.interval
+                self._missed.inc(overdue)
+                self._behind = 0
+        else:
+            self._behind = 0
+        self._deadline = deadline
+        return deadline
+
+    def time_until_next(self):
+        """Advance to the next deadline and return the seconds left until it (>= 0)."""
+        return max(0.0, self.next_deadline() - time.monotonic())
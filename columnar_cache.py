@@ -0,0 +1,210 @@
+import csv
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+
+
+class ColumnarCache:
+    """
+    Memory-mapped columnar copy of a numeric replay CSV (e.g. data.csv).
+
+    The CSV is parsed once into ``<csv>.cols``: a small header followed by
+    one contiguous float64 array per column. While the cache file's recorded
+    source size/mtime still match the CSV it is reused as-is, so every tick
+    reads values straight out of the mapping instead of re-parsing text.
+    All threads that open the same CSV through ``open_cache`` share a single
+    mapping, and separate processes share the same page-cache pages.
+
+    Values are stored as float64 so replayed readings are bit-for-bit the
+    values written in the CSV (no float32 rounding in alerts or uploads).
+    A last line without its newline is left out until the newline arrives
+    (the size change then triggers a rebuild).
+    """
+
+    MAGIC = b'IOTCOL01'
+    # magic, byte order, column count, row count, source size, source mtime, names length
+    HEADER = struct.Struct('<8sBIQQQI')
+    ITEM = array('d').itemsize
+
+    def __init__(self, csv_file, cache_file=None):
+        self.csv_file = csv_file
+        self.cache_file = cache_file or f"{csv_file}.cols"
+        self.columns = []
+        self._lock = threading.Lock()
+        self._mm = None
+        self._views = []
+        self._rows = 0
+        self._data_start = 0
+        self._source_stat = None
+
+    # ------------------------------------------------------------------ public
+
+    def refresh(self):
+        """
+        Make sure the mapping reflects the current CSV.
+
+        Costs one ``stat`` when the source is unchanged. Rebuilds the cache
+        file when the CSV size or mtime no longer match. Raises
+        FileNotFoundError if the CSV is missing and ValueError if it holds
+        non-numeric data.
+        """
+        st = os.stat(self.csv_file)
+        key = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            if key == self._source_stat:
+                return
+            if not self._map_if_fresh(st):
+                self._build(st)
+                if not self._map_if_fresh(st):
+                    raise ValueError(f"Could not map columnar cache {self.cache_file}")
+            self._source_stat = key
+
+    def __len__(self):
+        return self._rows
+
+    def column(self, name_or_index):
+        """Zero-copy float64 view of one column."""
+        if isinstance(name_or_index, str):
+            name_or_index = self.columns.index(name_or_index)
+        return self._views[name_or_index]
+
+    def row(self, index):
+        """Return data row ``index`` as a tuple of floats."""
+        views = self._views  # one read, so a concurrent refresh can't mix mappings
+        rows = len(views[0]) if views else 0
+        if index < 0:
+            index += rows
+        if not 0 <= index < rows:
+            raise IndexError(f"row {index} out of range")
+        return tuple(view[index] for view in views)
+
+    def as_numpy(self):
+        """
+        Return a ``(rows, columns)`` NumPy view over the mapping.
+
+        NumPy is optional; this raises ImportError when it is not installed.
+        """
+        import numpy as np
+        if self._rows == 0:
+            return np.empty((0, len(self.columns)))
+        data = np.frombuffer(self._mm, dtype='f8', count=self._rows * len(self.columns),
+                             offset=self._data_start)
+        return data.reshape(len(self.columns), self._rows).T
+
+    # -------------------------------------------------------------- internal
+
+    def _map_if_fresh(self, st):
+        try:
+            f = open(self.cache_file, 'rb')
+        except OSError:
+            return False
+        with f:
+            raw = f.read(self.HEADER.size)
+            if len(raw) != self.HEADER.size:
+                return False
+            magic, order, ncols, nrows, src_size, src_mtime, names_len = self.HEADER.unpack(raw)
+            if (magic != self.MAGIC or order != _BYTE_ORDER
+                    or src_size != st.st_size or src_mtime != st.st_mtime_ns):
+                return False
+            try:
+                names = json.loads(f.read(names_len).decode('utf-8'))
+            except ValueError:
+                return False
+            data_offset = _align(self.HEADER.size + names_len)
+            if os.fstat(f.fileno()).st_size < data_offset + ncols * nrows * self.ITEM:
+                return False
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if nrows else None
+
+        views = []
+        if mm is not None:
+            buf = memoryview(mm)
+            for c in range(ncols):
+                start = data_offset + c * nrows * self.ITEM
+                views.append(buf[start:start + nrows * self.ITEM].cast('d'))
+        else:
+            views = [memoryview(array('d')) for _ in range(ncols)]
+
+        # Readers may still hold views into the previous mapping, so it is
+        # dropped rather than closed and goes away with its last view.
+        self._mm = mm
+        self._views = views
+        self.columns = names
+        self._rows = nrows
+        self._data_start = data_offset
+        return True
+
+    def _build(self, st):
+        """Parse the CSV once and write the columnar file atomically."""
+        with open(self.csv_file, 'rb') as f:
+            reader = csv.reader(_complete_lines(f, st.st_size))
+            names = next(reader, [])
+            columns = [array('d') for _ in names]
+            for line_no, row in enumerate(reader, start=2):
+                if not row or not any(cell.strip() for cell in row):
+                    continue
+                if len(row) < len(columns):
+                    raise ValueError(f"{self.csv_file}:{line_no}: expected {len(columns)} columns")
+                try:
+                    for col, cell in zip(columns, row):
+                        col.append(float(cell))
+                except ValueError:
+                    raise ValueError(f"{self.csv_file}:{line_no}: non-numeric value in {row}") from None
+
+        names_raw = json.dumps(names).encode('utf-8')
+        nrows = len(columns[0]) if columns else 0
+        header = self.HEADER.pack(self.MAGIC, _BYTE_ORDER, len(columns), nrows,
+                                  st.st_size, st.st_mtime_ns, len(names_raw))
+        padding = _align(len(header) + len(names_raw)) - len(header) - len(names_raw)
+
+        tmp = f"{self.cache_file}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as out:
+            out.write(header)
+            out.write(names_raw)
+            out.write(b'\0' * padding)
+            for col in columns:
+                col.tofile(out)
+        os.replace(tmp, self.cache_file)
+        print(f"[ColumnarCache]   > Built {self.cache_file} ({nrows} rows x {len(columns)} columns)")
+
+
+_BYTE_ORDER = 0 if sys.byteorder == 'little' else 1
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _complete_lines(f, size):
+    """
+    Decoded lines of ``f`` up to ``size`` bytes, stopping before a last line
+    that has no newline yet (a row still being appended).
+    """
+    pos = 0
+    for line in f:
+        pos += len(line)
+        if pos > size or not line.endswith(b'\n'):
+            return
+        yield line.decode('utf-8')
+
+
+def _align(n, to=8):
+    return (n + to - 1) // to * to
+
+
+def open_cache(csv_file):
+    """
+    Return the shared, refreshed ColumnarCache for ``csv_file``.
+
+    Every caller in the process gets the same instance (and so the same
+    mapping) for a given path.
+    """
+    key = os.path.abspath(csv_file)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = ColumnarCache(csv_file)
+    cache.refresh()
+    return cache
@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+
+from metrics import REGISTRY
+
+
+class FrozenDict(dict):
+    """A dict that refuses changes, so one parsed config can be shared by every thread."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('config snapshots are read-only')
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _readonly
+
+
+def freeze(value):
+    """Recursively turn parsed JSON into FrozenDicts and tuples."""
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def changed_keys(old, new, prefix=''):
+    """Dotted paths of every key that was added, removed or changed between two configs."""
+    old = old or {}
+    new = new or {}
+    changed = []
+    for key in sorted(set(old) | set(new), key=str):
+        path = f"{prefix}{key}"
+        a, b = old.get(key), new.get(key)
+        if isinstance(a, dict) and isinstance(b, dict):
+            changed.extend(changed_keys(a, b, path + '.'))
+        elif a != b or (key in old) != (key in new):
+            changed.append(path)
+    return changed
+
+
+def validate_config(config):
+    """Raise ValueError when config.json has values the system can't run with."""
+    if not isinstance(config, dict):
+        raise ValueError('config must be a JSON object')
+    interval = config.get('update_interval', 20)
+    if not isinstance(interval, (int, float)) or isinstance(interval, bool) or interval <= 0:
+        raise ValueError(f"update_interval must be a positive number, got {interval!r}")
+    for key in ('temperature_limit', 'humidity_limit', 'co2_limit'):
+        value = config.get(key)
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool)):
+            raise ValueError(f"{key} must be a number, got {value!r}")
+    for section in ('weather_api', 'email', 'thingspeak', 'pipeline', 'alerts', 'http', 'orchestrator'):
+        if config.get(section) is not None and not isinstance(config[section], dict):
+            raise ValueError(f"'{section}' must be an object")
+    devices = config.get('devices')
+    if devices is not None:
+        if not isinstance(devices, (list, tuple)) or not all(isinstance(d, dict) for d in devices):
+            raise ValueError("'devices' must be a list of objects")
+    email = config.get('email') or {}
+    if email.get('enabled') and not email.get('smtp_server'):
+        raise ValueError('email.smtp_server is required when email alerts are enabled')
+    # Rules carry their own, more specific, checks
+    from rules import RuleSet
+    RuleSet.from_config(config)
+
+
+class ConfigService:
+    """
+    Parsed, validated, immutable snapshot of config.json shared by everyone.
+
+    ``get()`` returns the current snapshot without touching the file; at
+    most every ``check_interval`` seconds it stats the file and only re-reads
+    it when the mtime, size or inode changed. A file that fails to parse or
+    validate is reported and the previous snapshot stays in use.
+    Subscribers are called as ``callback(snapshot, changed_keys)`` after
+    every successful reload that changed something. ``start()`` adds a
+    watcher thread so subscribers hear about edits even when nobody calls
+    ``get()``.
+    """
+
+    def __init__(self, path='config.json', check_interval=1.0, validator=validate_config, registry=REGISTRY):
+        self.path = path
+        self.check_interval = check_interval
+        self.validator = validator
+        self._snapshot = None
+        self._signature = None
+        self._next_check = 0.0
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.version = 0
+        self.reloads = registry.counter('config.reloads')
+        self.errors = registry.counter('config.reload_errors')
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def get(self):
+        """The current snapshot (None until config.json has loaded successfully once)."""
+        if time.monotonic() >= self._next_check:
+            self.check()
+        return self._snapshot
+
+    def check(self):
+        """Reload if the file changed. Returns the list of changed keys (empty if none)."""
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval
+            signature = self._stat()
+            if signature == self._signature:
+                return []
+            self._signature = signature
+            if signature is None:
+                if self._snapshot is not None:
+                    print(f"[Config]   > {self.path} disappeared, keeping the last good config")
+                return []
+            try:
+                with open(self.path, 'r') as f:
+                    parsed = json.load(f)
+                if self.validator:
+                    self.validator(parsed)
+            except (OSError, ValueError, TypeError) as e:
+                self.errors.inc()
+                print(f"[Config]   > Ignoring invalid {self.path}: {e}")
+                return []
+            old, snapshot = self._snapshot, freeze(parsed)
+            changed = changed_keys(old, snapshot)
+            if not changed:
+                # Same content (e.g. touched): keep the snapshot everyone already holds
+                return []
+            self._snapshot = snapshot
+            self.version += 1
+            self.reloads.inc()
+            subscribers = list(self._subscribers)
+        if old is not None:
+            print(f"[Config]   > Reloaded {self.path}: {', '.join(changed)}")
+        for callback in subscribers:
+            try:
+                callback(snapshot, changed)
+            except Exception as e:
+                print(f"[Config]   > Subscriber failed: {e}")
+        return changed
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='config-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            self.check()
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_config_service(path='config.json'):
+    """Process-wide ConfigService for a config file."""
+    with _services_lock:
+        service = _services.get(path)
+        if service is None:
+            service = _services[path] = ConfigService(path)
+        return service
+
+
+def get_config(path='config.json'):
+    """Shortcut for ``get_config_service(path).get()``."""
+    return get_config_service(path).get()
@@ -0,0 +1,6 @@
+"""
+pytest setup: the modules live at the top level, the tests in tests/.
+
+test_runner.py is the interactive CSV simulation, not a test module.
+"""
+collect_ignore = ['test_runner.py']
@@ -0,0 +1,233 @@
+import csv
+import hashlib
+import os
+import struct
+import threading
+from array import array
+
+
+class CsvRowIndex:
+    """
+    Byte-offset index of the data rows in a CSV file.
+
+    The index is built once, persisted next to the CSV (``<csv>.idx``) and
+    lets callers seek straight to row N instead of parsing the whole file.
+    When the CSV grows, only the new bytes are scanned and the new offsets
+    are appended to the index file. When the CSV is rewritten (shrunk,
+    replaced, or the first 4 KiB or last indexed row changed) the index is
+    rebuilt. Edits elsewhere are not fingerprinted; instead ``row()`` checks
+    that each offset it seeks to still starts a line and rebuilds the index
+    when it doesn't, so an in-place edit that moves row boundaries is
+    caught on the first read that crosses it.
+
+    Rows are assumed to be one record per physical line, which holds for the
+    numeric sensor traces this project replays. Blank lines are skipped, and
+    a last line still being written (no newline yet) is not a row until its
+    newline arrives.
+    """
+
+    MAGIC = b'CSVIDX01'
+    # magic, inode, indexed size, header end, row count, head digest, tail digest
+    HEADER = struct.Struct('<8sQQQQ16s16s')
+    CHUNK_SIZE = 1024 * 1024
+    FINGERPRINT_BYTES = 4096
+
+    def __init__(self, csv_file, index_file=None):
+        self.csv_file = csv_file
+        self.index_file = index_file or f"{csv_file}.idx"
+        self._lock = threading.Lock()
+        self._offsets = array('q')  # start offset of every complete data row
+        self._ino = 0
+        self._indexed_size = 0      # bytes covered by the index (ends on a newline)
+        self._header_end = 0        # offset of the first byte after the header line
+        self._head_digest = b''
+        self._tail_digest = b''
+        self._last_stat = None
+        self._load()
+
+    # ------------------------------------------------------------------ public
+
+    def refresh(self):
+        """
+        Bring the index up to date with the CSV file.
+
+        Costs a single ``stat`` when nothing changed. Raises FileNotFoundError
+        if the CSV does not exist.
+        """
+        st = os.stat(self.csv_file)
+        key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            if key == self._last_stat:
+                return
+            if self._can_extend(st):
+                if st.st_size > self._indexed_size:
+                    self._extend(st)
+            else:
+                self._rebuild(st)
+            self._last_stat = key
+
+    def __len__(self):
+        with self._lock:
+            return len(self._offsets)
+
+    def row(self, index):
+        """Return data row ``index`` (0-based, header excluded) as a list of strings."""
+        for attempt in range(2):
+            start = self._row_start(index)
+            with open(self.csv_file, 'rb') as f:
+                f.seek(start - 1)
+                boundary = f.read(1)
+                line = f.readline()
+            if boundary == b'\n' or attempt:
+                break
+            # The byte before the row is not a newline: the file was edited in
+            # place without touching the fingerprinted ranges
+            self._force_rebuild()
+        return next(csv.reader([line.decode('utf-8')]), [])
+
+    def _row_start(self, index):
+        with self._lock:
+            if index < 0:
+                index += len(self._offsets)
+            if 0 <= index < len(self._offsets):
+                return self._offsets[index]
+            raise IndexError(f"row {index} out of range")
+
+    def _force_rebuild(self):
+        st = os.stat(self.csv_file)
+        with self._lock:
+            self._rebuild(st)
+            self._last_stat = (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+    # ----------------------------------------------------------- persistence
+
+    def _load(self):
+        """Load a previously persisted index, if one exists and is readable."""
+        try:
+            with open(self.index_file, 'rb') as f:
+                raw = f.read(self.HEADER.size)
+                if len(raw) != self.HEADER.size:
+                    return
+                magic, ino, indexed, header_end, count, head, tail = self.HEADER.unpack(raw)
+                if magic != self.MAGIC:
+                    return
+                offsets = array('q')
+                offsets.fromfile(f, count)
+        except (OSError, EOFError, struct.error):
+            return
+
+        self._offsets = offsets
+        self._ino = ino
+        self._indexed_size = indexed
+        self._header_end = header_end
+        self._head_digest = head
+        self._tail_digest = tail
+
+    def _header_bytes(self):
+        return self.HEADER.pack(
+            self.MAGIC, self._ino, self._indexed_size, self._header_end,
+            len(self._offsets), self._head_digest, self._tail_digest,
+        )
+
+    def _save_full(self):
+        tmp = f"{self.index_file}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(self._header_bytes())
+                self._offsets.tofile(f)
+            os.replace(tmp, self.index_file)
+        except OSError as e:
+            print(f"[CsvRowIndex]   > Could not persist index {self.index_file}: {e}")
+
+    def _save_appended(self, first_new):
+        """Append offsets[first_new:] to the index file and rewrite its header in place."""
+        try:
+            with open(self.index_file, 'r+b') as f:
+                f.seek(self.HEADER.size + first_new * self._offsets.itemsize)
+                self._offsets[first_new:].tofile(f)
+                f.seek(0)
+                f.write(self._header_bytes())
+        except OSError:
+            self._save_full()
+
+    # -------------------------------------------------------------- indexing
+
+    def _digest(self, f, start, end):
+        f.seek(start)
+        return hashlib.blake2b(f.read(max(0, end - start)), digest_size=16).digest()
+
+    def _tail_range(self):
+        """Byte range of the last indexed row, used to detect in-place rewrites."""
+        if self._offsets:
+            return self._offsets[-1], self._indexed_size
+        return 0, self._header_end
+
+    def _can_extend(self, st):
+        if not self._head_digest or st.st_ino != self._ino or st.st_size < self._indexed_size:
+            return False
+        try:
+            with open(self.csv_file, 'rb') as f:
+                head_end = min(self.FINGERPRINT_BYTES, self._indexed_size)
+                if self._digest(f, 0, head_end) != self._head_digest:
+                    return False
+                return self._digest(f, *self._tail_range()) == self._tail_digest
+        except OSError:
+            return False
+
+    def _rebuild(self, st):
+        self._offsets = array('q')
+        self._ino = st.st_ino
+        self._indexed_size = 0
+        self._header_end = 0
+        self._scan(st.st_size)
+        self._save_full()
+
+    def _extend(self, st):
+        first_new = len(self._offsets)
+        previous_size = self._indexed_size
+        self._scan(st.st_size)
+        if self._indexed_size != previous_size:
+            if os.path.exists(self.index_file):
+                self._save_appended(first_new)
+            else:
+                self._save_full()
+
+    def _scan(self, size):
+        """Index complete lines between the current indexed size and ``size``."""
+        with open(self.csv_file, 'rb') as f:
+            pos = self._indexed_size
+            f.seek(pos)
+            pending = b''
+            line_start = pos
+            while pos < size:
+                chunk = f.read(min(self.CHUNK_SIZE, size - pos))
+                if not chunk:
+                    break
+                buf = pending + chunk
+                base = pos - len(pending)
+                cursor = 0
+                while True:
+                    nl = buf.find(b'\n', cursor)
+                    if nl < 0:
+                        break
+                    self._add_line(base + cursor, buf[cursor:nl])
+                    cursor = nl + 1
+                    line_start = base + cursor
+                pending = buf[cursor:]
+                pos += len(chunk)
+
+            self._indexed_size = line_start
+            head_end = min(self.FINGERPRINT_BYTES, self._indexed_size)
+            self._head_digest = self._digest(f, 0, head_end)
+            self._tail_digest = self._digest(f, *self._tail_range())
+
+    def _add_line(self, start, line):
+        if start == 0 and self._header_end == 0:
+            self._header_end = len(line) + 1
+            return
+        if line.strip():
+            self._offsets.append(start)
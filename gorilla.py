@@ -0,0 +1,224 @@
+"""
+Compressed blocks for archived sensor series, after Facebook's Gorilla
+(Pelkonen et al., VLDB 2015).
+
+Timestamps (epoch milliseconds) are stored as delta-of-deltas: a steady
+20 s cadence costs one bit per point, a few ms of scheduler jitter nine.
+Each value is XORed with the previous value of its column; an unchanged
+value costs one bit, a small change only its meaningful bits. With
+``decimals`` set, values are first scaled to integers (23.4 -> 2340.0 at
+two decimals), whose float representations share far more bits.
+
+Block layout (little endian header, then a big-endian bit stream)::
+
+    magic     4s  b'GRL1'
+    columns   B   values per point
+    decimals  B   255 = exact floats
+    reserved  H
+    first_ts  q   timestamp of the first point
+    count     I   points in the block
+    bits          per point: timestamp delta-of-delta, then one XOR code per column
+
+Missing values (None) are stored as NaN and decoded as None.
+"""
+import math
+import struct
+
+MAGIC = b'GRL1'
+HEADER = struct.Struct('<4sBBHqI')
+EXACT = 255
+_FLOAT = struct.Struct('>d')
+_BITS = struct.Struct('>Q')
+_NAN_BITS = _BITS.unpack(_FLOAT.pack(math.nan))[0]
+
+# (prefix, prefix bits, value bits) for delta-of-deltas in [-2^(n-1), 2^(n-1))
+_DOD_CODES = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12))
+
+
+class BitWriter:
+    def __init__(self):
+        self._buf = bytearray()
+        self._acc = 0
+        self._n = 0
+
+    def write(self, value, bits):
+        self._acc = (self._acc << bits) | (value & ((1 << bits) - 1))
+        self._n += bits
+        if self._n >= 64:
+            extra = self._n & 7
+            self._buf += (self._acc >> extra).to_bytes(self._n >> 3, 'big')
+            self._acc &= (1 << extra) - 1
+            self._n = extra
+
+    def getvalue(self):
+        pad = -self._n & 7
+        return bytes(self._buf) + (self._acc << pad).to_bytes((self._n + pad) >> 3, 'big')
+
+
+class BitReader:
+    def __init__(self, data, offset=0):
+        self._data = data
+        self._pos = offset * 8
+
+    def bit(self):
+        pos = self._pos
+        self._pos = pos + 1
+        return (self._data[pos >> 3] >> (7 - (pos & 7))) & 1
+
+    def read(self, bits):
+        pos = self._pos
+        end = (pos + bits + 7) >> 3
+        chunk = int.from_bytes(self._data[pos >> 3:end], 'big')
+        self._pos = pos + bits
+        return (chunk >> ((end << 3) - pos - bits)) & ((1 << bits) - 1)
+
+
+class Encoder:
+    """
+    Builds one block point by point: ``add(ts, values)`` then ``finish()``.
+
+    ``ts`` is an integer (epoch milliseconds in the history store) and must
+    not decrease; ``values`` is a sequence of ``columns`` floats or None.
+    """
+
+    def __init__(self, columns=1, decimals=None):
+        self.columns = columns
+        self.decimals = decimals
+        self._scale = None if decimals is None else 10 ** decimals
+        self._bits = BitWriter()
+        self.count = 0
+        self.first_ts = self.last_ts = 0
+        self._delta = 0
+        self._prev = [0] * columns
+        self._window = [None] * columns   # (leading, trailing) zeros of the last XOR
+
+    def __len__(self):
+        return self.count
+
+    def _value_bits(self, value):
+        if value is None:
+            return _NAN_BITS
+        if self._scale is not None and math.isfinite(value):
+            value = round(value * self._scale)
+        return _BITS.unpack(_FLOAT.pack(value))[0]
+
+    def add(self, ts, values):
+        w = self._bits
+        if self.count == 0:
+            self.first_ts = ts
+        else:
+            delta = ts - self.last_ts
+            dod = delta - self._delta
+            self._delta = delta
+            if dod == 0:
+                w.write(0, 1)
+            else:
+                for prefix, prefix_bits, bits in _DOD_CODES:
+                    if -(1 << (bits - 1)) <= dod < (1 << (bits - 1)):
+                        w.write(prefix, prefix_bits)
+                        w.write(dod, bits)
+                        break
+                else:
+                    w.write(0b1111, 4)
+                    w.write(dod, 64)
+        self.last_ts = ts
+        for i in range(self.columns):
+            bits = self._value_bits(values[i])
+            xor = bits ^ self._prev[i]
+            self._prev[i] = bits
+            if xor == 0:
+                w.write(0, 1)
+                continue
+            leading = min(64 - xor.bit_length(), 31)
+            trailing = (xor & -xor).bit_length() - 1
+            window = self._window[i]
+            if window is not None and leading >= window[0] and trailing >= window[1]:
+                # Fits the previous meaningful-bit window: no need to repeat it
+                w.write(0b10, 2)
+                w.write(xor >> window[1], 64 - window[0] - window[1])
+            else:
+                significant = 64 - leading - trailing
+                w.write(0b11, 2)
+                w.write(leading, 5)
+                w.write(significant - 1, 6)
+                w.write(xor >> trailing, significant)
+                self._window[i] = (leading, trailing)
+        self.count += 1
+
+    def finish(self):
+        """The finished block as bytes."""
+        decimals = EXACT if self.decimals is None else self.decimals
+        return HEADER.pack(MAGIC, self.columns, decimals, 0, self.first_ts, self.count) + self._bits.getvalue()
+
+
+def block_info(block):
+    """``(columns, decimals, first_ts, count)`` of a block; decimals None for exact floats."""
+    magic, columns, decimals, _, first_ts, count = HEADER.unpack_from(block)
+    if magic != MAGIC:
+        raise ValueError('not a Gorilla block')
+    return columns, None if decimals == EXACT else decimals, first_ts, count
+
+
+def decode_block(block):
+    """Yield ``(ts, values)`` of every point in a block, lazily."""
+    columns, decimals, ts, count = block_info(block)
+    scale = None if decimals is None else 10 ** decimals
+    r = BitReader(block, HEADER.size)
+    bit, read = r.bit, r.read
+    delta = 0
+    prev = [0] * columns
+    window = [(0, 0)] * columns
+    for n in range(count):
+        if n:
+            if bit():
+                if not bit():
+                    dod = read(7)
+                    dod -= (dod >> 6) << 7
+                elif not bit():
+                    dod = read(9)
+                    dod -= (dod >> 8) << 9
+                elif not bit():
+                    dod = read(12)
+                    dod -= (dod >> 11) << 12
+                else:
+                    dod = read(64)
+                    dod -= (dod >> 63) << 64
+                delta += dod
+            ts += delta
+        values = []
+        for i in range(columns):
+            if bit():
+                if bit():
+                    leading = read(5)
+                    significant = read(6) + 1
+                    trailing = 64 - leading - significant
+                    window[i] = (leading, trailing)
+                else:
+                    leading, trailing = window[i]
+                    significant = 64 - leading - trailing
+                prev[i] ^= read(significant) << trailing
+            value = _FLOAT.unpack(_BITS.pack(prev[i]))[0]
+            if value != value:
+                value = None
+            elif scale is not None:
+                value /= scale
+            values.append(value)
+        yield ts, values
+
+
+def iter_encode(points, columns=1, decimals=None, block_size=4096):
+    """Encode ``(ts, values)`` points into blocks of up to ``block_size`` points, yielding each block."""
+    encoder = Encoder(columns, decimals)
+    for ts, values in points:
+        encoder.add(ts, values)
+        if len(encoder) >= block_size:
+            yield encoder.finish()
+            encoder = Encoder(columns, decimals)
+    if len(encoder):
+        yield encoder.finish()
+
+
+def iter_decode(blocks):
+    """Yield ``(ts, values)`` from a sequence of blocks, in order."""
+    for block in blocks:
+        yield from decode_block(block)
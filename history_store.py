@@ -0,0 +1,481 @@
+import itertools
+import sqlite3
+import threading
+import time
+
+import gorilla
+from metrics import REGISTRY
+
+COLUMNS = ('co2', 'temperature', 'humidity')
+
+# name, table, bucket size in seconds (0 = one row per reading)
+TIERS = (
+    ('raw', 'readings', 0),
+    ('1m', 'rollup_1m', 60),
+    ('1h', 'rollup_1h', 3600),
+)
+
+# Compaction commits after this many devices, so flushes aren't held up for long
+DEVICES_PER_TRANSACTION = 100
+
+DAY = 86400
+END_OF_TIME = 2 ** 62
+
+
+def _aggregates(table):
+    """Select list merging rows of ``table`` into one rollup row."""
+    if table == 'readings':
+        parts = ['count(*)']
+        for c in COLUMNS:
+            parts += [f'min({c})', f'max({c})', f'total({c})', f'count({c})']
+    else:
+        parts = ['sum(count)']
+        for c in COLUMNS:
+            parts += [f'min({c}_min)', f'max({c}_max)', f'total({c}_sum)', f'sum({c}_count)']
+    return ', '.join(parts)
+
+
+def _rollup_table(table):
+    columns = ''.join(f'{c}_min REAL, {c}_max REAL, {c}_sum REAL, {c}_count INTEGER, ' for c in COLUMNS)
+    return (f'CREATE TABLE IF NOT EXISTS {table} (device_id INTEGER NOT NULL, ts INTEGER NOT NULL, '
+            f'count INTEGER NOT NULL, {columns}PRIMARY KEY (device_id, ts)) WITHOUT ROWID;')
+
+
+class HistoryStore:
+    """
+    Persistent reading history in SQLite (WAL mode).
+
+    Rows live in ``readings(device_id, ts, co2, temperature, humidity)``
+    keyed by ``(device_id, ts)`` in a WITHOUT ROWID table, so one device's
+    time range is a single contiguous B-tree scan. Device names are stored
+    once in ``devices``; ``ts`` is epoch milliseconds.
+
+    ``add()`` only buffers; rows are written in one transaction per batch
+    (``batch_size`` rows, or every ``flush_interval`` seconds from a
+    background thread). Readers use their own connection, which WAL lets run
+    alongside the writer.
+
+    Every ``compact_interval`` seconds the same thread rolls completed
+    minutes up into ``rollup_1m`` and completed hours into ``rollup_1h``
+    (count and min/max/sum per column), then drops raw rows older than
+    ``raw_retention`` and minute rows older than ``minute_retention``
+    seconds. ``hour_retention`` None keeps hourly rows forever. ``series()``
+    reads from the coarsest tier that still meets the requested resolution.
+
+    With ``archive`` on (off by default), expired raw readings aren't
+    dropped but moved, one block per device and day, into ``archive`` as
+    Gorilla-compressed blobs (see gorilla.py; values rounded to
+    ``archive_decimals``), where ``query()`` still finds them. Reading
+    archived days means decoding their blocks, so long ranges are better
+    served from the rollups by ``series()``. A reading that arrives after
+    its day was archived is merged into that day's block.
+    """
+
+    def __init__(self, path='history.db', batch_size=500, flush_interval=1.0,
+                 raw_retention=7 * DAY, minute_retention=30 * DAY, hour_retention=None,
+                 compact_interval=300, settle=120, archive=False, archive_decimals=2, registry=REGISTRY):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = {'raw': raw_retention, '1m': minute_retention, '1h': hour_retention}
+        self.compact_interval = compact_interval
+        # Readings may arrive this many seconds late; younger buckets aren't rolled up yet
+        self.settle = settle
+        self.archive = archive
+        self.archive_decimals = archive_decimals
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._device_ids = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._db = self._connect()
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS devices (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS readings (
+                device_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                co2 REAL,
+                temperature REAL,
+                humidity REAL,
+                PRIMARY KEY (device_id, ts)) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS watermarks (
+                tier TEXT PRIMARY KEY,
+                ts INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS archive (
+                device_id INTEGER NOT NULL,
+                start_ts INTEGER NOT NULL,
+                end_ts INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                data BLOB NOT NULL);
+            CREATE INDEX IF NOT EXISTS archive_range ON archive (device_id, end_ts);
+        ''' + _rollup_table('rollup_1m') + _rollup_table('rollup_1h'))
+        self._device_ids = dict(self._db.execute('SELECT name, id FROM devices').fetchall())
+        self._reader = self._connect()
+        self.rows_written = registry.counter('history.rows_written')
+        self.batch_seconds = registry.histogram('history.batch_seconds')
+        self.pending_rows = registry.gauge('history.pending')
+        self.rows_expired = registry.counter('history.rows_expired')
+        self.compact_seconds = registry.histogram('history.compact_seconds')
+        self.rows_archived = registry.counter('history.rows_archived')
+        self.archive_bytes = registry.counter('history.archive_bytes')
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # Only takes effect on a new database; lets compaction give space back
+        db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    @classmethod
+    def from_config(cls, config):
+        opts = (config or {}).get('history') or {}
+
+        def days(key, default):
+            value = opts.get(key, default)
+            return None if value is None else value * DAY
+
+        return cls(
+            path=opts.get('db', 'history.db'),
+            batch_size=opts.get('batch_size', 500),
+            flush_interval=opts.get('flush_interval', 1.0),
+            raw_retention=days('raw_days', 7),
+            minute_retention=days('minute_days', 30),
+            hour_retention=days('hour_days', None),
+            compact_interval=opts.get('compact_interval', 300),
+            archive=opts.get('archive', False),
+            archive_decimals=opts.get('archive_decimals', 2),
+        )
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.flush()
+        with self._write_lock:
+            self._db.close()
+        with self._read_lock:
+            self._reader.close()
+
+    def _run(self):
+        next_compact = time.monotonic() + (self.compact_interval or 0)
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                if self.compact_interval and time.monotonic() >= next_compact:
+                    next_compact = time.monotonic() + self.compact_interval
+                    self.compact()
+            except sqlite3.Error as e:
+                print(f"[history]   > Write failed: {e}")
+
+    def add(self, reading):
+        """Queue one reading dict (``device``, ``epoch`` and the metric columns)."""
+        row = (reading.get('device') or 'default', int(reading.get('epoch', time.time()) * 1000),
+               *(reading.get(c) for c in COLUMNS))
+        with self._pending_lock:
+            self._pending.append(row)
+            full = len(self._pending) >= self.batch_size
+            self.pending_rows.set(len(self._pending))
+        if full:
+            self.flush()
+
+    def _device_id(self, name):
+        device_id = self._device_ids.get(name)
+        if device_id is None:
+            self._db.execute('INSERT OR IGNORE INTO devices (name) VALUES (?)', (name,))
+            device_id = self._db.execute('SELECT id FROM devices WHERE name = ?', (name,)).fetchone()[0]
+            self._device_ids[name] = device_id
+        return device_id
+
+    def flush(self):
+        """Write everything buffered in one transaction. Returns the number of rows."""
+        with self._pending_lock:
+            rows, self._pending = self._pending, []
+            self.pending_rows.set(0)
+        if not rows:
+            return 0
+        started = time.monotonic()
+        with self._write_lock:
+            self._db.execute('BEGIN')
+            try:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO readings (device_id, ts, co2, temperature, humidity) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(self._device_id(device), *rest) for device, *rest in rows])
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        self.batch_seconds.observe(time.monotonic() - started)
+        self.rows_written.inc(len(rows))
+        return len(rows)
+
+    # Compaction
+
+    def _watermark(self, db, tier):
+        """Everything before this ts (ms) has been rolled up into ``tier``; None before the first run."""
+        row = db.execute('SELECT ts FROM watermarks WHERE tier = ?', (tier,)).fetchone()
+        return row[0] if row else None
+
+    def _device_groups(self):
+        with self._write_lock:
+            device_ids = [row[0] for row in self._db.execute('SELECT id FROM devices')]
+        for i in range(0, len(device_ids), DEVICES_PER_TRANSACTION):
+            yield device_ids[i:i + DEVICES_PER_TRANSACTION]
+
+    def _in_transaction(self, sql, params):
+        """Run ``sql`` for every parameter tuple in one transaction; returns the rows changed."""
+        with self._write_lock:
+            self._db.execute('BEGIN')
+            try:
+                changed = self._db.executemany(sql, params).rowcount
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return changed
+
+    def _roll_up(self, tier, source, step, until):
+        """Aggregate ``source`` rows before ``until`` (ms) into ``tier`` and advance its watermark."""
+        step *= 1000
+        until -= until % step
+        with self._write_lock:
+            done = self._watermark(self._db, tier) or 0
+        if done >= until:
+            return
+        # Each device's range is one primary key scan. Re-running after a crash
+        # rewrites the same complete buckets, so the watermark moves last.
+        for group in self._device_groups():
+            self._in_transaction(
+                f'INSERT OR REPLACE INTO rollup_{tier} SELECT device_id, ts - ts % {step}, '
+                f'{_aggregates(source)} FROM {source} WHERE device_id = ? AND ts >= ? AND ts < ? GROUP BY 2',
+                [(d, done, until) for d in group])
+        with self._write_lock:
+            self._db.execute('INSERT OR REPLACE INTO watermarks (tier, ts) VALUES (?, ?)', (tier, until))
+
+    def _expire(self, table, cutoff, rolled_into):
+        """Delete rows of ``table`` older than ``cutoff`` (ms) that are already rolled up."""
+        if rolled_into is not None:
+            with self._write_lock:
+                watermark = self._watermark(self._db, rolled_into)
+            if watermark is None:
+                return 0
+            cutoff = min(cutoff, watermark)
+        return sum(self._in_transaction(f'DELETE FROM {table} WHERE device_id = ? AND ts < ?',
+                                        [(d, cutoff) for d in group])
+                   for group in self._device_groups())
+
+    def _archive(self, cutoff):
+        """Move raw rows from whole days before ``cutoff`` (ms) into compressed archive blocks."""
+        with self._write_lock:
+            watermark = self._watermark(self._db, '1m')
+        if watermark is None:
+            return 0
+        cutoff = min(cutoff, watermark)
+        cutoff -= cutoff % (DAY * 1000)
+        moved = 0
+        for group in self._device_groups():
+            for device_id in group:
+                with self._write_lock:
+                    rows = self._db.execute(
+                        'SELECT ts, co2, temperature, humidity FROM readings '
+                        'WHERE device_id = ? AND ts < ? ORDER BY ts', (device_id, cutoff)).fetchall()
+                if not rows:
+                    continue
+                days = [list(day) for _, day in itertools.groupby(rows, key=lambda row: row[0] // (DAY * 1000))]
+                # Encode without holding up flushes; days that already have a
+                # block (late readings) are merged with it under the lock
+                blocks = {day[0][0]: self._encode(day) for day in days}
+                with self._write_lock:
+                    self._db.execute('BEGIN')
+                    try:
+                        for day in days:
+                            self._store_block(device_id, day, blocks[day[0][0]])
+                        # Only the rows that were encoded; a reading that arrived or
+                        # changed since the SELECT stays for the next run
+                        moved += self._db.executemany(
+                            'DELETE FROM readings WHERE device_id = ? AND ts = ? '
+                            'AND co2 IS ? AND temperature IS ? AND humidity IS ?',
+                            [(device_id, *row) for row in rows]).rowcount
+                        self._db.execute('COMMIT')
+                    except Exception:
+                        self._db.execute('ROLLBACK')
+                        raise
+        self.rows_archived.inc(moved)
+        return moved
+
+    def _encode(self, rows):
+        encoder = gorilla.Encoder(len(COLUMNS), self.archive_decimals)
+        for ts, *values in rows:
+            encoder.add(ts, values)
+        return encoder.finish()
+
+    def _store_block(self, device_id, rows, block):
+        """Write one day's block, merging it with blocks already archived for that day."""
+        day_start = rows[0][0] - rows[0][0] % (DAY * 1000)
+        existing = self._db.execute(
+            'SELECT rowid, data FROM archive WHERE device_id = ? AND end_ts >= ? AND start_ts < ?',
+            (device_id, day_start, day_start + DAY * 1000)).fetchall()
+        if existing:
+            merged = {}
+            for _, data in existing:
+                merged.update((ts, (ts, *values)) for ts, values in gorilla.decode_block(data))
+            merged.update((row[0], row) for row in rows)
+            rows = [merged[ts] for ts in sorted(merged)]
+            block = self._encode(rows)
+            self._db.executemany('DELETE FROM archive WHERE rowid = ?', [(rowid,) for rowid, _ in existing])
+        self._db.execute('INSERT INTO archive (device_id, start_ts, end_ts, count, data) VALUES (?, ?, ?, ?, ?)',
+                         (device_id, rows[0][0], rows[-1][0], len(rows), block))
+        self.archive_bytes.inc(len(block))
+
+    def compact(self, now=None):
+        """Roll up settled data and drop (or archive) expired rows. Returns the number of rows removed."""
+        now = time.time() if now is None else now
+        started = time.monotonic()
+        self.flush()
+        settled = int((now - self.settle) * 1000)
+        self._roll_up('1m', 'readings', 60, settled)
+        with self._write_lock:
+            minutes_done = self._watermark(self._db, '1m')
+        if minutes_done is not None:
+            self._roll_up('1h', 'rollup_1m', 3600, minutes_done)
+        removed = 0
+        for (name, table, _), (coarser, _, _) in zip(TIERS, TIERS[1:] + ((None, None, None),)):
+            retention = self.retention[name]
+            if retention is None:
+                continue
+            if name == 'raw' and self.archive:
+                removed += self._archive(int((now - retention) * 1000))
+            else:
+                removed += self._expire(table, int((now - retention) * 1000), coarser)
+        if removed:
+            with self._write_lock:
+                # execute() would step the pragma once, freeing a single page
+                self._db.executescript('PRAGMA incremental_vacuum')
+            self.rows_expired.inc(removed)
+        self.compact_seconds.observe(time.monotonic() - started)
+        return removed
+
+    # Queries
+
+    def devices(self):
+        with self._read_lock:
+            return [name for (name,) in self._reader.execute('SELECT name FROM devices ORDER BY name')]
+
+    def query(self, device, start=None, end=None, limit=None):
+        """
+        Raw readings of ``device`` with ``start <= epoch < end`` (epoch
+        seconds, either bound optional), oldest first, as a list of
+        ``(epoch, co2, temperature, humidity)`` tuples. Archived readings
+        are included.
+        """
+        start_ms = 0 if start is None else int(start * 1000)
+        end_ms = END_OF_TIME if end is None else int(end * 1000)
+        with self._read_lock:
+            row = self._reader.execute('SELECT id FROM devices WHERE name = ?', (device,)).fetchone()
+            if row is None:
+                return []
+            rows = self._archived(row[0], start_ms, end_ms, limit)
+            if not limit or len(rows) < limit:
+                sql = ('SELECT ts, co2, temperature, humidity FROM readings '
+                       'WHERE device_id = ? AND ts >= ? AND ts < ? ORDER BY ts')
+                params = [row[0], start_ms, end_ms]
+                if limit:
+                    sql += ' LIMIT ?'
+                    params.append(limit)
+                live = self._reader.execute(sql, params).fetchall()
+                if rows and live and live[0][0] < rows[-1][0]:
+                    # A reading that arrived late, after its day was archived
+                    live = sorted(rows + live)
+                    rows = []
+                rows += live
+        if limit:
+            rows = rows[:limit]
+        return [(ts / 1000, co2, temp, humid) for ts, co2, temp, humid in rows]
+
+    def _archived(self, device_id, start, end, limit=None):
+        rows = []
+        blocks = self._reader.execute(
+            'SELECT data FROM archive WHERE device_id = ? AND end_ts >= ? AND start_ts < ? ORDER BY start_ts',
+            (device_id, start, end))
+        for (data,) in blocks:
+            for ts, values in gorilla.decode_block(data):
+                if ts >= end:
+                    break
+                if ts >= start:
+                    rows.append((ts, *values))
+            if limit and len(rows) >= limit:
+                break
+        return rows
+
+    def tier_for(self, resolution=None, start=None, now=None):
+        """
+        Index into TIERS of the coarsest tier no coarser than ``resolution``
+        seconds, moving to coarser tiers when ``start`` is already past the
+        chosen tier's retention.
+        """
+        index = max(i for i, (_, _, step) in enumerate(TIERS) if step <= (resolution or 0))
+        if start is not None:
+            now = time.time() if now is None else now
+            while index < len(TIERS) - 1:
+                retention = self.retention[TIERS[index][0]]
+                if retention is None or start >= now - retention:
+                    break
+                index += 1
+        return index
+
+    def series(self, device, start=None, end=None, resolution=None):
+        """
+        Points of ``device`` between ``start`` and ``end`` (epoch seconds),
+        one per ``resolution``-second bucket (rounded to the tier's step; no
+        resolution means raw readings while they are kept). Each point is a
+        dict with ``epoch`` (bucket start), ``count`` and, per column, the
+        average plus ``<column>_min`` / ``<column>_max``.
+        """
+        index = self.tier_for(resolution, start)
+        step = TIERS[index][2]
+        bucket = max(step, int(resolution or 0) // step * step) if step else int(resolution or 0)
+        start_ms = 0 if start is None else int(start * 1000)
+        end_ms = END_OF_TIME if end is None else int(end * 1000)
+        with self._read_lock:
+            row = self._reader.execute('SELECT id FROM devices WHERE name = ?', (device,)).fetchone()
+            if row is None:
+                return []
+            rows = self._points(row[0], index, start_ms, end_ms, max(bucket * 1000, 1))
+        points = []
+        for ts, count, *values in rows:
+            point = {'epoch': ts / 1000, 'count': count}
+            for i, c in enumerate(COLUMNS):
+                low, high, total, n = values[4 * i:4 * i + 4]
+                point[c] = round(total / n, 2) if n else None
+                point[f'{c}_min'] = low
+                point[f'{c}_max'] = high
+            points.append(point)
+        return points
+
+    def _points(self, device_id, index, start, end, bucket):
+        name, table, _ = TIERS[index]
+        tail = []
+        if index:
+            # The newest part isn't rolled up into this tier yet; read it from the finer one
+            watermark = self._watermark(self._reader, name) or 0
+            split = watermark - watermark % bucket
+            if end > split:
+                tail = self._points(device_id, index - 1, max(start, split), end, bucket)
+                end = split
+        rows = []
+        if start < end:
+            rows = self._reader.execute(
+                f'SELECT ts - ts % {bucket}, {_aggregates(table)} FROM {table} '
+                f'WHERE device_id = ? AND ts >= ? AND ts < ? GROUP BY 1 ORDER BY 1',
+                (device_id, start, end)).fetchall()
+        return rows + tail
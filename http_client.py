@@ -0,0 +1,120 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import REGISTRY
+from rate_limit import RateLimited, get_rate_limiter
+from resilience import get_breakers
+
+
+class HttpClient:
+    """
+    Shared keep-alive HTTP client for every sensor and sink.
+
+    Connection pools live in ``HTTPAdapter`` objects (urllib3 pools are
+    thread-safe) and are shared by all threads, so repeated calls to
+    api.weatherapi.com / api.thingspeak.com reuse open TCP+TLS connections
+    instead of handshaking every cycle. Each thread gets its own lightweight
+    ``requests.Session`` mounted with those shared adapters, which keeps
+    session state (cookies, headers) off the shared path.
+
+    Pools can be sized per host; hosts without an entry share a default
+    adapter. Every request first takes a token from its host's bucket in
+    the shared RateLimiter (rate_limit.py), which also hears about 429s,
+    and goes through its host's circuit breaker (resilience.py): while a
+    host is down, calls fail fast with CircuitOpen instead of waiting out
+    the timeout.
+    Latency and errors are exported per host as
+    ``http.<host>.latency_seconds`` / ``http.<host>.errors``.
+    """
+
+    def __init__(self, connect_timeout=5, read_timeout=10, pool_maxsize=10,
+                 host_pool_sizes=None, rate_limiter=None, breakers=None, registry=REGISTRY):
+        self.timeout = (connect_timeout, read_timeout)
+        self.rate_limiter = rate_limiter
+        self.breakers = breakers
+        self.registry = registry
+        self._default_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_maxsize)
+        self._host_adapters = {
+            host: HTTPAdapter(pool_connections=1, pool_maxsize=size)
+            for host, size in (host_pool_sizes or {}).items()
+        }
+        self._local = threading.local()
+
+    @classmethod
+    def from_config(cls, config):
+        opts = (config or {}).get('http') or {}
+        return cls(
+            connect_timeout=opts.get('connect_timeout', 5),
+            read_timeout=opts.get('read_timeout', 10),
+            pool_maxsize=opts.get('pool_maxsize', 10),
+            host_pool_sizes=opts.get('hosts'),
+            rate_limiter=get_rate_limiter(config),
+            breakers=get_breakers(config),
+        )
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self._default_adapter)
+            session.mount('https://', self._default_adapter)
+            for host, adapter in self._host_adapters.items():
+                session.mount(f"http://{host}", adapter)
+                session.mount(f"https://{host}", adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlsplit(url).hostname or 'unknown'
+        limiter = self.rate_limiter or get_rate_limiter()
+        breaker = (self.breakers or get_breakers()).breaker(host)
+        breaker.before()
+        try:
+            limiter.acquire(host)
+        except RateLimited:
+            breaker.abandon()
+            raise
+        started = time.monotonic()
+        try:
+            response = self._session().request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.registry.counter(f"http.{host}.errors").inc()
+            breaker.failure()
+            raise
+        finally:
+            self.registry.histogram(f"http.{host}.latency_seconds").observe(time.monotonic() - started)
+        limiter.response(host, response.status_code, response.headers)
+        if response.status_code >= 500:
+            breaker.failure()
+        else:
+            breaker.success()
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        self._default_adapter.close()
+        for adapter in self._host_adapters.values():
+            adapter.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client(config=None):
+    """Process-wide HttpClient, created from config.json's ``http`` section on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient.from_config(config)
+        return _client
@@ -1,7 +1,6 @@
 import json
-import threading
 import time
-from api_weather_device import WeatherSensor  # Import our new weather sensor class
+from orchestrator import DeviceOrchestrator, devices_from_config  # Runs every configured device
 
 print("╔════════════════════════════════════════════════════════════╗")
 print("║     LIVE WEATHER-BASED IoT MONITORING SYSTEM               ║")
@@ -20,8 +19,9 @@ except FileNotFoundError:
     exit(1)
 
 # Validate required fields
-weather_api = config.get('weather_api')
-if not weather_api or not weather_api.get('api_key') or weather_api.get('api_key') == 'YOUR_OPENWEATHERMAP_API_KEY':
+devices = devices_from_config(config, default_type='weather')
+weather_keys = [d.get('weather_api_key') for d in devices if d['type'] == 'weather']
+if any(not key or key == 'YOUR_OPENWEATHERMAP_API_KEY' for key in weather_keys):
     print("ERROR: WeatherAPI.com API key not configured!")
     print("\nSetup Instructions:")
     print("   1. Get FREE API key from: https://www.weatherapi.com/signup.aspx")
@@ -30,21 +30,20 @@ if not weather_api or not weather_api.get('api_key') or weather_api.get('api_key
     print("   4. Set country code in 'weather_api.country_code' (e.g., 'IN' for India)\n")
     exit(1)
 
-# Create the weather sensor object
-print("Initializing weather sensor...")
-sensor_device = WeatherSensor(
-    name=config['device_name'],
-    api_key=config['api_key'],  # ThingSpeak API key
-    interval=config['update_interval'],
-    weather_api_key=weather_api['api_key'],
-    city=weather_api.get('city', 'Bangalore'),
-    country_code=weather_api.get('country_code', 'IN')
-)
+# Create the devices ('devices' list, or the flat keys for one weather sensor)
+print(f"Initializing {len(devices)} device(s)...")
+if (config.get('orchestrator') or {}).get('mode') == 'async':
+    # Every device on one asyncio event loop instead of the worker pool
+    import asyncio
+    from async_runtime import AsyncRuntime
+    runtime = AsyncRuntime.from_config(config, default_type='weather')
+    orchestrator = None
+else:
+    orchestrator = DeviceOrchestrator.from_config(config, default_type='weather')
 
-# Start the sensor in a background thread
-print("\nLaunching weather monitoring thread...")
-thread = threading.Thread(target=sensor_device.run_simulation, daemon=True)
-thread.start()
+    # Run every device on a shared, bounded worker pool
+    print("\nLaunching device orchestrator...")
+    orchestrator.start()
 
 print("\n╔════════════════════════════════════════════════════════════╗")
 print("║  SYSTEM IS LIVE                                            ║")
@@ -59,9 +58,14 @@ print("╚═══════════════════════
 
 # Keep the main script alive
 try:
-    while thread.is_alive():
-        time.sleep(1)
+    if orchestrator is None:
+        asyncio.run(runtime.run())
+    else:
+        while orchestrator.is_alive():
+            time.sleep(1)
 except KeyboardInterrupt:
+    if orchestrator is not None:
+        orchestrator.stop(wait=False)
     print("\n\n╔════════════════════════════════════════════════════════════╗")
     print("║  System stopped by user. Goodbye!                          ║")
     print("╚════════════════════════════════════════════════════════════╝\n")
@@ -1,7 +1,6 @@
 import json
-import threading
 import time  # <-- THIS IS THE LINE I FORGOT
-from csv_device import CsvSensor  # Import our new CSV sensor class
+from orchestrator import DeviceOrchestrator  # Runs every configured device
 
 print("--- CSV-Based IoT Simulation: STARTING ---")
 
@@ -13,25 +12,20 @@ except FileNotFoundError:
     print("ERROR: config.json not found. Exiting.")
     exit()
 
-# 1. Create the sensor object from the config
-sensor_device = CsvSensor(
-    name=config['device_name'],
-    api_key=config['api_key'],
-    interval=config['update_interval'],
-    csv_file=config['data_file']
-)
+# 1. Create the devices from the config ('devices' list, or the flat keys for one CSV sensor)
+orchestrator = DeviceOrchestrator.from_config(config, default_type='csv')
 
-# 2. We use threading so the main program doesn't freeze
-# This is a key "high-level" concept
-print("--- Launching device thread... ---")
-thread = threading.Thread(target=sensor_device.run_simulation, daemon=True)
-thread.start()
+# 2. Devices share a bounded worker pool so the main program doesn't freeze
+# and we don't need one thread per device
+print("--- Launching device orchestrator... ---")
+orchestrator.start()
 
 print("--- System is LIVE. Press CTRL+C to stop. ---")
 
 # Keep the main script alive so we can see the output
 try:
-    while thread.is_alive():
+    while orchestrator.is_alive():
         time.sleep(1)
 except KeyboardInterrupt:
-    print("\n--- Main thread stopping. Shutting down... ---")
\ No newline at end of file
+    print("\n--- Main thread stopping. Shutting down... ---")
+    orchestrator.stop(wait=False)
\ No newline at end of file
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+
+class Counter:
+    """Monotonically increasing count."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """Value that can go up and down (queue depth, last lag, ...)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with O(log buckets) observe and no per-sample storage.
+
+    Bucket bounds are upper bounds in the metric's unit (seconds by default);
+    one extra overflow bucket catches everything above the last bound.
+    Percentiles are estimated as the upper bound of the bucket they fall in.
+    """
+
+    DEFAULT_BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                      0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, bounds=None):
+        self.bounds = tuple(bounds or self.DEFAULT_BOUNDS)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[i] += 1
+            self.count += 1
+            self.sum += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, q):
+        """Estimated value below which a fraction ``q`` of samples fall."""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for i, n in enumerate(self._counts):
+                seen += n
+                if seen >= rank and n:
+                    return self.bounds[i] if i < len(self.bounds) else self.max
+            return self.max
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            count, total, lo, hi = self.count, self.sum, self.min, self.max
+        buckets = {f"le_{b:g}": n for b, n in zip(self.bounds, counts)}
+        buckets['le_inf'] = counts[-1]
+        return {
+            'count': count,
+            'sum': round(total, 6),
+            'min': lo,
+            'max': hi,
+            'mean': round(total / count, 6) if count else None,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'buckets': buckets,
+        }
+
+
+class MetricsRegistry:
+    """Named metrics shared by every component in the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name):
+        return self._get(name, Counter)
+
+    def gauge(self, name):
+        return self._get(name, Gauge)
+
+    def histogram(self, name, bounds=None):
+        return self._get(name, lambda: Histogram(bounds))
+
+    def snapshot(self):
+        with self._lock:
+            items = sorted(self._metrics.items())
+        return {name: metric.snapshot() for name, metric in items}
+
+    def dump(self, path='metrics.json'):
+        """Write a snapshot atomically so other processes (the dashboards) can read it."""
+        data = {'timestamp': time.time(), 'metrics': self.snapshot()}
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
+
+
+# Process-wide registry
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,297 @@
+import re
+import threading
+import time
+
+from alert_dispatcher import get_dispatcher
+from cadence import Cadence
+from config_service import freeze, get_config_service
+from http_client import get_client
+from metrics import REGISTRY
+from pipeline import default_pipeline
+from scheduler import DeadlineScheduler
+from weather_cache import get_weather_cache
+
+
+def _slug(name):
+    return re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_') or 'device'
+
+
+def devices_from_config(config, default_type='csv'):
+    """
+    Build the list of device specs from config.json.
+
+    Uses the ``devices: [...]`` section when present. Otherwise a single
+    device is described by the legacy flat keys (device_name, api_key,
+    update_interval, data_file / weather_api), so older configs keep working.
+    Entries without a ``type`` get ``default_type``.
+    """
+    weather_api = config.get('weather_api') or {}
+    thingspeak = config.get('thingspeak') or {}
+    entries = config.get('devices')
+    if not entries:
+        entries = [{
+            'name': config.get('device_name', 'Sensor'),
+            'type': default_type,
+        }]
+
+    specs = []
+    for entry in entries:
+        spec = dict(entry)
+        spec.setdefault('type', default_type)
+        spec.setdefault('name', f"{spec['type']}-{len(specs) + 1}")
+        spec.setdefault('api_key', config.get('api_key'))
+        spec.setdefault('thingspeak_channel_id', thingspeak.get('channel_id'))
+        spec.setdefault('interval', config.get('update_interval', 20))
+        spec.setdefault('missed_tick_policy', config.get('missed_tick_policy', 'skip'))
+        spec.setdefault('max_catch_up', config.get('max_catch_up', 3))
+        spec.setdefault('adaptive_polling', config.get('adaptive_polling'))
+        if spec['type'] == 'csv':
+            spec.setdefault('data_file', config.get('data_file', 'data.csv'))
+        elif spec['type'] == 'weather':
+            spec.setdefault('weather_api_key', weather_api.get('api_key'))
+            spec.setdefault('city', weather_api.get('city', 'Bangalore'))
+            spec.setdefault('country_code', weather_api.get('country_code', 'IN'))
+            spec.setdefault('weather_base_url', weather_api.get('base_url', 'http://api.weatherapi.com/v1'))
+        specs.append(spec)
+
+    # A single CSV device keeps the historical tracker file the dashboards read
+    csv_specs = [s for s in specs if s['type'] == 'csv']
+    for spec in csv_specs:
+        if len(csv_specs) == 1:
+            spec.setdefault('tracker_file', 'row_tracker.txt')
+        else:
+            spec.setdefault('tracker_file', f"row_tracker_{_slug(spec['name'])}.txt")
+    return specs
+
+
+def build_sensor(spec, pipeline=None, weather_class=None):
+    """
+    Create the sensor object described by a device spec; ``weather_class``
+    replaces WeatherSensor (the asyncio runtime passes its coroutine device).
+    Devices may share a state file: each has its own shared memory slot in it.
+    """
+    kind = spec['type']
+    if kind == 'csv':
+        from csv_device import CsvSensor
+        return CsvSensor(
+            name=spec['name'],
+            api_key=spec['api_key'],
+            interval=spec['interval'],
+            csv_file=spec['data_file'],
+            tracker_file=spec.get('tracker_file', 'row_tracker.txt'),
+            state_file=spec.get('state_file', 'current_state.json'),
+            missed_tick_policy=spec.get('missed_tick_policy', 'skip'),
+            pipeline=pipeline,
+            channel_id=spec.get('thingspeak_channel_id'),
+        )
+    if kind == 'weather':
+        if weather_class is None:
+            from api_weather_device import WeatherSensor as weather_class
+        return weather_class(
+            name=spec['name'],
+            api_key=spec['api_key'],
+            interval=spec['interval'],
+            weather_api_key=spec['weather_api_key'],
+            city=spec['city'],
+            country_code=spec.get('country_code', 'IN'),
+            state_file=spec.get('state_file', 'current_state.json'),
+            missed_tick_policy=spec.get('missed_tick_policy', 'skip'),
+            pipeline=pipeline,
+            channel_id=spec.get('thingspeak_channel_id'),
+            base_url=spec.get('weather_base_url', 'http://api.weatherapi.com/v1'),
+            adaptive=spec.get('adaptive_polling'),
+        )
+    raise ValueError(f"Unknown device type '{kind}' for device '{spec.get('name')}'")
+
+
+class DeviceRunner:
+    """Scheduling and crash bookkeeping for one device."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.name = spec['name']
+        self.interval = float(spec['interval'])
+        self.cadence = Cadence(self.interval,
+                               policy=spec.get('missed_tick_policy', 'skip'),
+                               max_catch_up=spec.get('max_catch_up', 3))
+        self.sensor = None
+        self.running = False
+        self.crashes = 0          # consecutive crashes, reset by a good step
+        self.restarts = 0
+        self.last_error = None
+        self.pending_spec = None  # edited spec from config.json, applied at the next step
+
+    def reconfigure(self, spec):
+        """Queue an edited spec; it takes effect when the device next steps."""
+        self.pending_spec = spec
+
+    def apply_pending(self):
+        """Switch to a queued spec: new interval, and the sensor is rebuilt from it."""
+        spec, self.pending_spec = self.pending_spec, None
+        if spec is None:
+            return
+        self.spec = spec
+        self.interval = float(spec['interval'])
+        self.cadence.set_interval(self.interval)
+        self.sensor = None
+
+    def follow_sensor(self):
+        """Take up the sensor's current (adaptive) polling interval."""
+        self.interval = self.sensor.next_interval()
+        self.cadence.set_interval(self.interval)
+
+
+def reconfigure_runners(runners, config, default_type, label):
+    """
+    ConfigService subscriber body: queue the edited spec of every device
+    whose settings changed in config.json. Devices are matched by name;
+    adding or removing devices still needs a restart.
+    """
+    specs = {spec['name']: spec for spec in devices_from_config(config, default_type)}
+    names = {runner.name for runner in runners}
+    changed = [runner for runner in runners
+               if runner.name in specs and freeze(specs[runner.name]) != freeze(runner.spec)]
+    for runner in changed:
+        runner.reconfigure(specs[runner.name])
+    if changed:
+        print(f"[{label}]   > config.json changed, updating {', '.join(r.name for r in changed)}")
+    if set(specs) != names:
+        print(f"[{label}]   > Devices were added or removed in config.json; restart to apply")
+
+
+class DeviceOrchestrator:
+    """
+    Runs many sensors of mixed types on a bounded worker pool.
+
+    Each device is driven one ``step()`` at a time, so a device only holds a
+    worker while it is actually sampling; everything slow after sampling
+    (state file, email, ThingSpeak) runs on the shared ReadingPipeline. A DeadlineScheduler is the single
+    supervisor: it dispatches devices as their deadlines come due and
+    re-schedules devices whose step raised, with exponential backoff between
+    restarts. Scheduler metrics are dumped to ``metrics_file`` periodically.
+    With a ``config_service``, edits to a device's settings in config.json
+    (interval, location, ...) are applied from its next step.
+    """
+
+    def __init__(self, specs, max_workers=8, restart_backoff=5, max_restart_backoff=300,
+                 metrics_file='metrics.json', metrics_interval=10, pipeline=None,
+                 config_service=None, default_type='csv'):
+        self.runners = [DeviceRunner(spec) for spec in specs]
+        self.config_service = config_service
+        self.default_type = default_type
+        self.pipeline = pipeline or default_pipeline()
+        self.max_workers = max_workers
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.scheduler = DeadlineScheduler(max_workers=max_workers, name='scheduler')
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, default_type='csv'):
+        """Create an orchestrator from config.json (``devices`` + ``orchestrator`` sections)."""
+        opts = config.get('orchestrator') or {}
+        # Configure the shared HTTP pools before any device uses them
+        get_client(config)
+        get_dispatcher(config)
+        get_weather_cache(config)
+        return cls(
+            devices_from_config(config, default_type),
+            max_workers=opts.get('max_workers', 8),
+            restart_backoff=opts.get('restart_backoff', 5),
+            max_restart_backoff=opts.get('max_restart_backoff', 300),
+            metrics_file=opts.get('metrics_file', 'metrics.json'),
+            metrics_interval=opts.get('metrics_interval', 10),
+            pipeline=default_pipeline(config),
+            config_service=get_config_service(),
+            default_type=default_type,
+        )
+
+    def _config_changed(self, config, changed):
+        reconfigure_runners(self.runners, config, self.default_type, 'Orchestrator')
+
+    def start(self):
+        print(f"[Orchestrator]   > Starting {len(self.runners)} device(s) on {self.max_workers} worker(s)")
+        self.scheduler.start()
+        # Spread first samples over each device's interval so a large fleet
+        # doesn't all come due on the same tick
+        now = time.monotonic()
+        count = len(self.runners)
+        for i, runner in enumerate(self.runners):
+            first = runner.cadence.start(now + runner.interval * i / count)
+            self.scheduler.schedule_at(first, self._run_step, runner)
+        if self.metrics_file:
+            self.scheduler.schedule_in(self.metrics_interval, self._dump_metrics)
+        if self.config_service is not None:
+            # Load first so the initial snapshot isn't reported as a change
+            self.config_service.get()
+            self.config_service.subscribe(self._config_changed)
+            self.config_service.start()
+
+    def stop(self, wait=True):
+        if self.config_service is not None:
+            self.config_service.unsubscribe(self._config_changed)
+        self.scheduler.stop(wait=wait)
+        # Let the sinks flush what the devices already published
+        self.pipeline.stop()
+        # ...and the alert emails those sinks queued
+        get_dispatcher().stop()
+
+    def is_alive(self):
+        return self.scheduler.is_alive()
+
+    def status(self):
+        """Snapshot of every device's scheduling state."""
+        with self._lock:
+            return [{
+                'name': r.name,
+                'type': r.spec['type'],
+                'interval': r.interval,
+                'running': r.running,
+                'crashes': r.crashes,
+                'restarts': r.restarts,
+                'last_error': r.last_error,
+            } for r in self.runners]
+
+    # ------------------------------------------------------------ supervisor
+
+    def _dump_metrics(self):
+        try:
+            REGISTRY.dump(self.metrics_file)
+        except OSError as e:
+            print(f"[Orchestrator]   > Failed to write {self.metrics_file}: {e}")
+        self.scheduler.schedule_in(self.metrics_interval, self._dump_metrics)
+
+    def _run_step(self, runner):
+        with self._lock:
+            runner.running = True
+            runner.apply_pending()
+        runner.cadence.mark_sample()
+        try:
+            if runner.sensor is None:
+                if runner.crashes:
+                    runner.restarts += 1
+                    print(f"[Orchestrator]   > Restarting device '{runner.name}'")
+                runner.sensor = build_sensor(runner.spec, self.pipeline)
+            runner.sensor.step()
+        except Exception as e:
+            with self._lock:
+                runner.crashes += 1
+                runner.last_error = f"{type(e).__name__}: {e}"
+                runner.sensor = None
+                runner.running = False
+                backoff = min(self.max_restart_backoff,
+                              self.restart_backoff * 2 ** (runner.crashes - 1))
+            print(f"[Orchestrator]   > Device '{runner.name}' crashed ({e}); restarting in {backoff:.0f}s")
+            # Re-anchor the cadence grid at the restart time
+            restart_at = runner.cadence.start(time.monotonic() + backoff)
+            self.scheduler.schedule_at(restart_at, self._run_step, runner)
+            return
+
+        with self._lock:
+            runner.crashes = 0
+            runner.running = False
+            runner.follow_sensor()
+        # Next deadline is on the device's fixed grid, not "interval after this step"
+        self.scheduler.schedule_at(runner.cadence.next_deadline(), self._run_step, runner)
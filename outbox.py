@@ -0,0 +1,250 @@
+import json
+import sqlite3
+import threading
+import time
+
+from metrics import REGISTRY
+from resilience import Backoff
+
+
+class Outbox:
+    """
+    Durable, append-only queue of ThingSpeak updates waiting for an ack.
+
+    Backed by SQLite in WAL mode: appends are cheap single-row inserts, a
+    restart just reopens the file (no scanning of old data) and rows are
+    deleted only once ThingSpeak has accepted them. A one-row
+    ``outbox_depth`` table, kept current by triggers inside each
+    insert/delete, holds the number of pending rows and bounds disk use: the
+    insert trigger drops the oldest rows once the id range grows past
+    ``max_entries``, so the bound holds on every append and across restarts.
+    Freed pages are reused by later appends.
+
+    The channels with pending rows are kept in memory, so finding what is
+    due costs one index lookup per channel rather than a scan.
+
+    Rows with an empty channel belong to devices without a channel id and
+    are replayed one by one through the single-update endpoint.
+    """
+
+    def __init__(self, path='thingspeak_outbox.db', max_entries=100000, registry=REGISTRY):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' channel TEXT NOT NULL,'
+            ' write_key TEXT NOT NULL,'
+            ' queued_at REAL NOT NULL,'
+            ' payload TEXT NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS outbox_channel ON outbox (channel, id)')
+        self._create_depth()
+        self.depth = registry.gauge('outbox.pending')
+        self.dropped = registry.counter('outbox.dropped')
+        self.acked = registry.counter('outbox.acked')
+        self._full_reported = False
+        self._dropped_total = self._apply_bound()
+        self._channels = self._load_channels()
+        self.depth.set(self.pending())
+
+    def _create_depth(self):
+        columns = [row[1] for row in self._db.execute('PRAGMA table_info(outbox_depth)')]
+        if 'bound' in columns:
+            return
+        # One-time count for outboxes written before the depth table existed
+        self._db.executescript(
+            'BEGIN;'
+            'DROP TRIGGER IF EXISTS outbox_depth_insert;'
+            'DROP TRIGGER IF EXISTS outbox_depth_delete;'
+            'DROP TABLE IF EXISTS outbox_depth;'
+            'CREATE TABLE outbox_depth (id INTEGER PRIMARY KEY CHECK (id = 0), pending INTEGER NOT NULL,'
+            ' bound INTEGER NOT NULL, dropped INTEGER NOT NULL);'
+            'INSERT INTO outbox_depth (id, pending, bound, dropped) SELECT 0, COUNT(*), 0, 0 FROM outbox;'
+            'CREATE TRIGGER outbox_depth_insert AFTER INSERT ON outbox BEGIN'
+            ' UPDATE outbox_depth SET pending = pending + 1, dropped = dropped + (SELECT COUNT(*) FROM outbox'
+            '  WHERE outbox_depth.bound > 0 AND outbox.id <= NEW.id - outbox_depth.bound) WHERE id = 0;'
+            ' DELETE FROM outbox WHERE id <= NEW.id - (SELECT bound FROM outbox_depth WHERE id = 0 AND bound > 0);'
+            ' END;'
+            'CREATE TRIGGER outbox_depth_delete AFTER DELETE ON outbox'
+            ' BEGIN UPDATE outbox_depth SET pending = pending - 1 WHERE id = 0; END;'
+            'COMMIT;'
+        )
+
+    def _apply_bound(self):
+        """
+        Store ``max_entries`` (None: unbounded) for the insert trigger and
+        trim the outbox to it. Returns the number of rows ever dropped.
+        """
+        with self._lock:
+            self._db.execute('UPDATE outbox_depth SET bound = ? WHERE id = 0', (self.max_entries or 0,))
+            hi = self._db.execute('SELECT MAX(id) FROM outbox').fetchone()[0]
+            removed = 0
+            if hi is not None and self.max_entries:
+                removed = self._db.execute('DELETE FROM outbox WHERE id <= ?',
+                                           (hi - self.max_entries,)).rowcount
+            if removed:
+                self._db.execute('UPDATE outbox_depth SET dropped = dropped + ? WHERE id = 0', (removed,))
+                # A lowered bound frees more than appends will reuse soon;
+                # execute() would step the pragma once, freeing a single page
+                self._db.executescript('PRAGMA incremental_vacuum')
+                self.dropped.inc(removed)
+                print(f"[Outbox]   > Outbox over {self.max_entries} entries, dropped {removed} oldest reading(s)")
+            return self._db.execute('SELECT dropped FROM outbox_depth WHERE id = 0').fetchone()[0]
+
+    def _load_channels(self):
+        """Distinct channels with pending rows, one index seek each."""
+        channels = set()
+        with self._lock:
+            row = self._db.execute('SELECT MIN(channel) FROM outbox').fetchone()
+            while row and row[0] is not None:
+                channels.add(row[0])
+                row = self._db.execute('SELECT MIN(channel) FROM outbox WHERE channel > ?', row).fetchone()
+        return channels
+
+    def append(self, channel, write_key, update):
+        channel = channel or ''
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO outbox (channel, write_key, queued_at, payload) VALUES (?, ?, ?, ?)',
+                (channel, write_key, time.time(), json.dumps(update)))
+            self._channels.add(channel)
+            pending, dropped = self._db.execute(
+                'SELECT pending, dropped FROM outbox_depth WHERE id = 0').fetchone()
+            removed, self._dropped_total = dropped - self._dropped_total, dropped
+        self.depth.set(pending)
+        if removed:
+            if not self._full_reported:
+                self._full_reported = True
+                print(f"[Outbox]   > Outbox full ({self.max_entries} entries), dropping oldest readings")
+            self.dropped.inc(removed)
+
+    def pending(self):
+        with self._lock:
+            return self._db.execute('SELECT pending FROM outbox_depth WHERE id = 0').fetchone()[0]
+
+    def channels(self):
+        """(channel, oldest queued_at) for every channel with pending rows."""
+        result = []
+        with self._lock:
+            for channel in sorted(self._channels):
+                row = self._db.execute('SELECT queued_at FROM outbox WHERE channel = ? ORDER BY id LIMIT 1',
+                                       (channel,)).fetchone()
+                if row is None:
+                    self._channels.discard(channel)
+                else:
+                    result.append((channel, row[0]))
+        return result
+
+    def count(self, channel, limit):
+        """Pending rows for a channel, counted up to ``limit``."""
+        with self._lock:
+            return self._db.execute(
+                'SELECT COUNT(*) FROM (SELECT 1 FROM outbox WHERE channel = ? LIMIT ?)',
+                (channel, limit)).fetchone()[0]
+
+    def peek(self, channel, limit):
+        """Oldest rows of a channel as (id, write_key, update), in order."""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id, write_key, payload FROM outbox WHERE channel = ? ORDER BY id LIMIT ?',
+                (channel, limit)).fetchall()
+        return [(row_id, key, json.loads(payload)) for row_id, key, payload in rows]
+
+    def ack(self, ids):
+        with self._lock:
+            self._db.executemany('DELETE FROM outbox WHERE id = ?', [(i,) for i in ids])
+        self.acked.inc(len(ids))
+        self.depth.dec(len(ids))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class OutboxReplayer:
+    """
+    Background thread draining the outbox into ThingSpeak.
+
+    Channels are sent in bulk (``uploader.send_batch``) when they have a full
+    batch or their oldest row has waited ``max_age``, never more often than
+    ``min_interval`` per channel. Channel-less rows go through the single
+    update endpoint at ``single_rate`` requests per second. Any failure backs
+    the whole replayer off exponentially with jitter (up to ``max_backoff``),
+    since it almost always means ThingSpeak or the network is down; once a
+    send succeeds again the backlog drains at the normal rate.
+    """
+
+    def __init__(self, outbox, uploader, single_rate=1.0, max_backoff=300):
+        self.outbox = outbox
+        self.uploader = uploader
+        self.single_rate = single_rate
+        self.max_backoff = max_backoff
+        self._last_post = {}
+        self._backoff = Backoff(5, max_backoff)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='outbox-replayer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                ok = self.drain_once()
+            except Exception as e:
+                print(f"[Outbox]   > Replay error: {e}")
+                ok = False
+            if ok:
+                self._backoff.reset()
+                delay = 1.0
+            else:
+                delay = self._backoff.next()
+                print(f"[Outbox]   > ThingSpeak unreachable, retrying in {delay:.0f}s "
+                      f"({self.outbox.pending()} reading(s) waiting)")
+            self._stop.wait(delay)
+
+    def drain_once(self, force=False):
+        """Send every channel that is due. Returns False if a send failed."""
+        uploader = self.uploader
+        now = time.monotonic()
+        for channel, oldest in self.outbox.channels():
+            if self._stop.is_set():
+                return True
+            if not channel:
+                if not self._replay_singles():
+                    return False
+                continue
+            if not force and now - self._last_post.get(channel, 0.0) < uploader.min_interval:
+                continue
+            full = self.outbox.count(channel, uploader.max_batch) >= uploader.max_batch
+            if not (force or full or time.time() - oldest >= uploader.max_age):
+                continue
+            rows = self.outbox.peek(channel, uploader.max_batch)
+            self._last_post[channel] = now
+            if not uploader.send_batch(channel, rows[-1][1], [update for _, _, update in rows]):
+                return False
+            self.outbox.ack([row_id for row_id, _, _ in rows])
+        return True
+
+    def _replay_singles(self):
+        for row_id, write_key, update in self.outbox.peek('', 50):
+            if self._stop.is_set():
+                break
+            if not self.uploader.send_single(write_key, update):
+                return False
+            self.outbox.ack([row_id])
+            self._stop.wait(1.0 / self.single_rate)
+        return True
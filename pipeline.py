@@ -0,0 +1,222 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from metrics import REGISTRY
+
+
+class BoundedQueue:
+    """
+    Bounded FIFO with a configurable backpressure policy.
+
+      - ``block``: producers wait for room (nothing is lost)
+      - ``drop_oldest``: a full queue discards its oldest item to make room
+      - ``coalesce``: at most one pending item per key; a newer item for the
+        same key replaces the queued one in place (only the latest matters).
+        New keys on a full queue drop the oldest key.
+
+    Depth, drops, coalesces and time producers spent blocked are exported
+    as ``<name>.queue_depth``, ``<name>.dropped``, ``<name>.coalesced`` and
+    ``<name>.blocked_seconds``.
+    """
+
+    POLICIES = ('block', 'drop_oldest', 'coalesce')
+
+    def __init__(self, maxsize=1000, policy='block', name='queue', registry=REGISTRY):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{policy}' (expected one of {self.POLICIES})")
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items = OrderedDict() if policy == 'coalesce' else deque()
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self.depth = registry.gauge(f"{name}.queue_depth")
+        self.dropped = registry.counter(f"{name}.dropped")
+        self.coalesced = registry.counter(f"{name}.coalesced")
+        self.blocked = registry.histogram(f"{name}.blocked_seconds")
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def put(self, item, key=None):
+        with self._cond:
+            if self._closed:
+                return False
+            if self.policy == 'coalesce':
+                if key is None:
+                    self._seq += 1
+                    key = ('_', self._seq)
+                if key in self._items:
+                    self._items[key] = item
+                    self.coalesced.inc()
+                    return True
+                if len(self._items) >= self.maxsize:
+                    self._items.popitem(last=False)
+                    self.dropped.inc()
+                self._items[key] = item
+            else:
+                if len(self._items) >= self.maxsize:
+                    if self.policy == 'drop_oldest':
+                        self._items.popleft()
+                        self.dropped.inc()
+                    else:
+                        started = time.monotonic()
+                        while len(self._items) >= self.maxsize and not self._closed:
+                            self._cond.wait()
+                        self.blocked.observe(time.monotonic() - started)
+                        if self._closed:
+                            return False
+                self._items.append(item)
+            self.depth.set(len(self._items))
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """Return the next item, or None on timeout / once closed and drained."""
+        with self._cond:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._items:
+                if self._closed:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            if self.policy == 'coalesce':
+                _, item = self._items.popitem(last=False)
+            else:
+                item = self._items.popleft()
+            self.depth.set(len(self._items))
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class SinkWorker:
+    """One thread draining one sink's queue."""
+
+    def __init__(self, sink, maxsize, policy, registry=REGISTRY):
+        self.sink = sink
+        prefix = f"pipeline.{sink.name}"
+        self.queue = BoundedQueue(maxsize, policy, name=prefix, registry=registry)
+        self.processed = registry.counter(f"{prefix}.processed")
+        self.errors = registry.counter(f"{prefix}.errors")
+        self.latency = registry.histogram(f"{prefix}.handle_seconds")
+        self._thread = threading.Thread(target=self._run, name=prefix, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                break
+            started = time.monotonic()
+            try:
+                self.sink.handle(*message)
+            except Exception as e:
+                self.errors.inc()
+                print(f"[pipeline]   > {self.sink.name} sink failed: {e}")
+            self.latency.observe(time.monotonic() - started)
+            self.processed.inc()
+        self.sink.close()
+
+
+class ReadingPipeline:
+    """
+    Fans readings out from samplers to independent sink workers.
+
+    ``publish(sensor, reading, cfg)`` only enqueues, so a slow sink (SMTP,
+    ThingSpeak) never delays the next sample; its own queue absorbs the
+    backlog according to that sink's backpressure policy.
+    """
+
+    def __init__(self, sinks, maxsize=1000, policies=None, registry=REGISTRY):
+        policies = policies or {}
+        self.workers = [
+            SinkWorker(sink, maxsize, policies.get(sink.name, sink.default_policy), registry)
+            for sink in sinks
+        ]
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if not self._started:
+                for worker in self.workers:
+                    worker.start()
+                self._started = True
+
+    def publish(self, sensor, reading, cfg=None):
+        for worker in self.workers:
+            worker.queue.put((sensor, reading, cfg), key=sensor.name)
+
+    def stop(self, timeout=10):
+        """Stop accepting readings and let every sink drain what it has queued."""
+        for worker in self.workers:
+            worker.queue.close()
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+
+    def depths(self):
+        return {w.sink.name: len(w.queue) for w in self.workers}
+
+
+def build_pipeline(config=None):
+    """Create (but don't start) the standard sink pipeline from config.json's ``pipeline`` section."""
+    from alert_engine import AlertEngine
+    from sinks import (EmailSink, HistoryFileSink, HistoryStoreSink, RecentHistorySink, StateFileSink,
+                       ThingSpeakSink)
+    from thingspeak import ThingSpeakUploader
+    opts = (config or {}).get('pipeline') or {}
+    ts_opts = (config or {}).get('thingspeak') or {}
+    uploader = ThingSpeakUploader.from_config(config) if ts_opts.get('bulk', True) else None
+    outbox = None
+    outbox_file = ts_opts.get('outbox', 'thingspeak_outbox.db')
+    if outbox_file:
+        from outbox import Outbox
+        uploader = uploader or ThingSpeakUploader.from_config(config)
+        outbox = Outbox(outbox_file, max_entries=ts_opts.get('outbox_max_entries', 100000))
+    alert_opts = (config or {}).get('alerts') or {}
+    engine = AlertEngine.from_config(config) if alert_opts.get('enabled', True) else None
+    sinks = [StateFileSink(opts.get('state_file', True)), EmailSink(engine), ThingSpeakSink(uploader, outbox)]
+    if opts.get('history_file'):
+        sinks.append(HistoryFileSink(opts['history_file']))
+    history_opts = (config or {}).get('history') or {}
+    store = None
+    if history_opts.get('db', 'history.db'):
+        from history_store import HistoryStore
+        store = HistoryStore.from_config(config)
+        sinks.append(HistoryStoreSink(store))
+    if history_opts.get('recent', True):
+        from ring_buffer import DeviceHistory
+        sinks.append(RecentHistorySink(DeviceHistory.from_config(config, store)))
+    return ReadingPipeline(sinks, maxsize=opts.get('queue_size', 1000), policies=opts.get('policies'))
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_pipeline(config=None):
+    """Process-wide pipeline shared by every sensor, started on first use."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = build_pipeline(config)
+            _default.start()
+        return _default
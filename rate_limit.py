@@ -0,0 +1,243 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from metrics import REGISTRY
+
+
+class RateLimited(requests.exceptions.RequestException):
+    """A request would have had to wait longer than ``max_wait`` for its host's quota."""
+
+
+def retry_after(headers, default=60, now=None):
+    """Seconds asked for by a ``Retry-After`` header (delay or HTTP date), else ``default``."""
+    value = (headers or {}).get('Retry-After')
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - (now or time.time()))
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """
+    ``rate`` requests per second on average, in bursts of up to ``burst``.
+
+    Kept as a theoretical arrival time (GCRA), so ``reserve()`` is O(1) and
+    returns how long the caller has to wait for its token instead of
+    sleeping itself: threads ``time.sleep`` it, coroutines ``asyncio.sleep``
+    it, and both share one bucket. A rate of None never throttles, but
+    ``pause()`` (a 429's Retry-After) still holds every caller back.
+    """
+
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._step = 1.0 / rate if rate else 0.0
+        self._tolerance = (self.burst - 1) * self._step
+        self._tat = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait=None):
+        """Take a token; seconds to wait before using it, or None (nothing taken) past ``max_wait``."""
+        with self._lock:
+            now = time.monotonic()
+            tat = max(self._tat, now)
+            wait = max(0.0, tat - self._tolerance - now)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tat = tat + self._step
+            return wait
+
+    def pause(self, seconds):
+        """Hand out no tokens for ``seconds`` from now."""
+        with self._lock:
+            self._tat = max(self._tat, time.monotonic() + seconds + self._tolerance)
+
+
+class RateLimiter:
+    """
+    Per-host token buckets shared by every outbound HTTP call in the process
+    (HttpClient and the asyncio clients), so a large fleet stays inside an
+    API's quota however many devices use it.
+
+    ``limits`` maps a host to ``{"per_minute": ..., "burst": ...}``; hosts
+    without an entry are not throttled. A 429 (or a 503 with Retry-After)
+    from any host pauses that host's bucket for the time the server asked
+    for. A caller that would wait longer than ``max_wait`` gets RateLimited
+    instead, which the devices treat like any failed request.
+
+    Metrics per host: ``rate_limit.<host>.wait_seconds``, ``throttled``
+    (429s received) and ``rejected`` (RateLimited raised).
+    """
+
+    # WeatherAPI's free plan allows 1,000,000 calls a month (~23 a minute)
+    DEFAULT_LIMITS = {'api.weatherapi.com': {'per_minute': 23, 'burst': 30}}
+
+    def __init__(self, limits=None, max_wait=30, default_retry_after=60, registry=REGISTRY):
+        self.limits = self.DEFAULT_LIMITS if limits is None else limits
+        self.max_wait = max_wait
+        self.default_retry_after = default_retry_after
+        self.registry = registry
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        opts = ((config or {}).get('http') or {}).get('rate_limits') or {}
+        return cls(
+            limits=opts.get('hosts'),
+            max_wait=opts.get('max_wait', 30),
+            default_retry_after=opts.get('default_retry_after', 60),
+        )
+
+    def bucket(self, host):
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                limit = self.limits.get(host) or {}
+                per_minute = limit.get('per_minute')
+                bucket = self._buckets[host] = TokenBucket(
+                    rate=per_minute / 60 if per_minute else None, burst=limit.get('burst', 1))
+            return bucket
+
+    def reserve(self, host):
+        """Seconds to wait before calling ``host``; raises RateLimited past ``max_wait``."""
+        wait = self.bucket(host).reserve(self.max_wait)
+        if wait is None:
+            self.registry.counter(f"rate_limit.{host}.rejected").inc()
+            raise RateLimited(f"{host} is over its request quota")
+        if wait:
+            self.registry.histogram(f"rate_limit.{host}.wait_seconds").observe(wait)
+        return wait
+
+    def acquire(self, host):
+        """Blocking ``reserve``: returns once the request may go out."""
+        wait = self.reserve(host)
+        if wait:
+            time.sleep(wait)
+
+    def response(self, host, status_code, headers):
+        """Feed back a response: 429, or 503 with Retry-After, pauses the host."""
+        if status_code == 429 or (status_code == 503 and headers.get('Retry-After')):
+            self.registry.counter(f"rate_limit.{host}.throttled").inc()
+            self.bucket(host).pause(retry_after(headers, self.default_retry_after))
+
+
+class AdaptiveInterval:
+    """
+    Polling interval that follows both the data and the upstream API.
+
+    Starts at ``base``. Every failed fetch doubles it (up to
+    ``max_interval``), so a failing or throttling API isn't retried at full
+    rate; the next good fetch drops that backoff. With ``follow_data``,
+    good fetches also compare the new values with the previous ones: a
+    change of at least ``fast[field]``
+    in any field halves the interval (down to ``min_interval``),
+    ``flat_samples`` readings in a row where every field moved less than
+    ``flat[field]`` stretch it by half (up to ``max_interval``), anything
+    in between eases it back towards ``base``. A reading of an upstream
+    observation that was already seen (``observed``, e.g. served again from
+    a cache) says nothing about the trend and is not classified.
+    """
+
+    FAST = {'co2': 100, 'temperature': 1.0, 'humidity': 5}
+    FLAT = {'co2': 10, 'temperature': 0.2, 'humidity': 1}
+
+    def __init__(self, base, min_interval=None, max_interval=None, fast=None, flat=None, flat_samples=3,
+                 follow_data=True, registry=REGISTRY):
+        self.base = float(base)
+        self.min_interval = float(min_interval or self.base / 2)
+        self.max_interval = float(max_interval or self.base * 8)
+        self.fast = fast or self.FAST
+        self.flat = flat or self.FLAT
+        self.flat_samples = flat_samples
+        self.follow_data = follow_data
+        self.value_interval = self.base
+        self.failures = 0
+        self._last = None
+        self._observed = None
+        self._flat = 0
+        self.backoffs = registry.counter('adaptive.backoffs')
+        self.speedups = registry.counter('adaptive.speedups')
+        self.slowdowns = registry.counter('adaptive.slowdowns')
+
+    @classmethod
+    def from_config(cls, base, opts):
+        """
+        From an ``adaptive_polling`` section. Failed fetches always back off;
+        the interval only follows the data when the section is there and not
+        ``"enabled": false``.
+        """
+        if opts is None or not opts.get('enabled', True):
+            return cls(base, max_interval=(opts or {}).get('max_interval'), follow_data=False)
+        return cls(
+            base,
+            min_interval=opts.get('min_interval'),
+            max_interval=opts.get('max_interval'),
+            fast=opts.get('fast'),
+            flat=opts.get('flat'),
+            flat_samples=opts.get('flat_samples', 3),
+        )
+
+    @property
+    def interval(self):
+        if self.failures:
+            return min(self.max_interval, max(self.value_interval, self.base) * 2 ** self.failures)
+        return self.value_interval
+
+    def failure(self):
+        self.failures += 1
+        self.backoffs.inc()
+        return self.interval
+
+    def success(self, values, observed=None):
+        """Record a good reading (field -> value) of observation ``observed``; returns the new interval."""
+        self.failures = 0
+        if not self.follow_data:
+            return self.interval
+        if observed is not None:
+            if observed == self._observed:
+                return self.interval
+            self._observed = observed
+        last, self._last = self._last, dict(values)
+        if last is None:
+            return self.interval
+        changes = {field: abs(value - last[field]) for field, value in values.items()
+                   if value is not None and last.get(field) is not None}
+        if any(changes.get(field, 0) >= limit for field, limit in self.fast.items()):
+            self._flat = 0
+            if self.value_interval > self.min_interval:
+                self.speedups.inc()
+            self.value_interval = max(self.min_interval, self.value_interval / 2)
+        elif all(changes.get(field, 0) < limit for field, limit in self.flat.items()):
+            self._flat += 1
+            if self._flat >= self.flat_samples:
+                self._flat = 0
+                if self.value_interval < self.max_interval:
+                    self.slowdowns.inc()
+                self.value_interval = min(self.max_interval, self.value_interval * 1.5)
+        else:
+            self._flat = 0
+            self.value_interval += (self.base - self.value_interval) / 2
+        return self.interval
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter(config=None):
+    """Process-wide RateLimiter, created from config.json's ``http.rate_limits`` section on first use."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter.from_config(config)
+        return _limiter
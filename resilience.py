@@ -0,0 +1,178 @@
+import random
+import threading
+import time
+
+import requests
+
+from metrics import REGISTRY
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    """A call was refused without trying because its endpoint's circuit is open."""
+
+
+class Backoff:
+    """
+    Jittered exponential backoff: ``base`` doubling up to ``maximum``.
+
+    Each delay is drawn from ``[d * (1 - jitter), d]`` so that many devices
+    or workers that failed together don't all retry on the same tick.
+    """
+
+    def __init__(self, base=1, maximum=60, jitter=0.5):
+        self.base = base
+        self.maximum = maximum
+        self.jitter = jitter
+        self.attempts = 0
+
+    def peek(self):
+        """The un-jittered delay the next ``next()`` is drawn around."""
+        return min(self.maximum, self.base * 2 ** self.attempts)
+
+    def next(self):
+        delay = self.peek()
+        self.attempts += 1
+        return delay * (1 - self.jitter * random.random())
+
+    def reset(self):
+        self.attempts = 0
+
+
+class CircuitBreaker:
+    """
+    Fails calls to an endpoint fast while it is known to be down.
+
+    ``closed``: calls go through; ``failure_threshold`` failures in a row
+    open the circuit. ``open``: ``before()`` raises CircuitOpen at once, so
+    nobody sits on a socket that is certain to time out, until a jittered,
+    exponentially growing backoff has passed. ``half_open``: one trial call
+    is let through (everyone else still fails fast); success closes the
+    circuit and resets the backoff, failure opens it again for longer. A
+    trial that never reports back is given up after ``trial_timeout``.
+
+    Callers bracket each call with ``before()`` and ``success()`` /
+    ``failure()`` (or ``abandon()`` when the call was not made after all).
+    Metrics: ``circuit.<name>.state`` (0 closed, 1 half-open, 2 open),
+    ``opened`` and ``fast_failed``.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name, failure_threshold=3, base_backoff=5, max_backoff=300, jitter=0.5,
+                 trial_timeout=60, registry=REGISTRY):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.trial_timeout = trial_timeout
+        self.backoff = Backoff(base_backoff, max_backoff, jitter)
+        self.state = self.CLOSED
+        self.failures = 0
+        self._open_until = 0.0
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+        self._state_gauge = registry.gauge(f"circuit.{name}.state")
+        self.opened = registry.counter(f"circuit.{name}.opened")
+        self.fast_failed = registry.counter(f"circuit.{name}.fast_failed")
+
+    def _set_state(self, state):
+        self.state = state
+        self._state_gauge.set(self._STATE_VALUES[state])
+
+    def retry_in(self):
+        """Seconds until the next trial call may go out (0 when calls go through)."""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self._open_until - time.monotonic())
+
+    def before(self):
+        """Call before each attempt; raises CircuitOpen instead of letting it through."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == self.OPEN and now >= self._open_until:
+                self._set_state(self.HALF_OPEN)
+                self._trial_started = now
+                return
+            if self.state == self.HALF_OPEN and now - self._trial_started >= self.trial_timeout:
+                self._trial_started = now
+                return
+            self.fast_failed.inc()
+            raise CircuitOpen(f"{self.name} is unavailable (circuit open, retry in {self.retry_in():.0f}s)")
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                self.backoff.reset()
+                self._set_state(self.CLOSED)
+                print(f"[Resilience]   > {self.name} is back, circuit closed")
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.OPEN:
+                return                 # a call that was already in flight when the circuit opened
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                delay = self.backoff.next()
+                self._open_until = time.monotonic() + delay
+                if self.state != self.OPEN:
+                    self.opened.inc()
+                    print(f"[Resilience]   > {self.name} failing, circuit open for {delay:.0f}s")
+                self._set_state(self.OPEN)
+
+    def abandon(self):
+        """The attempt ``before()`` allowed was not made; let the next caller try instead."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trial_started = 0.0
+
+
+class CircuitBreakers:
+    """
+    One CircuitBreaker per endpoint (an HTTP host, an SMTP server), created
+    on first use with the settings of config.json's ``resilience`` section.
+    """
+
+    def __init__(self, failure_threshold=3, base_backoff=5, max_backoff=300, jitter=0.5,
+                 trial_timeout=60, registry=REGISTRY):
+        self.settings = dict(failure_threshold=failure_threshold, base_backoff=base_backoff,
+                             max_backoff=max_backoff, jitter=jitter, trial_timeout=trial_timeout)
+        self.registry = registry
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        opts = (config or {}).get('resilience') or {}
+        return cls(
+            failure_threshold=opts.get('failure_threshold', 3),
+            base_backoff=opts.get('base_backoff', 5),
+            max_backoff=opts.get('max_backoff', 300),
+            jitter=opts.get('jitter', 0.5),
+            trial_timeout=opts.get('trial_timeout', 60),
+        )
+
+    def breaker(self, name):
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name, registry=self.registry, **self.settings)
+            return breaker
+
+    def states(self):
+        with self._lock:
+            return {name: b.state for name, b in self._breakers.items()}
+
+
+_breakers = None
+_breakers_lock = threading.Lock()
+
+
+def get_breakers(config=None):
+    """Process-wide CircuitBreakers, created from config.json's ``resilience`` section on first use."""
+    global _breakers
+    with _breakers_lock:
+        if _breakers is None:
+            _breakers = CircuitBreakers.from_config(config)
+        return _breakers
@@ -0,0 +1,347 @@
+import os
+import random
+import struct
+import threading
+import time
+from array import array
+from multiprocessing import shared_memory
+
+from state_store import pid_alive, segment_name, untrack_segment
+
+COLUMNS = ('co2', 'temperature', 'humidity')
+
+
+class RingBuffer:
+    """
+    Fixed-capacity time series for one device.
+
+    Timestamps (epoch milliseconds) are kept in an int64 array and every
+    column in a float32 array, all preallocated, so a device costs
+    ``capacity * (8 + 4 * len(columns))`` bytes however long it runs. Once
+    full, each append overwrites the oldest point. Timestamps must not go
+    backwards (older points are ignored), which lets ``query`` bisect.
+    ``ts`` and ``values`` may be supplied as views of other memory (see
+    DeviceHistory).
+    """
+
+    def __init__(self, capacity, columns=COLUMNS, ts=None, values=None, size=0, head=0):
+        self.capacity = capacity
+        self.columns = columns
+        self.ts = array('q', bytes(8 * capacity)) if ts is None else ts
+        self.values = values or {name: array('f', bytes(4 * capacity)) for name in columns}
+        self.size = size
+        self.head = head   # next slot to write
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        return self.ts.itemsize * self.capacity + sum(a.itemsize * self.capacity for a in self.values.values())
+
+    def _slot(self, i):
+        """Physical slot of the i-th oldest point."""
+        return (self.head - self.size + i) % self.capacity
+
+    def last_ts(self):
+        return self.ts[self._slot(self.size - 1)] if self.size else None
+
+    def append(self, epoch, values):
+        ts = int(epoch * 1000)
+        if self.size and ts <= self.last_ts():
+            return False
+        slot = self.head
+        self.ts[slot] = ts
+        for name, column in self.values.items():
+            value = values.get(name)
+            column[slot] = float('nan') if value is None else float(value)
+        self.head = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return True
+
+    def _first_at_or_after(self, ts):
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts[self._slot(mid)] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, since=None, max_points=None):
+        """
+        Points at or after ``since`` (epoch seconds) as ``{'timestamps': [...],
+        <column>: [...]}``. With ``max_points``, consecutive points are averaged
+        into at most that many equal-count buckets.
+        """
+        start = self._first_at_or_after(int(since * 1000)) if since else 0
+        count = self.size - start
+        buckets = count if not max_points or count <= max_points else max_points
+        result = {'timestamps': []}
+        result.update((name, []) for name in self.columns)
+        for b in range(buckets):
+            lo = start + b * count // buckets
+            hi = start + (b + 1) * count // buckets
+            slots = [self._slot(i) for i in range(lo, hi)]
+            result['timestamps'].append(sum(self.ts[s] for s in slots) / len(slots) / 1000)
+            for name, column in self.values.items():
+                values = [column[s] for s in slots if column[s] == column[s]]  # skip NaN gaps
+                result[name].append(round(sum(values) / len(values), 2) if values else None)
+        return result
+
+
+# Shared memory layout of DeviceHistory (little endian):
+#   header: magic 8s, instance I, owner pid I, slots I, capacity I, used I, pad I
+#   per slot: name 64s, seq Q (odd while writing), size I, head I,
+#             ts q * capacity, then each column f * capacity
+HISTORY_MAGIC = b'IOTRING1'
+HISTORY_HEADER = struct.Struct('<8sIIIIII')
+HISTORY_USED_OFFSET = 24
+SLOT_HEADER = struct.Struct('<64sQII')
+U32 = struct.Struct('<I')
+
+# Segments written by a DeviceHistory of this process
+_owned = set()
+
+
+def history_segment(name):
+    return segment_name(f"{name}.history")
+
+
+class DeviceHistory:
+    """
+    Recent readings, one RingBuffer per device, written by the sensor
+    process (RecentHistorySink records every reading the pipeline carries)
+    into a shared memory segment that the dashboards read through
+    DeviceHistoryReader. Each device slot is guarded by a seqlock.
+
+    Like StateWriter, only one DeviceHistory in one live process writes a
+    segment; a second one keeps its rings in private memory, as do devices past ``slots``
+    (from_config sizes it for every configured device). With a
+    HistoryStore, a device's ring is seeded from history.db when the device
+    first reports, so restarting the sensor process doesn't empty the charts.
+    """
+
+    def __init__(self, name='recent', slots=64, capacity=4096, max_age=6 * 3600, columns=COLUMNS, store=None):
+        self.name = name
+        self.capacity = capacity
+        self.max_age = max_age
+        self.columns = columns
+        self.store = store
+        self.slot_size = SLOT_HEADER.size + capacity * (8 + 4 * len(columns))
+        self.slot_count = slots
+        self._buffers = {}
+        self._offsets = {}
+        self._lock = threading.Lock()
+        self.shm = None
+        self._opened = False
+        self._full_warned = False
+
+    @classmethod
+    def from_config(cls, config, store=None):
+        opts = (config or {}).get('history') or {}
+        # Without a devices list the flat keys describe a single device
+        configured = len((config or {}).get('devices') or ()) or 1
+        return cls(
+            slots=opts.get('recent_devices') or max(64, configured),
+            capacity=opts.get('recent_points', 4096),
+            max_age=opts.get('recent_hours', 6) * 3600,
+            store=store,
+        )
+
+    def _open(self, name):
+        if name in _owned:
+            print(f"[history]   > Recent history '{self.name}' already has a writer in this process, "
+                  f"keeping this one private")
+            return None
+        size = HISTORY_HEADER.size + self.slot_count * self.slot_size
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            shm = shared_memory.SharedMemory(name=name)
+            magic, _, owner, _, _, _, _ = HISTORY_HEADER.unpack_from(shm.buf, 0)
+            if magic == HISTORY_MAGIC and owner != os.getpid() and pid_alive(owner):
+                print(f"[history]   > Recent history '{self.name}' is written by process {owner}, "
+                      f"keeping it in this process only")
+                untrack_segment(shm)
+                shm.close()
+                return None
+            if shm.size < size:
+                shm.close()
+                shm.unlink()
+                return self._open(name)
+        except OSError as e:
+            print(f"[history]   > Shared memory unavailable ({e}), keeping recent history in this process")
+            return None
+        shm.buf[:size] = bytes(size)
+        HISTORY_HEADER.pack_into(shm.buf, 0, HISTORY_MAGIC, random.getrandbits(32), os.getpid(),
+                                 self.slot_count, self.capacity, 0, 0)
+        return shm
+
+    def _buffer(self, device):
+        buffer = self._buffers.get(device)
+        if buffer is not None:
+            return buffer
+        if not self._opened:
+            self._opened = True
+            self.shm = self._open(history_segment(self.name))
+            if self.shm is not None:
+                _owned.add(self.shm.name)
+        offset = None
+        if self.shm is not None and len(self._offsets) < self.slot_count:
+            offset = HISTORY_HEADER.size + len(self._offsets) * self.slot_size
+            SLOT_HEADER.pack_into(self.shm.buf, offset, device.encode('utf-8')[:64], 0, 0, 0)
+            self._offsets[device] = offset
+            U32.pack_into(self.shm.buf, HISTORY_USED_OFFSET, len(self._offsets))
+            ts, values = _slot_views(self.shm.buf, offset + SLOT_HEADER.size, self.capacity, self.columns)
+            buffer = RingBuffer(self.capacity, self.columns, ts, values)
+        else:
+            if self.shm is not None and not self._full_warned:
+                print(f"[history]   > All {self.slot_count} shared history slots in use; '{device}' and "
+                      f"later devices are not charted (raise history.recent_devices)")
+                self._full_warned = True
+            buffer = RingBuffer(self.capacity, self.columns)
+        self._buffers[device] = buffer
+        if self.store is not None:
+            self._backfill(device, buffer)
+        return buffer
+
+    def _backfill(self, device, buffer):
+        try:
+            rows = self.store.query(device, start=time.time() - self.max_age)
+        except Exception as e:
+            print(f"[history]   > Could not load recent history of '{device}': {e}")
+            return
+        for epoch, *values in rows[-self.capacity:]:
+            self._append(device, buffer, epoch, dict(zip(COLUMNS, values)))
+
+    def _append(self, device, buffer, epoch, values):
+        offset = self._offsets.get(device)
+        if offset is None:
+            return buffer.append(epoch, values)
+        buf = self.shm.buf
+        seq = SLOT_HEADER.unpack_from(buf, offset)[1]
+        struct.pack_into('<Q', buf, offset + 64, seq + 1)          # odd: readers retry
+        added = buffer.append(epoch, values)
+        struct.pack_into('<QII', buf, offset + 64, seq + 2, buffer.size, buffer.head)
+        return added
+
+    def add(self, reading):
+        device = reading.get('device') or 'default'
+        epoch = reading.get('epoch') or time.time()
+        with self._lock:
+            return self._append(device, self._buffer(device), epoch, reading)
+
+    def close(self):
+        with self._lock:
+            if self.shm is not None:
+                # Drop the views into the segment before unmapping it
+                self._buffers.clear()
+                name = self.shm.name
+                owner = HISTORY_HEADER.unpack_from(self.shm.buf, 0)[2]
+                self.shm.close()
+                if owner == os.getpid():
+                    try:
+                        self.shm.unlink()
+                    except FileNotFoundError:
+                        pass
+                _owned.discard(name)
+                self.shm = None
+
+
+def _slot_views(buf, start, capacity, columns):
+    """Typed views of the timestamp and column arrays of a slot starting at ``start``."""
+    ts = buf[start:start + 8 * capacity].cast('q')
+    start += 8 * capacity
+    values = {}
+    for name in columns:
+        values[name] = buf[start:start + 4 * capacity].cast('f')
+        start += 4 * capacity
+    return ts, values
+
+
+class DeviceHistoryReader:
+    """
+    Reader side of DeviceHistory for the dashboards: ``devices()`` and
+    ``query()``. A query copies the device's slot out under
+    its seqlock and answers from the copy. The segment is re-attached
+    every ``retry_interval`` seconds, to follow a restarted writer.
+    """
+
+    def __init__(self, name='recent', max_age=6 * 3600, columns=COLUMNS, retry_interval=1.0):
+        self.segment = history_segment(name)
+        self.max_age = max_age
+        self.columns = columns
+        self.retry_interval = retry_interval
+        self._shm = None
+        self._instance = None
+        self._slots = {}
+        self._next_attach = 0.0
+        self._lock = threading.Lock()
+
+    def _attach(self):
+        # Like StateStore: re-open by name to notice a gone or restarted writer
+        if time.monotonic() < self._next_attach:
+            return self._shm
+        self._next_attach = time.monotonic() + self.retry_interval
+        try:
+            fresh = shared_memory.SharedMemory(name=self.segment)
+        except (FileNotFoundError, OSError):
+            fresh = None
+        header = HISTORY_HEADER.unpack_from(fresh.buf, 0) if fresh is not None else None
+        if fresh is not None and header[2] != os.getpid():
+            untrack_segment(fresh)
+        if header is not None and header[0] != HISTORY_MAGIC:
+            fresh.close()
+            fresh = header = None
+        if fresh is not None and self._shm is not None and header[1] == self._instance:
+            fresh.close()
+            return self._shm
+        if self._shm is not None:
+            self._shm.close()
+        self._shm = fresh
+        self._slots = {}
+        self._instance = None
+        if header is not None:
+            _, self._instance, _, self.slot_count, self.capacity, _, _ = header
+            self.slot_size = SLOT_HEADER.size + self.capacity * (8 + 4 * len(self.columns))
+        return fresh
+
+    def _offsets(self, shm):
+        used = min(U32.unpack_from(shm.buf, HISTORY_USED_OFFSET)[0], self.slot_count)
+        # Slots are never reassigned while the writer lives
+        for index in range(len(self._slots), used):
+            offset = HISTORY_HEADER.size + index * self.slot_size
+            name = SLOT_HEADER.unpack_from(shm.buf, offset)[0].rstrip(b'\0').decode('utf-8', 'replace')
+            self._slots[name] = offset
+        return self._slots
+
+    def devices(self):
+        with self._lock:
+            shm = self._attach()
+            return sorted(self._offsets(shm)) if shm is not None else []
+
+    def _copy(self, shm, offset, retries=1000):
+        buf = shm.buf
+        for _ in range(retries):
+            _, seq, size, head = SLOT_HEADER.unpack_from(buf, offset)
+            if seq % 2:
+                time.sleep(0)
+                continue
+            data = bytes(buf[offset + SLOT_HEADER.size:offset + self.slot_size])
+            if SLOT_HEADER.unpack_from(buf, offset)[1] == seq:
+                ts, values = _slot_views(memoryview(data), 0, self.capacity, self.columns)
+                return RingBuffer(self.capacity, self.columns, ts, values, size, head)
+        raise TimeoutError('history slot kept changing while reading')
+
+    def query(self, device, since=None, max_points=None):
+        """Downsampled points of a device no older than ``max_age``; None for unknown devices."""
+        since = max(since or 0, time.time() - self.max_age)
+        with self._lock:
+            shm = self._attach()
+            offset = self._offsets(shm).get(device) if shm is not None else None
+            if offset is None:
+                return None
+            buffer = self._copy(shm, offset)
+        return buffer.query(since, max_points)
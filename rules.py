@@ -0,0 +1,320 @@
+"""
+Declarative threshold rules, compiled once into per-device evaluators.
+
+config.json may carry a ``rules`` list; every entry watches one metric::
+
+    {"metric": "co2", "above": 1000}                       static threshold
+    {"metric": "humidity", "below": 20, "severity": "danger"}
+    {"metric": "co2", "above": 1000, "for": 300}           held for 5 minutes
+    {"metric": "temperature", "rate_above": 2, "per": 60}  rising > 2 per minute
+    {"metric": "co2", "above": 800, "devices": ["Office"]} only some devices
+
+Optional keys: ``name``, ``severity`` (``warning``/``danger``), ``message``.
+The legacy ``temperature_limit`` / ``humidity_limit`` / ``co2_limit`` keys
+become warning rules at the limit and danger rules a little above it (the
+levels the dashboards always used), so old configs behave as before.
+
+Per (device, metric), rules of the same kind are kept sorted by threshold
+and matched with one bisect; duration and rate rules share one sliding
+window per distinct length. Evaluating a reading therefore costs
+O(windows + log rules) instead of one comparison per rule.
+"""
+import json
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+METRICS = {
+    'co2': ('CO2', ' ppm'),
+    'temperature': ('Temperature', '°C'),
+    'humidity': ('Humidity', '%'),
+}
+SEVERITIES = ('warning', 'danger')
+
+# Legacy flat limits: (config key, metric, default, danger multiplier)
+LEGACY_LIMITS = (
+    ('co2_limit', 'co2', 1000, 1.2),
+    ('temperature_limit', 'temperature', None, 1.15),
+    ('humidity_limit', 'humidity', None, 1.15),
+)
+
+
+class Rule:
+    """One parsed rule entry."""
+
+    def __init__(self, spec, index=0):
+        self.spec = spec
+        self.metric = spec.get('metric')
+        if self.metric not in METRICS:
+            raise ValueError(f"Rule {index}: unknown metric {self.metric!r} (expected one of {sorted(METRICS)})")
+        kinds = [k for k in ('above', 'below', 'rate_above', 'rate_below') if spec.get(k) is not None]
+        if len(kinds) != 1:
+            raise ValueError(f"Rule {index}: needs exactly one of above/below/rate_above/rate_below")
+        self.kind = kinds[0]
+        self.threshold = float(spec[self.kind])
+        self.severity = spec.get('severity', 'warning')
+        if self.severity not in SEVERITIES:
+            raise ValueError(f"Rule {index}: unknown severity {self.severity!r}")
+        self.window = float(spec.get('for', 0)) if self.kind in ('above', 'below') else float(spec.get('per', 60))
+        if self.window < 0 or (self.kind.startswith('rate') and self.window == 0):
+            raise ValueError(f"Rule {index}: window must be positive")
+        devices = spec.get('devices', spec.get('device'))
+        self.devices = {devices} if isinstance(devices, str) else (set(devices) if devices else None)
+        self.name = spec.get('name') or f"{self.metric}_{self.kind}_{self.threshold:g}" + (
+            f"_{self.window:g}s" if self.window else '')
+        self.template = spec.get('message')
+
+    @property
+    def static(self):
+        return self.kind in ('above', 'below') and not self.window
+
+    def applies_to(self, device):
+        return self.devices is None or device in self.devices
+
+    def message(self, value):
+        label, unit = METRICS[self.metric]
+        if self.template:
+            return self.template.format(value=value, threshold=self.threshold, metric=self.metric)
+        level = 'Very high' if self.severity == 'danger' else 'High'
+        if self.kind == 'above':
+            text = f"{level} {label}: {round(value, 1):g}{unit} > {self.threshold:g}{unit}"
+        elif self.kind == 'below':
+            level = 'Very low' if self.severity == 'danger' else 'Low'
+            text = f"{level} {label}: {round(value, 1):g}{unit} < {self.threshold:g}{unit}"
+        else:
+            direction = 'rising' if self.kind == 'rate_above' else 'falling'
+            return f"{label} {direction} fast: {value:+.1f}{unit} per {_duration(self.window)}"
+        if self.window:
+            text += f" for {_duration(self.window)}"
+        return text
+
+
+def _duration(seconds):
+    if seconds % 3600 == 0:
+        return f"{seconds / 3600:g} h"
+    if seconds % 60 == 0:
+        return f"{seconds / 60:g} min"
+    return f"{seconds:g} s"
+
+
+class _Tier:
+    """Rules of one kind on one input, sorted by threshold for bisect matching."""
+
+    def __init__(self, rules, above):
+        self.above = above
+        self.rules = sorted(rules, key=lambda r: r.threshold)
+        self.thresholds = [r.threshold for r in self.rules]
+
+    def match(self, value):
+        """The most severe matched rule: the highest threshold below an 'above' value, and vice versa."""
+        if self.above:
+            k = bisect_left(self.thresholds, value)
+            return self.rules[k - 1] if k else None
+        k = bisect_right(self.thresholds, value)
+        return self.rules[k] if k < len(self.rules) else None
+
+    def lowest(self):
+        return self.rules[0] if self.rules else None
+
+
+class _Window:
+    """
+    Samples of one metric covering the last ``seconds``, plus the one just
+    before (so "held for T" and "change over T" can be decided), with
+    monotonic deques for O(1) amortized window min / max.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.samples = deque()
+        self._min = deque()
+        self._max = deque()
+
+    def add(self, ts, value):
+        self.samples.append((ts, value))
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((ts, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((ts, value))
+        boundary = ts - self.seconds
+        while len(self.samples) > 1 and self.samples[1][0] <= boundary:
+            self.samples.popleft()
+        first = self.samples[0][0]
+        while self._min[0][0] < first:
+            self._min.popleft()
+        while self._max[0][0] < first:
+            self._max.popleft()
+
+    def covered(self):
+        return self.samples[0][0] <= self.samples[-1][0] - self.seconds
+
+    def low(self):
+        return self._min[0][1]
+
+    def high(self):
+        return self._max[0][1]
+
+    def rate(self):
+        (t0, v0), (t1, v1) = self.samples[0], self.samples[-1]
+        return (v1 - v0) / (t1 - t0) * self.seconds if t1 > t0 else 0.0
+
+
+class MetricEvaluator:
+    """Compiled rules (and their window state) for one metric of one device."""
+
+    def __init__(self, rules):
+        static = [r for r in rules if r.static]
+        self.static_above = _Tier([r for r in static if r.kind == 'above'], above=True)
+        self.static_below = _Tier([r for r in static if r.kind == 'below'], above=False)
+        self.windows = []
+        for seconds in sorted({r.window for r in rules if not r.static}):
+            group = [r for r in rules if not r.static and r.window == seconds]
+            tiers = [(kind, _Tier([r for r in group if r.kind == kind], above=kind in ('above', 'rate_above')))
+                     for kind in ('above', 'below', 'rate_above', 'rate_below')]
+            self.windows.append((_Window(seconds), [(k, t) for k, t in tiers if t.rules]))
+
+    def evaluate(self, value, ts):
+        """List of (rule, value) matches for one sample, most severe per tier."""
+        matches = []
+        for tier in (self.static_above, self.static_below):
+            rule = tier.match(value)
+            if rule:
+                matches.append((rule, value))
+        for window, tiers in self.windows:
+            window.add(ts, value)
+            if not window.covered():
+                continue
+            for kind, tier in tiers:
+                observed = {'above': window.low, 'below': window.high}.get(kind, window.rate)()
+                rule = tier.match(observed)
+                if rule:
+                    matches.append((rule, observed))
+        return matches
+
+    def status(self, value):
+        """'danger', 'warning' or 'normal' from the static rules alone."""
+        levels = [r.severity for r in (self.static_above.match(value), self.static_below.match(value)) if r]
+        if 'danger' in levels:
+            return 'danger'
+        return 'warning' if levels else 'normal'
+
+
+class Evaluation:
+    """
+    Result of evaluating one reading.
+
+    ``warnings`` are the human-readable messages, ``limits`` maps each
+    metric to its lowest static "above" threshold (what the alert engine
+    applies hysteresis to) and ``conditions`` names every other matched
+    rule (escalations, duration, rate and "below" rules).
+    ``condition_limits`` gives the (metric, kind, threshold) of the matched
+    static conditions, so the alert engine can apply the same clear margin
+    to them.
+    """
+
+    def __init__(self, matches, limit_rules):
+        self.matches = matches
+        self.warnings = [rule.message(value) for rule, value in matches]
+        self.limits = {metric: rule.threshold for metric, rule in limit_rules.items()}
+        others = [rule for rule, _ in matches if rule not in limit_rules.values()]
+        self.conditions = [rule.name for rule in others]
+        self.condition_limits = {rule.name: (rule.metric, rule.kind, rule.threshold)
+                                 for rule in others if rule.static}
+
+    @property
+    def status(self):
+        if any(rule.severity == 'danger' for rule, _ in self.matches):
+            return 'danger'
+        return 'warning' if self.matches else 'normal'
+
+
+class RuleSet:
+    """
+    Rules compiled from one config, with lazily built per-device evaluators.
+
+    Window state (for duration and rate rules) lives in the per-device
+    evaluators, so one RuleSet must be reused across readings.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        rules = []
+        for key, metric, default, danger in LEGACY_LIMITS:
+            limit = config.get(key, default)
+            if limit is None:
+                continue
+            limit = float(limit)
+            rules.append(Rule({'name': key, 'metric': metric, 'above': limit}))
+            rules.append(Rule({'name': f"{key}_danger", 'metric': metric,
+                               'above': round(limit * danger, 6), 'severity': 'danger'}))
+        rules.extend(Rule(spec, i) for i, spec in enumerate(config.get('rules') or []))
+        return cls(rules)
+
+    def _for_device(self, device):
+        evaluators = self._devices.get(device)
+        if evaluators is None:
+            with self._lock:
+                evaluators = self._devices.get(device)
+                if evaluators is None:
+                    evaluators = {}
+                    for metric in METRICS:
+                        rules = [r for r in self.rules if r.metric == metric and r.applies_to(device)]
+                        if rules:
+                            evaluators[metric] = MetricEvaluator(rules)
+                    self._devices[device] = evaluators
+        return evaluators
+
+    def evaluate(self, device, values, ts=None):
+        """Evaluate one reading (``values``: metric -> number) of a device."""
+        ts = time.time() if ts is None else ts
+        matches = []
+        limits = {}
+        for metric, evaluator in self._for_device(device).items():
+            value = values.get(metric)
+            if value is None:
+                continue
+            matches.extend(evaluator.evaluate(float(value), ts))
+            lowest = evaluator.static_above.lowest()
+            if lowest is not None:
+                limits[metric] = lowest
+        return Evaluation(matches, limits)
+
+    def evaluate_batch(self, device, readings):
+        """Evaluate a time-ordered batch of reading dicts (each with an ``epoch``)."""
+        return [self.evaluate(device, r, r.get('epoch')) for r in readings]
+
+    def status(self, metric, value, device=None):
+        """Dashboard colour of a single value: 'danger', 'warning' or 'normal'."""
+        evaluator = self._for_device(device).get(metric)
+        return evaluator.status(float(value)) if evaluator else 'normal'
+
+
+_cache = (None, None, None)
+_cache_lock = threading.Lock()
+
+
+def rules_for(config):
+    """
+    The compiled RuleSet for a config, reused as long as the rule-relevant
+    keys are unchanged (so window state survives config reloads). Passing
+    the same config snapshot again costs a single identity check.
+    """
+    global _cache
+    config = config or {}
+    with _cache_lock:
+        if _cache[0] is config:
+            return _cache[2]
+        fingerprint = json.dumps([config.get(key) for key, _, _, _ in LEGACY_LIMITS] + [config.get('rules')],
+                                 sort_keys=True)
+        ruleset = _cache[2] if _cache[1] == fingerprint else RuleSet.from_config(config)
+        _cache = (config, fingerprint, ruleset)
+        return ruleset
@@ -0,0 +1,115 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import REGISTRY
+
+
+class DeadlineScheduler:
+    """
+    Heap of ``time.monotonic()`` deadlines dispatching due jobs onto a small pool.
+
+    One dispatcher thread sleeps until the earliest deadline, pops every job
+    that is due and hands it to a ThreadPoolExecutor, so thousands of devices
+    can share a handful of threads instead of each sleeping in its own loop.
+
+    Metrics (in ``metrics.REGISTRY``, prefixed with the scheduler name):
+      - ``dispatch_lag_seconds``: deadline -> handed to the pool, per job
+      - ``start_lag_seconds``: deadline -> a worker actually started it
+      - ``tick_lag_seconds``: worst dispatch lag of each dispatcher wake-up
+      - ``pending`` / ``dispatched``: jobs waiting in the heap / dispatched so far
+    A growing start lag with a flat dispatch lag means the pool is saturated;
+    a growing dispatch lag means the dispatcher itself is falling behind.
+    """
+
+    def __init__(self, max_workers=8, name='scheduler', registry=REGISTRY):
+        self.name = name
+        self.max_workers = max_workers
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._executor = None
+        self._thread = None
+
+        self.dispatch_lag = registry.histogram(f"{name}.dispatch_lag_seconds")
+        self.start_lag = registry.histogram(f"{name}.start_lag_seconds")
+        self.tick_lag = registry.histogram(f"{name}.tick_lag_seconds")
+        self.last_tick_lag = registry.gauge(f"{name}.last_tick_lag_seconds")
+        self.pending = registry.gauge(f"{name}.pending")
+        self.dispatched = registry.counter(f"{name}.dispatched")
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        with self._cond:
+            self._stopped = True
+            self._heap.clear()
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._executor:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def schedule_at(self, deadline, fn, *args):
+        """Run ``fn(*args)`` on the pool once ``time.monotonic()`` reaches ``deadline``."""
+        with self._cond:
+            if self._stopped:
+                return
+            seq = next(self._seq)
+            heapq.heappush(self._heap, (deadline, seq, fn, args))
+            self.pending.set(len(self._heap))
+            # Only wake the dispatcher if this job is now the earliest one
+            if self._heap[0][1] == seq:
+                self._cond.notify()
+
+    def schedule_in(self, delay, fn, *args):
+        self.schedule_at(time.monotonic() + delay, fn, *args)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._heap:
+                        delay = self._heap[0][0] - time.monotonic()
+                        if delay <= 0:
+                            break
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait()
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap))
+                self.pending.set(len(self._heap))
+
+            worst = 0.0
+            for deadline, _, fn, args in due:
+                lag = time.monotonic() - deadline
+                worst = max(worst, lag)
+                self.dispatch_lag.observe(lag)
+                try:
+                    self._executor.submit(self._invoke, deadline, fn, args)
+                except RuntimeError:
+                    # Pool shut down underneath us
+                    return
+            self.dispatched.inc(len(due))
+            self.tick_lag.observe(worst)
+            self.last_tick_lag.set(round(worst, 6))
+
+    def _invoke(self, deadline, fn, args):
+        self.start_lag.observe(time.monotonic() - deadline)
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"[{self.name}]   > Scheduled job {getattr(fn, '__name__', fn)} failed: {e}")
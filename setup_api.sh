@@ -170,6 +170,11 @@ if [ "$SKIP_CONFIG" != "true" ]; then
     "city": "$CITY",
     "country_code": "$COUNTRY_CODE"
   },
+  "_comment": "To run several sensors from one process, rename \"_devices_example\" to \"devices\". Each entry has its own type (csv or weather) and interval; keys left out come from the settings above. See START.md, \"Run Many Devices\".",
+  "_devices_example": [
+    {"name": "Bangalore", "type": "weather", "city": "Bangalore", "country_code": "IN", "interval": 60},
+    {"name": "London", "type": "weather", "city": "London", "country_code": "GB"}
+  ],
   "email": {
     "enabled": $EMAIL_ENABLED,
     "smtp_server": "smtp.gmail.com",
@@ -0,0 +1,180 @@
+import json
+
+from alert_dispatcher import get_dispatcher
+from state_store import StateWriter
+from thingspeak import to_update
+
+
+class Sink:
+    """
+    Consumer of published readings; runs on its own pipeline worker thread.
+
+    ``handle(sensor, reading, cfg)`` receives the publishing sensor, the
+    reading dict and the config snapshot the reading was evaluated with.
+    """
+
+    name = 'sink'
+    default_policy = 'block'
+
+    def handle(self, sensor, reading, cfg):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class StateFileSink(Sink):
+    """
+    Publishes the latest reading for the dashboards: into shared memory
+    (see state_store.py) and, unless ``write_file`` is off, atomically into
+    the sensor's state file.
+    """
+
+    name = 'state'
+    # Only the newest reading per device is worth writing
+    default_policy = 'coalesce'
+
+    def __init__(self, write_file=True):
+        self.write_file = write_file
+        self._writers = {}
+
+    def handle(self, sensor, reading, cfg):
+        try:
+            writer = self._writers.get(sensor.state_file)
+            if writer is None:
+                writer = self._writers[sensor.state_file] = StateWriter(sensor.state_file, write_file=self.write_file)
+            writer.publish(reading)
+        except Exception as e:
+            print(f"[{sensor.name}]   > Failed to save state for web dashboard: {e}")
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+
+
+class EmailSink(Sink):
+    """
+    Sends the sensor's alert email when a reading has warnings.
+
+    With an ``engine`` (AlertEngine) only new breaches outside their cooldown
+    are emailed right away; everything else goes into the periodic digest.
+    """
+
+    name = 'email'
+
+    def __init__(self, engine=None):
+        self.engine = engine
+
+    def handle(self, sensor, reading, cfg):
+        email_cfg = cfg.get('email') if cfg else None
+        enabled = bool(email_cfg and email_cfg.get('enabled'))
+        if self.engine is None:
+            if reading['warnings'] and enabled:
+                subject, body = sensor.format_alert(reading)
+                sensor._send_email_alert(subject, body, email_cfg)
+            return
+        if self.engine.observe(sensor.name, reading) and enabled:
+            subject, body = sensor.format_alert(reading)
+            sensor._send_email_alert(subject, body, email_cfg)
+        digest = self.engine.digest()
+        if digest and enabled:
+            get_dispatcher().submit(email_cfg, *digest, source='alerts')
+
+
+class ThingSpeakSink(Sink):
+    """
+    Uploads readings to the sensor's ThingSpeak channel.
+
+    Sensors with a known channel id go through the batching uploader (bulk
+    JSON endpoint); others fall back to one update request per reading.
+
+    With an ``outbox`` every reading is first written to disk and the
+    replayer uploads it from there, so nothing is lost while ThingSpeak or
+    the network is down. The queue in front of it then blocks instead of
+    dropping: handling a reading is a local insert, and the outbox applies
+    its own bound.
+    """
+
+    name = 'thingspeak'
+    # Without an outbox, the freshest readings are the ones worth keeping
+    default_policy = 'drop_oldest'
+
+    def __init__(self, uploader=None, outbox=None):
+        self.uploader = uploader
+        self.outbox = outbox
+        self.replayer = None
+        if outbox is not None:
+            self.default_policy = 'block'
+            from outbox import OutboxReplayer
+            self.replayer = OutboxReplayer(outbox, uploader)
+
+    def handle(self, sensor, reading, cfg):
+        channel_id = getattr(sensor, 'channel_id', None)
+        if self.outbox is not None:
+            self.replayer.start()
+            self.outbox.append(channel_id, sensor.api_key, to_update(reading))
+        elif self.uploader is not None and channel_id:
+            self.uploader.start()
+            self.uploader.add(channel_id, sensor.api_key, reading)
+        else:
+            sensor._send_to_thingspeak(reading['co2'], reading['temperature'], reading['humidity'])
+
+    def close(self):
+        if self.replayer is not None:
+            # Whatever is still queued stays on disk for the next start
+            self.replayer.stop()
+            self.outbox.close()
+        elif self.uploader is not None:
+            self.uploader.close()
+
+
+class HistoryFileSink(Sink):
+    """Appends every reading as one JSON line to a local history file."""
+
+    name = 'history'
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def handle(self, sensor, reading, cfg):
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._file.write(json.dumps(reading) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class HistoryStoreSink(Sink):
+    """Records every reading in the local SQLite history (see history_store.py)."""
+
+    name = 'history_db'
+
+    def __init__(self, store):
+        self.store = store
+
+    def handle(self, sensor, reading, cfg):
+        self.store.start()
+        self.store.add(reading)
+
+    def close(self):
+        self.store.close()
+
+
+class RecentHistorySink(Sink):
+    """Keeps the last hours of every device in shared ring buffers for the dashboards (see ring_buffer.py)."""
+
+    name = 'recent'
+
+    def __init__(self, history):
+        self.history = history
+
+    def handle(self, sensor, reading, cfg):
+        self.history.add(reading)
+
+    def close(self):
+        self.history.close()
@@ -0,0 +1,358 @@
+"""
+Latest-reading snapshot shared between the sensor process and the dashboards.
+
+The writer publishes each reading into a ``multiprocessing.shared_memory``
+segment with one seqlocked slot per device, and (for compatibility with
+anything that still reads it) atomically replaces the JSON state file with
+the newest reading of any device. Readers in other processes copy a record
+out of shared memory without locks or syscalls and only parse it when its
+version changed; when no writer segment exists they fall back to the state
+file.
+
+A segment has a single writer: the process that created it. Another process
+that finds the segment while its owner is alive refuses to write to it (it
+would share the seqlocks) and uses the state file only; a segment whose
+owner died is taken over.
+
+Segment layout (little endian)::
+
+    magic     8s  b'IOTSHM02'
+    instance  I   random id of the writer that created the segment
+    owner     I   pid of that writer
+    slots     I   number of device slots
+    slot_size I   bytes per slot, slot header included
+    latest    I   index of the slot published last
+    used      I   slots handed out so far
+    slots...  per slot:
+        seq     Q    even = stable, odd = write in progress; version = seq // 2
+        length  I    bytes of JSON payload
+        name    64s  device name (UTF-8, NUL padded)
+        payload slot_size - 76 bytes of compact JSON
+"""
+import atexit
+import hashlib
+import json
+import os
+import random
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+MAGIC = b'IOTSHM02'
+HEADER = struct.Struct('<8sIIIIII')
+LATEST_OFFSET = 24
+USED_OFFSET = 28
+SLOT = struct.Struct('<QI64s')
+SEQ = struct.Struct('<Q')
+U32 = struct.Struct('<I')
+DEFAULT_SLOTS = 256
+DEFAULT_SLOT_SIZE = 4096
+NO_SLOT = 0xFFFFFFFF
+
+# Segments this process writes (and whose resource tracker entry it keeps)
+_owned = set()
+
+
+def segment_name(state_file):
+    """Short, portable shared memory name for a state file path."""
+    digest = hashlib.blake2b(os.path.abspath(state_file).encode('utf-8'), digest_size=8).hexdigest()
+    return f"iot_{digest}"
+
+
+def write_file_atomic(path, data):
+    """Replace ``path`` with ``data`` (bytes) so readers never see a half-written file."""
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def untrack_segment(shm):
+    """
+    Attaching registers a segment with this process's resource tracker,
+    which would unlink it when we exit; only its writer may remove it.
+    """
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+def pid_alive(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True     # exists, owned by another user
+    return True
+
+
+class StateWriter:
+    """
+    Publishes readings for one state file (shared memory + file fallback).
+
+    Each device gets its own slot, so every device's latest reading stays
+    visible however many share the state file. One writer per state file:
+    threads of the owning process share it (writes are serialized by a
+    lock); a second StateWriter, in this or another live process, gets no
+    segment and only writes the file. A segment left behind by a crashed
+    writer is taken over. The segment is removed when its owner closes (or
+    exits), after which readers use the file.
+    """
+
+    def __init__(self, state_file, slots=DEFAULT_SLOTS, slot_size=DEFAULT_SLOT_SIZE, write_file=True):
+        self.state_file = state_file
+        self.write_file = write_file
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._full_warned = False
+        self.version = 0
+        self.shm = self._open(segment_name(state_file), slots, slot_size)
+        if self.shm is not None:
+            _owned.add(self.shm.name)
+            _, self.instance, _, self.slot_count, self.slot_size, _, used = HEADER.unpack_from(self.shm.buf, 0)
+            for index in range(used):
+                name = self._slot_name(index)
+                if name:
+                    self._slots[name] = index
+        atexit.register(self.close)
+
+    def _open(self, name, slots, slot_size):
+        if name in _owned:
+            print(f"[state]   > {self.state_file} already has a writer in this process, using the file only")
+            return None
+        size = HEADER.size + slots * slot_size
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            shm = shared_memory.SharedMemory(name=name)
+            magic, _, owner, _, _, _, _ = HEADER.unpack_from(shm.buf, 0)
+            if magic == MAGIC and owner != os.getpid() and pid_alive(owner):
+                print(f"[state]   > {self.state_file} is being written by process {owner}, using the file only")
+                untrack_segment(shm)
+                shm.close()
+                return None
+            if shm.size < size:
+                # Too small for this layout: replace the dead writer's segment
+                shm.close()
+                shm.unlink()
+                return self._open(name, slots, slot_size)
+            print(f"[state]   > Taking over the shared state of {self.state_file} from a stopped writer")
+        except OSError as e:
+            print(f"[state]   > Shared memory unavailable ({e}), using {self.state_file} only")
+            return None
+        shm.buf[:size] = bytes(size)
+        HEADER.pack_into(shm.buf, 0, MAGIC, random.getrandbits(32), os.getpid(), slots, slot_size, NO_SLOT, 0)
+        return shm
+
+    def _slot_offset(self, index):
+        return HEADER.size + index * self.slot_size
+
+    def _slot_name(self, index):
+        raw = SLOT.unpack_from(self.shm.buf, self._slot_offset(index))[2]
+        return raw.rstrip(b'\0').decode('utf-8', 'replace')
+
+    def _slot_for(self, device):
+        index = self._slots.get(device)
+        if index is None:
+            if len(self._slots) >= self.slot_count:
+                if not self._full_warned:
+                    print(f"[state]   > All {self.slot_count} shared state slots in use; "
+                          f"'{device}' is only in {self.state_file}")
+                    self._full_warned = True
+                return None
+            index = self._slots[device] = len(self._slots)
+            SLOT.pack_into(self.shm.buf, self._slot_offset(index), 0, 0, device.encode('utf-8')[:64])
+            U32.pack_into(self.shm.buf, USED_OFFSET, index + 1)
+        return index
+
+    def publish(self, reading):
+        """Store the latest reading of its device; returns the slot's version."""
+        payload = json.dumps(reading, separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            if self.shm is not None:
+                index = self._slot_for(str(reading.get('device') or 'default'))
+                if index is not None and len(payload) > self.slot_size - SLOT.size:
+                    print(f"[state]   > Reading too large for shared memory ({len(payload)} bytes)")
+                elif index is not None:
+                    buf = self.shm.buf
+                    offset = self._slot_offset(index)
+                    seq = SEQ.unpack_from(buf, offset)[0]
+                    seq += 1 if seq % 2 == 0 else 0
+                    SEQ.pack_into(buf, offset, seq)                 # odd: readers retry
+                    U32.pack_into(buf, offset + 8, len(payload))
+                    buf[offset + SLOT.size:offset + SLOT.size + len(payload)] = payload
+                    SEQ.pack_into(buf, offset, seq + 1)             # even: stable again
+                    U32.pack_into(buf, LATEST_OFFSET, index)
+                    self.version = (seq + 1) // 2
+            if self.write_file:
+                write_file_atomic(self.state_file, json.dumps(reading, indent=2).encode('utf-8'))
+        return self.version
+
+    def close(self):
+        with self._lock:
+            if self.shm is not None:
+                name = self.shm.name
+                # Only the owner removes it; a taken-over segment now belongs to us
+                owner = HEADER.unpack_from(self.shm.buf, 0)[2]
+                self.shm.close()
+                if owner == os.getpid():
+                    try:
+                        self.shm.unlink()
+                    except FileNotFoundError:
+                        pass
+                _owned.discard(name)
+                self.shm = None
+
+
+class SharedStateReader:
+    """Lock-free reader of a StateWriter segment in any process."""
+
+    def __init__(self, name):
+        self.shm = shared_memory.SharedMemory(name=name)
+        if name not in _owned:
+            untrack_segment(self.shm)
+        magic, self.instance, _, self.slot_count, self.slot_size, _, _ = HEADER.unpack_from(self.shm.buf, 0)
+        self._slots = {}
+        if magic != MAGIC:
+            self.shm.close()
+            raise ValueError(f"{name} is not a state segment")
+
+    def latest(self):
+        """Index of the slot published last, or None before the first reading."""
+        index = U32.unpack_from(self.shm.buf, LATEST_OFFSET)[0]
+        return None if index == NO_SLOT else index
+
+    def devices(self):
+        """Device name -> slot index of every device that has published."""
+        used = min(U32.unpack_from(self.shm.buf, USED_OFFSET)[0], self.slot_count)
+        # Slots are never reassigned while the writer lives, so only new ones are read
+        for index in range(len(self._slots), used):
+            raw = SLOT.unpack_from(self.shm.buf, HEADER.size + index * self.slot_size)[2]
+            self._slots[raw.rstrip(b'\0').decode('utf-8', 'replace')] = index
+        return self._slots
+
+    def version(self, index):
+        return SEQ.unpack_from(self.shm.buf, HEADER.size + index * self.slot_size)[0] // 2
+
+    def read_raw(self, index, retries=1000):
+        """(version, JSON bytes) of a consistent record; payload is b'' before the first write."""
+        buf = self.shm.buf
+        offset = HEADER.size + index * self.slot_size
+        for _ in range(retries):
+            before = SEQ.unpack_from(buf, offset)[0]
+            if before % 2:
+                time.sleep(0)
+                continue
+            length = min(U32.unpack_from(buf, offset + 8)[0], self.slot_size - SLOT.size)
+            payload = bytes(buf[offset + SLOT.size:offset + SLOT.size + length])
+            if SEQ.unpack_from(buf, offset)[0] == before:
+                return before // 2, payload
+        raise TimeoutError('state segment kept changing while reading')
+
+    def close(self):
+        self.shm.close()
+
+
+class StateStore:
+    """
+    Reader side: latest readings from shared memory, else from the file.
+
+    ``read(device)`` returns ``(version, data)`` and ``read_raw(device)``
+    ``(version, bytes)`` for one device's latest reading, or with no device
+    for the newest reading of any device. ``version`` is an opaque string
+    that changes whenever that reading does (handy as a cache key or ETag).
+    Parsed data is cached per version, so unchanged state costs one shared
+    memory read (or one stat). The state file only holds the newest reading,
+    so without a writer segment a device's reading is found only while it
+    is the newest.
+    """
+
+    def __init__(self, state_file='current_state.json', retry_interval=1.0):
+        self.state_file = state_file
+        self.name = segment_name(state_file)
+        self.retry_interval = retry_interval
+        self._reader = None
+        self._next_attach = 0.0
+        self._lock = threading.Lock()
+        self._cached = {}   # device (None: newest of any) -> (version, raw, parsed)
+
+    def _shared(self):
+        # Periodically re-open the segment by name: an existing mapping stays
+        # readable after its writer exits, so it must be checked for being
+        # gone or replaced by a new writer's segment.
+        if time.monotonic() < self._next_attach:
+            return self._reader
+        self._next_attach = time.monotonic() + self.retry_interval
+        try:
+            fresh = SharedStateReader(self.name)
+        except (FileNotFoundError, ValueError, OSError):
+            fresh = None
+        if self._reader is not None and fresh is not None and fresh.instance == self._reader.instance:
+            fresh.close()
+            return self._reader
+        if self._reader is not None:
+            self._reader.close()
+        self._reader = fresh
+        return fresh
+
+    def devices(self):
+        """Names of the devices with a reading in shared memory."""
+        with self._lock:
+            reader = self._shared()
+            return sorted(reader.devices()) if reader is not None else []
+
+    def read_raw(self, device=None):
+        with self._lock:
+            return self._read_raw(device)
+
+    def _read_raw(self, device):
+        version, raw, _ = self._cached.get(device, (None, None, None))
+        reader = self._shared()
+        if reader is not None:
+            index = reader.latest() if device is None else reader.devices().get(device)
+            if index is not None:
+                # The writer's instance id keeps versions unique across writer restarts
+                current = f"shm-{reader.instance:x}-{index}-{reader.version(index)}"
+                if current == version:
+                    return version, raw
+                number, payload = reader.read_raw(index)
+                if payload:
+                    self._cached[device] = (f"shm-{reader.instance:x}-{index}-{number}", payload, None)
+                    return self._cached[device][:2]
+        try:
+            st = os.stat(self.state_file)
+        except OSError:
+            return None, None
+        current = f"file-{st.st_ino}-{st.st_mtime_ns}-{st.st_size}"
+        if current != version:
+            with open(self.state_file, 'rb') as f:
+                raw = f.read()
+            self._cached[device] = (current, raw, None)
+        if device is not None and self._parsed(device).get('device') != device:
+            return None, None
+        return current, raw
+
+    def _parsed(self, device):
+        version, raw, data = self._cached[device]
+        if data is None:
+            data = json.loads(raw)
+            self._cached[device] = (version, raw, data)
+        return data
+
+    def read(self, device=None):
+        with self._lock:
+            version, payload = self._read_raw(device)
+            if version is None:
+                return None, None
+            return version, self._parsed(device)
+
+    def close(self):
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
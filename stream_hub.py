@@ -0,0 +1,115 @@
+import json
+import threading
+
+from metrics import REGISTRY
+
+
+class LatestSlot:
+    """Per-client mailbox of size one: a newer item replaces an unread one."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self.closed = False
+
+    def put(self, item):
+        with self._cond:
+            self._item = item
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """The pending item, or None after ``timeout`` / once closed."""
+        with self._cond:
+            if self._item is None and not self.closed:
+                self._cond.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+class StateBroadcaster:
+    """
+    One producer thread fanning new readings out to any number of clients.
+
+    The producer checks the StateStore version every ``poll_interval``
+    seconds (a shared memory read) and, only when it changed, parses and
+    serializes the reading once and drops ``(version, data, json)`` into
+    every subscriber's LatestSlot. Slow clients simply skip to the newest
+    reading. ``listeners`` are called with ``(version, data)`` from the
+    producer thread for every new reading.
+    """
+
+    def __init__(self, store, poll_interval=0.25, registry=REGISTRY):
+        self.store = store
+        self.poll_interval = poll_interval
+        self.listeners = []
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._latest = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.client_count = registry.gauge('stream.clients')
+        self.published = registry.counter('stream.published')
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='state-broadcaster', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            for client in self._clients:
+                client.close()
+
+    def subscribe(self):
+        """New client slot, primed with the current reading."""
+        self.start()
+        client = LatestSlot()
+        with self._lock:
+            self._clients.add(client)
+            self.client_count.set(len(self._clients))
+            if self._latest is not None:
+                client.put(self._latest)
+        return client
+
+    def unsubscribe(self, client):
+        client.close()
+        with self._lock:
+            self._clients.discard(client)
+            self.client_count.set(len(self._clients))
+
+    def latest(self):
+        return self._latest
+
+    def poll(self):
+        """Publish the current reading if it is new. Returns True when it was."""
+        version, data = self.store.read()
+        if data is None or (self._latest is not None and self._latest[0] == version):
+            return False
+        item = (version, data, json.dumps(data, separators=(',', ':')))
+        with self._lock:
+            self._latest = item
+            clients = list(self._clients)
+        for client in clients:
+            client.put(item)
+        for listener in self.listeners:
+            try:
+                listener(version, data)
+            except Exception as e:
+                print(f"[stream]   > Listener failed: {e}")
+        self.published.inc()
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"[stream]   > Could not read state: {e}")
+            self._stop.wait(self.poll_interval)
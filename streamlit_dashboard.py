@@ -1,11 +1,13 @@
 import streamlit as st
-import json
 import os
 from datetime import datetime
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import time
-import csv
+from csv_index import CsvRowIndex
+from rules import rules_for
+from config_service import ConfigService
+from state_store import StateStore
 
 # Page configuration
 st.set_page_config(
@@ -258,19 +260,25 @@ def get_row_info():
         # Get total rows
         total_rows = 0
         if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'r') as f:
-                total_rows = len(list(csv.reader(f))) - 1  # Exclude header
+            row_index = CsvRowIndex(DATA_FILE)
+            row_index.refresh()
+            total_rows = len(row_index)  # Header is not indexed
         
         return current_row + 1, total_rows  # Return 1-based index
     except Exception:
         return 0, 0
 
+@st.cache_resource
+def state_store():
+    """Reader of the sensor's shared-memory snapshot (falls back to the state file)"""
+    return StateStore(STATE_FILE)
+
 def load_current_data():
-    """Load current sensor data from JSON file"""
+    """Load current sensor data (parsed only when a new reading arrived)"""
     try:
-        if os.path.exists(STATE_FILE):
-            with open(STATE_FILE, 'r') as f:
-                return json.load(f)
+        version, data = state_store().read()
+        if data is not None:
+            return data
         else:
             return {
                 'co2': 0,
@@ -284,14 +292,14 @@ def load_current_data():
         st.error(f"Error loading data: {e}")
         return None
 
+@st.cache_resource
+def config_service():
+    """One parsed config shared by every rerun and session"""
+    return ConfigService(CONFIG_FILE)
+
 def load_config():
-    """Load configuration settings"""
-    try:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
-    except Exception:
-        return None
+    """Load configuration settings (re-parsed only when the file changes)"""
+    return config_service().get()
 
 def create_enhanced_visualization(co2, temp, humidity, config):
     """Create beautiful gauge charts with proper scaling for each metric"""
@@ -545,18 +553,12 @@ def main():
         humid_threshold = config.get('humidity_limit', 45) if config else 45
         co2_threshold = 1000
         
-        # Determine status for each metric
-        def get_status(value, threshold, danger_mult=1.2):
-            if value >= threshold * danger_mult:
-                return 'danger'
-            elif value > threshold:
-                return 'warning'
-            else:
-                return 'normal'
-        
-        co2_status = get_status(co2, co2_threshold)
-        temp_status = get_status(temp, temp_threshold, 1.15)
-        humid_status = get_status(humidity, humid_threshold, 1.15)
+        # Determine status for each metric from the same compiled rules the sensors use
+        rules = rules_for(config or {'temperature_limit': temp_threshold, 'humidity_limit': humid_threshold})
+        device = data.get('device')
+        co2_status = rules.status('co2', co2, device)
+        temp_status = rules.status('temperature', temp, device)
+        humid_status = rules.status('humidity', humidity, device)
         
         # Main display section - Two columns
         left_col, right_col = st.columns([1, 1])
@@ -0,0 +1,309 @@
+"""
+Local stand-ins for the external services, for offline checks and benchmarks.
+
+Each stub runs a real server on 127.0.0.1 in a background thread, records
+what it received and can be told to be slow or to fail, so batching,
+ordering and throughput can be measured without touching the real APIs.
+"""
+import base64
+import json
+import re
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class _StubServer:
+    """Shared start/stop plumbing for the stubs."""
+
+    def __init__(self, handler_class, server_class=ThreadingHTTPServer):
+        handler = type(handler_class.__name__, (handler_class,), {'stub': self})
+        self.server = server_class(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.latency = 0.0      # seconds added to every response
+        self.fail_status = None  # e.g. 503 to simulate an outage
+        self.lock = threading.Lock()
+        self.requests = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real services
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+    stub = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        raw = body if isinstance(body, bytes) else body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(raw)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _begin(self):
+        """Common per-request bookkeeping; returns False if the stub should fail."""
+        with self.stub.lock:
+            self.stub.requests += 1
+        if self.stub.latency:
+            time.sleep(self.stub.latency)
+        if self.stub.fail_status:
+            self._send(self.stub.fail_status, json.dumps({'error': 'stub failure'}))
+            return False
+        return True
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+
+class ThingSpeakStub(_StubServer):
+    """
+    Minimal ThingSpeak: ``GET /update`` and ``POST /channels/<id>/bulk_update.json``.
+
+    ``entries[channel]`` holds every accepted update in arrival order;
+    ``bulk_requests`` / ``single_requests`` count the calls of each kind.
+    """
+
+    def __init__(self):
+        super().__init__(_ThingSpeakHandler)
+        self.entries = {}
+        self.bulk_requests = 0
+        self.single_requests = 0
+
+    def _store(self, channel, updates):
+        with self.lock:
+            entries = self.entries.setdefault(channel, [])
+            entries.extend(updates)
+            return len(entries)
+
+
+class _ThingSpeakHandler(_StubHandler):
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path != '/update':
+            return self._send(404, '0', 'text/plain')
+        if not self._begin():
+            return
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        with self.stub.lock:
+            self.stub.single_requests += 1
+        entry_id = self.stub._store(query.pop('api_key', ''), [query])
+        self._send(200, str(entry_id), 'text/plain')
+
+    def do_POST(self):
+        match = re.fullmatch(r'/channels/([^/]+)/bulk_update\.json', urlsplit(self.path).path)
+        body = self._read_json()
+        if not match:
+            return self._send(404, json.dumps({'success': False}))
+        if not self._begin():
+            return
+        with self.stub.lock:
+            self.stub.bulk_requests += 1
+        self.stub._store(match.group(1), body.get('updates', []))
+        self._send(202, json.dumps({'success': True}))
+
+
+class WeatherApiStub(_StubServer):
+    """
+    Minimal WeatherAPI: ``GET /v1/current.json?q=<location>`` and the bulk
+    ``POST /v1/current.json?q=bulk`` (up to ``max_bulk`` locations).
+
+    Conditions for a location are derived from its name and change every
+    ``update_every`` seconds (``last_updated_epoch``); responses carry an
+    ETag and answer a matching ``If-None-Match`` with 304. With
+    ``bulk_enabled`` off, bulk requests are refused like on the free plan;
+    API keys in ``refused_keys`` get a 401 on every request.
+    ``single_requests`` / ``bulk_requests`` count the calls and
+    ``locations_served`` the locations answered in total.
+    """
+
+    def __init__(self):
+        super().__init__(_WeatherApiHandler)
+        self.update_every = 900
+        self.bulk_enabled = True
+        self.refused_keys = set()
+        self.max_bulk = 50
+        self.single_requests = 0
+        self.bulk_requests = 0
+        self.locations_served = 0
+
+    def conditions(self, location):
+        """The stub's payload for ``location`` (same shape as current.json)."""
+        updated = int(time.time()) // self.update_every * self.update_every
+        seed = sum(location.encode('utf-8')) + updated // self.update_every
+        return {
+            'location': {'name': location.split(',')[0].strip().title()},
+            'current': {
+                'last_updated_epoch': updated,
+                'temp_c': round(15 + seed % 200 / 10, 1),
+                'humidity': 30 + seed % 60,
+                'air_quality': {'co': 200 + seed % 300, 'us-epa-index': 1 + seed % 3},
+            },
+        }
+
+
+class _WeatherApiHandler(_StubHandler):
+
+    def _refused(self, query):
+        if parse_qs(query).get('key', [''])[0] not in self.stub.refused_keys:
+            return False
+        self._send(401, json.dumps({'error': {'code': 2006, 'message': 'API key is invalid.'}}))
+        return True
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path != '/v1/current.json':
+            return self._send(404, json.dumps({'error': {'code': 1005, 'message': 'API URL is invalid.'}}))
+        if not self._begin() or self._refused(parts.query):
+            return
+        location = parse_qs(parts.query).get('q', [''])[0]
+        data = self.stub.conditions(location)
+        etag = f'"{abs(hash(location)):x}-{data["current"]["last_updated_epoch"]}"'
+        with self.stub.lock:
+            self.stub.single_requests += 1
+            self.stub.locations_served += 1
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._send(200, json.dumps(data), headers={'ETag': etag})
+
+    def do_POST(self):
+        parts = urlsplit(self.path)
+        body = self._read_json()
+        if parts.path != '/v1/current.json' or parse_qs(parts.query).get('q') != ['bulk']:
+            return self._send(404, json.dumps({'error': {'code': 1005, 'message': 'API URL is invalid.'}}))
+        if not self._begin() or self._refused(parts.query):
+            return
+        if not self.stub.bulk_enabled:
+            return self._send(403, json.dumps({'error': {
+                'code': 2009, 'message': 'API key does not have access to the resource.'}}))
+        locations = body.get('locations', [])
+        if len(locations) > self.stub.max_bulk:
+            return self._send(400, json.dumps({'error': {'code': 2007, 'message': 'Too many locations.'}}))
+        with self.stub.lock:
+            self.stub.bulk_requests += 1
+            self.stub.locations_served += len(locations)
+        bulk = [{'query': {'custom_id': loc.get('custom_id'), 'q': loc['q'], **self.stub.conditions(loc['q'])}}
+                for loc in locations]
+        self._send(200, json.dumps({'bulk': bulk}))
+
+
+class _SmtpServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+
+
+class SmtpStub(_StubServer):
+    """
+    Minimal SMTP server (EHLO, AUTH PLAIN/LOGIN, MAIL, RCPT, DATA, NOOP, RSET, QUIT).
+
+    No STARTTLS, so point clients at it with ``use_tls: false``.
+    ``connect_latency`` delays the greeting and login, standing in for the
+    TCP/TLS handshake and authentication of a real provider; ``latency``
+    delays each accepted message. ``close_after`` drops the connection after
+    that many messages to exercise reconnects. ``messages`` holds the raw
+    message bodies; ``connections`` and ``logins`` count sessions.
+    """
+
+    def __init__(self):
+        super().__init__(_SmtpHandler, _SmtpServer)
+        self.connect_latency = 0.0
+        self.close_after = None
+        self.messages = []
+        self.connections = 0
+        self.logins = 0
+
+    @property
+    def url(self):
+        return self.server.server_address
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    stub = None
+
+    def _reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        stub = self.stub
+        with stub.lock:
+            stub.connections += 1
+        if stub.connect_latency:
+            time.sleep(stub.connect_latency)
+        self._reply('220 stub ESMTP ready')
+        sent = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.wfile.write(b'250-stub\r\n250-AUTH PLAIN LOGIN\r\n')
+                self._reply('250 8BITMIME')
+            elif verb == 'AUTH':
+                if command.upper().startswith('AUTH LOGIN'):
+                    self._reply('334 ' + base64.b64encode(b'Username:').decode())
+                    self.rfile.readline()
+                    self._reply('334 ' + base64.b64encode(b'Password:').decode())
+                    self.rfile.readline()
+                if stub.connect_latency:
+                    time.sleep(stub.connect_latency)
+                with stub.lock:
+                    stub.logins += 1
+                self._reply('235 Authentication successful')
+            elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self._reply('250 OK')
+            elif verb == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk == b'.\r\n':
+                        break
+                    data.append(chunk)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                with stub.lock:
+                    stub.requests += 1
+                    stub.messages.append(b''.join(data))
+                self._reply('250 Queued')
+                sent += 1
+                if stub.close_after and sent >= stub.close_after:
+                    return
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('502 Command not implemented')
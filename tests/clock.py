@@ -0,0 +1,17 @@
+class FakeClock:
+    """Stands in for the ``time`` module of the code under test; only moves when told to."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
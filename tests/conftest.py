@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from clock import FakeClock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def child():
+    """
+    Start ``python -c code`` from the repository root. The code prints
+    ``ready`` once set up and exits when its stdin closes; the fixture
+    returns after ``ready`` and stops the process at teardown.
+    """
+    started = []
+
+    def start(code):
+        proc = subprocess.Popen([sys.executable, '-c', code], cwd=ROOT, text=True,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        started.append(proc)
+        for line in proc.stdout:
+            if line.strip() == 'ready':
+                return proc
+        raise AssertionError(f"child exited with {proc.wait()} before it was ready")
+
+    yield start
+    for proc in started:
+        proc.stdin.close()
+        proc.wait(timeout=10)
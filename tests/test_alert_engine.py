@@ -0,0 +1,82 @@
+"""Alert hysteresis, cooldown and digests."""
+from alert_engine import AlertEngine
+from metrics import MetricsRegistry
+
+
+def make_engine(**kwargs):
+    return AlertEngine(registry=MetricsRegistry(), **kwargs)
+
+
+def test_hovering_value_does_not_flap():
+    engine = make_engine(clear_margin={'co2': 50})
+    assert engine.update('dev', 'co2', 1010, 1000, now=0)
+    for t, value in enumerate((990, 1005, 960, 1001), 1):
+        assert not engine.update('dev', 'co2', value, 1000, now=t)
+    assert engine.active() == [('dev', 'co2')]
+    assert engine.raised.value == 1
+
+    engine.update('dev', 'co2', 950, 1000, now=10)
+    assert engine.active() == []
+    assert engine.cleared.value == 1
+
+
+def test_default_margin_is_a_fraction_of_the_limit():
+    engine = make_engine(default_margin=0.1)
+    engine.update('dev', 'temperature', 31, 30, now=0)
+    engine.update('dev', 'temperature', 27.5, 30, now=1)
+    assert engine.active()
+    engine.update('dev', 'temperature', 27, 30, now=2)
+    assert not engine.active()
+
+
+def test_cooldown_folds_raises_into_the_digest():
+    engine = make_engine(cooldown=900, clear_margin={'co2': 0})
+    assert engine.update('dev', 'co2', 1100, 1000, now=0)
+    engine.update('dev', 'co2', 900, 1000, now=10)
+    assert not engine.update('dev', 'co2', 1100, 1000, now=20)
+    assert engine.suppressed.value == 1
+    engine.update('dev', 'co2', 900, 1000, now=30)
+    assert engine.update('dev', 'co2', 1100, 1000, now=1000)
+
+    subject, body = engine.digest(now=1001, force=True)
+    assert subject == 'Alert digest: 1 alert(s) on 1 device(s)'
+    assert 'raised 1 more time(s) during cooldown' in body
+    assert engine.digest(now=1002, force=True) is not None   # still active
+    engine.update('dev', 'co2', 900, 1000, now=1003)
+    engine.digest(now=1004, force=True)
+    assert engine.digest(now=1005, force=True) is None
+
+
+def test_digest_waits_for_its_interval():
+    engine = make_engine(digest_interval=3600)
+    engine.update('dev', 'co2', 1100, 1000)
+    assert engine.digest() is None
+    assert engine.digest(force=True) is not None
+
+
+def test_windowed_condition_clears_when_it_stops_matching():
+    engine = make_engine()
+    reading = {'conditions': ['co2_rising']}
+    assert engine.observe('dev', reading, now=0) == ['co2_rising']
+    assert engine.observe('dev', reading, now=1) == []
+    engine.observe('dev', {}, now=2)
+    assert engine.active() == []
+
+
+def test_static_condition_clears_past_its_margin():
+    engine = make_engine(clear_margin={'humidity': 5})
+    limits = {'too_dry': ('humidity', 'below', 30)}
+    assert engine.observe('dev', {'humidity': 28, 'conditions': ['too_dry'],
+                                  'condition_limits': limits}, now=0) == ['too_dry']
+    # Back above the threshold but inside the margin: still active
+    engine.observe('dev', {'humidity': 32}, now=1)
+    assert engine.active() == [('dev', 'too_dry')]
+    engine.observe('dev', {'humidity': 35}, now=2)
+    assert engine.active() == []
+
+
+def test_observe_alerts_on_limited_metrics():
+    engine = make_engine()
+    reading = {'co2': 1200, 'temperature': 20, 'limits': {'co2': 1000, 'temperature': 30}}
+    assert engine.observe('dev', reading, now=0) == ['co2']
+    assert engine.observe('dev', reading, now=1) == []
@@ -0,0 +1,81 @@
+"""Memory-mapped columnar copy of a replay CSV."""
+import os
+
+import pytest
+
+from columnar_cache import ColumnarCache, open_cache
+from csv_device import CsvSensor
+
+
+def write(path, data, mode='wb'):
+    with open(path, mode) as f:
+        f.write(data)
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    write(path, b'CO2,Temp,Humidity\r\n400,22,40\r\n410,22.5,40\r\n')
+    return path
+
+
+def test_columns_and_rows(csv_path):
+    cache = open_cache(csv_path)
+    assert cache.columns == ['CO2', 'Temp', 'Humidity']
+    assert len(cache) == 2
+    assert cache.row(1) == (410.0, 22.5, 40.0)
+    assert list(cache.column('Temp')) == [22.0, 22.5]
+    assert open_cache(csv_path) is cache
+
+
+def test_reused_by_a_new_instance(csv_path, capsys):
+    ColumnarCache(csv_path).refresh()
+    assert 'Built' in capsys.readouterr().out
+    cache = ColumnarCache(csv_path)
+    cache.refresh()
+    assert 'Built' not in capsys.readouterr().out
+    assert len(cache) == 2
+
+
+def test_rebuilds_when_the_csv_changes(csv_path):
+    cache = ColumnarCache(csv_path)
+    cache.refresh()
+    write(csv_path, b'420,23,41\r\n', 'ab')
+    cache.refresh()
+    assert cache.row(-1) == (420.0, 23.0, 41.0)
+
+    write(csv_path, b'CO2,Temp,Humidity\n1,2,3\n')
+    os.utime(csv_path, ns=(0, 0))
+    cache.refresh()
+    assert len(cache) == 1
+    assert cache.row(0) == (1.0, 2.0, 3.0)
+
+
+def test_half_appended_row_is_left_out(csv_path):
+    cache = ColumnarCache(csv_path)
+    cache.refresh()
+    write(csv_path, b'10,11', 'ab')
+    cache.refresh()
+    assert len(cache) == 2
+    write(csv_path, b',12\n', 'ab')
+    cache.refresh()
+    assert cache.row(2) == (10.0, 11.0, 12.0)
+
+
+def test_non_numeric_data_is_rejected(tmp_path):
+    path = str(tmp_path / 'text.csv')
+    write(path, b'a,b\nx,y\n')
+    with pytest.raises(ValueError):
+        ColumnarCache(path).refresh()
+
+
+def test_sensor_keeps_the_cache_across_a_partial_row(csv_path, tmp_path):
+    sensor = CsvSensor('dev', 'key', 1, csv_path, tracker_file=str(tmp_path / 'row.txt'),
+                       state_file=str(tmp_path / 'state.json'), pipeline=object())
+    assert sensor._refresh_rows() == 2
+    write(csv_path, b'10,11', 'ab')
+    assert sensor._refresh_rows() == 2
+    write(csv_path, b',12\n', 'ab')
+    assert sensor._refresh_rows() == 3
+    assert sensor.use_columnar
+    assert sensor._read_row_values(2) == (10.0, 11.0, 12.0)
@@ -0,0 +1,110 @@
+"""ConfigService change detection, validation and subscribers."""
+import json
+import os
+
+import pytest
+
+import config_service
+from config_service import ConfigService, FrozenDict, changed_keys
+from metrics import MetricsRegistry
+
+
+@pytest.fixture(autouse=True)
+def fake_time(monkeypatch, clock):
+    monkeypatch.setattr(config_service, 'time', clock)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / 'config.json'
+
+
+def write(path, config, replace=False):
+    """Write ``config`` in place (or by rename) and move the mtime on, as a later edit would."""
+    target = path.with_name('config.json.tmp') if replace else path
+    target.write_text(json.dumps(config))
+    if replace:
+        os.replace(target, path)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+def service(path):
+    return ConfigService(str(path), check_interval=1.0, registry=MetricsRegistry())
+
+
+def test_edits_are_seen_after_the_check_interval(path, clock):
+    write(path, {'co2_limit': 1000})
+    config = service(path)
+    snapshot = config.get()
+    assert snapshot == {'co2_limit': 1000}
+
+    write(path, {'co2_limit': 1200})
+    assert config.get() is snapshot
+    clock.advance(1)
+    assert config.get() == {'co2_limit': 1200}
+    assert config.version == 2
+
+
+def test_same_size_rewrite_and_rename_are_both_detected(path):
+    write(path, {'co2_limit': 1000})
+    config = service(path)
+    config.check()
+
+    write(path, {'co2_limit': 2000})
+    assert config.check() == ['co2_limit']
+    write(path, {'co2_limit': 3000}, replace=True)
+    assert config.check() == ['co2_limit']
+    assert config.get()['co2_limit'] == 3000
+
+
+def test_touch_without_changes_keeps_the_snapshot(path):
+    write(path, {'co2_limit': 1000})
+    config = service(path)
+    snapshot = config.get()
+
+    write(path, {'co2_limit': 1000})
+    assert config.check() == []
+    assert config.get() is snapshot
+    assert config.version == 1
+
+
+def test_invalid_edits_keep_the_last_good_config(path):
+    write(path, {'update_interval': 20})
+    config = service(path)
+    config.check()
+
+    path.write_text('{"update_interval": ')
+    assert config.check() == []
+    write(path, {'update_interval': -1})
+    assert config.check() == []
+    os.remove(path)
+    assert config.check() == []
+    assert config.get() == {'update_interval': 20}
+    assert config.errors.value == 2
+
+
+def test_subscribers_get_the_snapshot_and_dotted_changed_keys(path):
+    write(path, {'email': {'enabled': False, 'smtp_server': 'a'}, 'co2_limit': 1000})
+    config = service(path)
+    config.check()
+    calls = []
+    config.subscribe(lambda snapshot, changed: calls.append((snapshot, changed)))
+    config.subscribe(lambda snapshot, changed: 1 / 0)   # a failing subscriber doesn't stop the others
+
+    write(path, {'email': {'enabled': False, 'smtp_server': 'b'}, 'temperature_limit': 30})
+    config.check()
+
+    assert len(calls) == 1
+    snapshot, changed = calls[0]
+    assert changed == ['co2_limit', 'email.smtp_server', 'temperature_limit']
+    assert isinstance(snapshot, FrozenDict)
+    with pytest.raises(TypeError):
+        snapshot['co2_limit'] = 1
+
+
+def test_changed_keys():
+    assert changed_keys(None, {'a': 1}) == ['a']
+    assert changed_keys({'a': {'b': 1, 'c': 2}}, {'a': {'b': 1, 'c': 3}}) == ['a.c']
+    assert changed_keys({'a': None}, {}) == ['a']
+    assert changed_keys({'a': (1, 2)}, {'a': (1, 2)}) == []
@@ -0,0 +1,86 @@
+"""Byte-offset row index over a growing CSV."""
+import pytest
+
+from csv_index import CsvRowIndex
+
+HEADER = b'CO2,Temp,Humidity\n'
+
+
+def write(path, data, mode='wb'):
+    with open(path, mode) as f:
+        f.write(data)
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    write(path, HEADER + b'400,22,40\n410,22,40\n\n405,22,41\n')
+    return path
+
+
+def open_index(path):
+    index = CsvRowIndex(path)
+    index.refresh()
+    return index
+
+
+def test_rows_skip_header_and_blank_lines(csv_path):
+    index = open_index(csv_path)
+    assert len(index) == 3
+    assert index.row(0) == ['400', '22', '40']
+    assert index.row(-1) == ['405', '22', '41']
+    assert list(index)[1] == ['410', '22', '40']
+    with pytest.raises(IndexError):
+        index.row(3)
+
+
+def test_unterminated_row_waits_for_its_newline(csv_path):
+    index = open_index(csv_path)
+    write(csv_path, b'4', 'ab')
+    index.refresh()
+    assert len(index) == 3
+    with pytest.raises(IndexError):
+        index.row(3)
+
+    write(csv_path, b'2,23,42', 'ab')
+    index.refresh()
+    assert len(index) == 3
+    write(csv_path, b'\n', 'ab')
+    index.refresh()
+    assert len(index) == 4
+    assert index.row(3) == ['42', '23', '42']
+
+
+def test_crlf_rows(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    write(path, b'CO2,Temp,Humidity\r\n400,22,40\r\n410,22,40\r\n')
+    index = open_index(path)
+    assert [index.row(i) for i in range(len(index))] == [['400', '22', '40'], ['410', '22', '40']]
+
+
+def test_appends_extend_the_persisted_index(csv_path):
+    open_index(csv_path)
+    write(csv_path, b'420,23,41\n', 'ab')
+    index = open_index(csv_path)   # reloaded from <csv>.idx, then extended
+    assert len(index) == 4
+    assert index.row(3) == ['420', '23', '41']
+
+
+def test_rewrite_rebuilds(csv_path):
+    index = open_index(csv_path)
+    write(csv_path, HEADER + b'1,2,3\n')
+    index.refresh()
+    assert len(index) == 1
+    assert index.row(0) == ['1', '2', '3']
+
+
+def test_in_place_edit_outside_the_fingerprint_is_caught(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    rows = [b'%d,22,40\n' % (400 + i) for i in range(2000)]
+    write(path, HEADER + b''.join(rows))
+    index = open_index(path)
+    # Same size, head and last row unchanged, but row 999 starts a byte later
+    rows[998], rows[999] = b'1398,22,400\n', b'1399,22,4\n'
+    write(path, HEADER + b''.join(rows))
+    assert index.row(999) == ['1399', '22', '4']
+    assert index.row(998) == ['1398', '22', '400']
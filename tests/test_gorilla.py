@@ -0,0 +1,72 @@
+"""Gorilla block encoding round-trips."""
+import math
+import random
+
+import pytest
+
+from gorilla import Encoder, block_info, decode_block, iter_decode, iter_encode
+
+
+def roundtrip(points, columns, decimals=None):
+    encoder = Encoder(columns, decimals)
+    for ts, values in points:
+        encoder.add(ts, values)
+    return encoder.finish()
+
+
+def test_exact_floats_roundtrip():
+    rng = random.Random(7)
+    points = []
+    ts = 1700000000000
+    for i in range(500):
+        ts += 20000 + rng.randint(-30, 30)
+        points.append((ts, [rng.uniform(350, 2000), rng.uniform(-10, 40), 45.0]))
+    block = roundtrip(points, 3)
+    assert list(decode_block(block)) == points
+    assert block_info(block) == (3, None, points[0][0], 500)
+
+
+@pytest.mark.parametrize('gap', [0, 1, 63, -64, 255, 2047, 10 ** 6, -10 ** 6])
+def test_every_delta_of_delta_width(gap):
+    points = [(1000, [1.0]), (21000, [1.0]), (41000 + gap, [2.0]), (61000 + gap, [2.0]), (81000 + 2 * gap, [3.0])]
+    assert list(decode_block(roundtrip(points, 1))) == points
+
+
+def test_missing_values_decode_as_none():
+    points = [(0, [1.5, None]), (1, [None, None]), (2, [2.5, 0.0])]
+    assert list(decode_block(roundtrip(points, 2))) == points
+
+
+def test_special_floats_roundtrip():
+    points = [(i, [v]) for i, v in enumerate([0.0, -0.0, math.inf, -math.inf, 1e-300, -1e300, 5e-324])]
+    decoded = list(decode_block(roundtrip(points, 1)))
+    assert [(ts, [repr(v) for v in values]) for ts, values in decoded] == \
+        [(ts, [repr(v) for v in values]) for ts, values in points]
+
+
+def test_decimals_roundtrip_at_their_precision():
+    points = [(i * 20000, [round(400 + i * 0.37, 2), round(21.5 - i * 0.01, 2)]) for i in range(200)]
+    block = roundtrip(points, 2, decimals=2)
+    assert block_info(block)[1] == 2
+    for (ts, values), (want_ts, want) in zip(decode_block(block), points):
+        assert ts == want_ts
+        assert values == pytest.approx(want, abs=1e-9)
+
+
+def test_steady_series_compresses():
+    points = [(i * 20000, [415.0]) for i in range(1000)]
+    block = roundtrip(points, 1)
+    # two bits per point (timestamp and value unchanged), plus header and first point
+    assert len(block) < 400
+
+
+def test_iter_encode_splits_into_blocks():
+    points = [(i, [float(i)]) for i in range(10)]
+    blocks = list(iter_encode(points, block_size=4))
+    assert [block_info(b)[3] for b in blocks] == [4, 4, 2]
+    assert list(iter_decode(blocks)) == points
+
+
+def test_rejects_foreign_bytes():
+    with pytest.raises(ValueError):
+        block_info(b'\0' * 32)
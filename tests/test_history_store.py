@@ -0,0 +1,181 @@
+"""SQLite history store: batched writes, rollup tiers and the archive."""
+import time
+
+import pytest
+
+from history_store import DAY, HistoryStore
+from metrics import MetricsRegistry
+
+START = int(time.time()) // DAY * DAY - 2 * DAY   # midnight UTC, inside every tier's retention
+
+
+def reading(i, device='dev', interval=20, start=START):
+    return {'device': device, 'epoch': start + i * interval,
+            'co2': 400 + i % 50, 'temperature': 20 + i % 10 / 10, 'humidity': 40}
+
+
+@pytest.fixture
+def make_store(tmp_path):
+    stores = []
+
+    def make(**kwargs):
+        kwargs.setdefault('registry', MetricsRegistry())
+        store = HistoryStore(str(tmp_path / 'history.db'), **kwargs)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.close()
+
+
+def test_batches_are_written_once_full(make_store):
+    store = make_store(batch_size=3)
+    store.add(reading(0))
+    store.add(reading(1))
+    assert store.query('dev') == []
+    store.add(reading(2))
+    assert [row[0] for row in store.query('dev')] == [START, START + 20, START + 40]
+    assert store.rows_written.value == 3
+
+
+def test_range_query(make_store):
+    store = make_store()
+    for i in range(100):
+        store.add(reading(i))
+        store.add(reading(i, device='other'))
+    store.flush()
+    rows = store.query('dev', START + 200, START + 400)
+    assert [row[0] for row in rows] == [START + 200 + 20 * i for i in range(10)]
+    assert rows[0][1:] == (410, 20.0, 40)
+    assert len(store.query('dev', limit=7)) == 7
+    assert store.query('missing') == []
+    assert store.devices() == ['dev', 'other']
+
+
+def test_same_timestamp_replaces(make_store):
+    store = make_store()
+    store.add(reading(0))
+    store.add(dict(reading(0), co2=999))
+    store.flush()
+    assert store.query('dev') == [(START, 999, 20.0, 40)]
+
+
+def test_survives_reopen(make_store):
+    store = make_store()
+    store.add(reading(0))
+    store.close()
+    assert make_store().query('dev')[0][0] == START
+
+
+def test_rollups_follow_the_settled_watermark(make_store):
+    store = make_store(settle=120)
+    for i in range(3 * 180):                  # 3 hours of 20 s readings
+        store.add(reading(i))
+    store.compact(now=START + 2 * 3600 + 60)
+    with store._write_lock:
+        assert store._watermark(store._db, '1m') == (START + 2 * 3600 - 60) * 1000
+        assert store._watermark(store._db, '1h') == (START + 3600) * 1000
+
+    minutes = store.series('dev', START, START + 600, resolution=60)
+    assert [p['epoch'] for p in minutes] == [START + 60 * i for i in range(10)]
+    assert minutes[0]['count'] == 3
+    assert minutes[0]['co2'] == 401.0
+    assert (minutes[0]['co2_min'], minutes[0]['co2_max']) == (400, 402)
+
+    # The last hour isn't in rollup_1h yet and is read from the finer tiers
+    hours = store.series('dev', START, START + 3 * 3600, resolution=3600)
+    assert [p['count'] for p in hours] == [180, 180, 180]
+
+
+def test_compaction_expires_only_rolled_up_rows(make_store):
+    store = make_store(raw_retention=3600, settle=0)
+    for i in range(4 * 180):
+        store.add(reading(i))
+    now = START + 4 * 3600
+    removed = store.compact(now=now)
+    assert removed == 3 * 180
+    assert store.query('dev')[0][0] == START + 3 * 3600
+    # Raw rows are gone, the rollups still cover the whole range
+    assert sum(p['count'] for p in store.series('dev', START, now, resolution=60)) == 4 * 180
+    assert store.compact(now=now) == 0
+
+
+def test_tier_for_resolution_and_retention(make_store):
+    store = make_store(raw_retention=DAY, minute_retention=7 * DAY)
+    now = START + 30 * DAY
+    assert store.tier_for(None) == 0
+    assert store.tier_for(20) == 0
+    assert store.tier_for(300) == 1
+    assert store.tier_for(7200) == 2
+    assert store.tier_for(None, start=now - 3600, now=now) == 0
+    assert store.tier_for(None, start=now - 2 * DAY, now=now) == 1
+    assert store.tier_for(60, start=now - 10 * DAY, now=now) == 2
+
+
+
+def archive_blocks(store):
+    with store._write_lock:
+        return store._db.execute('SELECT start_ts, end_ts, count FROM archive ORDER BY start_ts').fetchall()
+
+
+def test_archive_is_opt_in(make_store):
+    store = make_store(raw_retention=3600, settle=0)
+    for i in range(3 * 180):
+        store.add(reading(i))
+    store.compact(now=START + DAY + 3600)
+    assert archive_blocks(store) == []
+    assert store.query('dev') == []
+
+
+def test_archive_round_trip(make_store):
+    store = make_store(raw_retention=DAY, settle=0, archive=True)
+    for i in range(2 * DAY // 600):              # two days, every 10 minutes
+        store.add(reading(i, interval=600))
+    store.flush()
+    expected = store.query('dev')
+    assert store.compact(now=START + 2 * DAY) == DAY // 600
+    assert archive_blocks(store) == [(START * 1000, (START + DAY - 600) * 1000, DAY // 600)]
+    assert store.query('dev') == expected
+    assert store.query('dev', START + 3000, START + 6000) == expected[5:10]
+
+
+def test_late_reading_is_merged_into_its_archived_day(make_store):
+    store = make_store(raw_retention=DAY, settle=0, archive=True)
+    for i in range(0, 2 * DAY // 600, 2):
+        store.add(reading(i, interval=600))
+    store.compact(now=START + 2 * DAY)
+    store.add(reading(3, interval=600))
+    store.add(dict(reading(4, interval=600), co2=999))
+    store.compact(now=START + 2 * DAY)
+
+    assert [count for _, _, count in archive_blocks(store)] == [DAY // 1200 + 1]
+    rows = store.query('dev', START, START + DAY)
+    assert [row[0] for row in rows] == sorted(row[0] for row in rows)
+    assert rows[1:4] == [(START + 1200, 402, 20.2, 40), (START + 1800, 403, 20.3, 40),
+                         (START + 2400, 999, 20.4, 40)]
+
+
+def test_only_encoded_rows_are_deleted(make_store, monkeypatch):
+    store = make_store(raw_retention=DAY, settle=0, archive=True)
+    for i in range(0, DAY // 600, 2):
+        store.add(reading(i, interval=600))
+    store.compact(now=START + 2 * DAY)   # roll up and archive the first pass
+    for i in range(1, DAY // 600, 2):
+        store.add(reading(i, interval=600))
+    store.flush()
+
+    # A reading written while the day is being encoded, below the last encoded ts
+    encode = store._encode
+
+    def encode_with_late_write(rows):
+        monkeypatch.undo()
+        store.add(reading(DAY // 600 - 2, interval=600) | {'epoch': START + 42})
+        store.flush()
+        return encode(rows)
+
+    monkeypatch.setattr(store, '_encode', encode_with_late_write)
+    store._archive((START + DAY) * 1000)
+    assert [row[0] for row in store.query('dev', START, START + 60)] == [START, START + 42]
+    store._archive((START + DAY) * 1000)
+    assert sum(count for _, _, count in archive_blocks(store)) == DAY // 600 + 1
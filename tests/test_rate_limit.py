@@ -0,0 +1,125 @@
+"""GCRA token buckets and the per-host rate limiter."""
+import pytest
+
+import rate_limit
+from metrics import MetricsRegistry
+from rate_limit import AdaptiveInterval, RateLimited, RateLimiter, TokenBucket, retry_after
+
+
+@pytest.fixture(autouse=True)
+def fake_time(monkeypatch, clock):
+    monkeypatch.setattr(rate_limit, 'time', clock)
+
+
+def test_burst_then_steady_rate(clock):
+    bucket = TokenBucket(rate=10, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket.reserve() == pytest.approx(0.1)
+    assert bucket.reserve() == pytest.approx(0.2)
+
+    # Idle time refills the burst, but never beyond it
+    clock.advance(60)
+    assert [bucket.reserve() for _ in range(3)] == [0, 0, 0]
+    assert bucket.reserve() == pytest.approx(0.1)
+
+
+def test_reservations_queue_up(clock):
+    bucket = TokenBucket(rate=2)
+    waits = [bucket.reserve() for _ in range(4)]
+    assert waits == pytest.approx([0, 0.5, 1.0, 1.5])
+    clock.advance(1.0)
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_max_wait_takes_nothing(clock):
+    bucket = TokenBucket(rate=1)
+    assert bucket.reserve(max_wait=0.5) == 0
+    assert bucket.reserve(max_wait=0.5) is None
+    assert bucket.reserve(max_wait=0.5) is None
+    clock.advance(0.6)
+    assert bucket.reserve(max_wait=0.5) == pytest.approx(0.4)
+
+
+def test_unlimited_bucket_still_pauses(clock):
+    bucket = TokenBucket()
+    assert [bucket.reserve() for _ in range(100)] == [0] * 100
+    bucket.pause(30)
+    assert bucket.reserve() == pytest.approx(30)
+    clock.advance(30)
+    assert bucket.reserve() == 0
+
+
+def test_pause_resumes_without_a_burst(clock):
+    bucket = TokenBucket(rate=1, burst=5)
+    bucket.pause(10)
+    assert bucket.reserve() == pytest.approx(10)
+    clock.advance(10)
+    assert bucket.reserve() == pytest.approx(1)
+
+
+def test_limiter_throttles_configured_hosts_only(clock):
+    registry = MetricsRegistry()
+    limiter = RateLimiter({'api.example.com': {'per_minute': 60, 'burst': 2}}, max_wait=1.5, registry=registry)
+    assert limiter.reserve('other.example.com') == 0
+    assert limiter.reserve('api.example.com') == 0
+    assert limiter.reserve('api.example.com') == 0
+    limiter.acquire('api.example.com')
+    assert clock.now == pytest.approx(1001.0)
+    assert limiter.reserve('api.example.com') == pytest.approx(1.0)
+    with pytest.raises(RateLimited):
+        limiter.reserve('api.example.com')
+    assert registry.counter('rate_limit.api.example.com.rejected').value == 1
+
+
+def test_limiter_pauses_on_429(clock):
+    registry = MetricsRegistry()
+    limiter = RateLimiter({}, max_wait=120, registry=registry)
+    limiter.response('api.example.com', 429, {'Retry-After': '90'})
+    assert limiter.reserve('api.example.com') == pytest.approx(90)
+    # A 503 without Retry-After is an outage, not a quota
+    limiter.response('other.example.com', 503, {})
+    assert limiter.reserve('other.example.com') == 0
+    assert registry.counter('rate_limit.api.example.com.throttled').value == 1
+
+
+def test_retry_after_forms():
+    assert retry_after({'Retry-After': '12'}) == 12
+    assert retry_after({'Retry-After': 'Thu, 01 Jan 2026 00:01:00 GMT'}, now=1767225600) == 60
+    assert retry_after({'Retry-After': 'soon'}, default=7) == 7
+    assert retry_after(None, default=5) == 5
+
+
+def test_failures_back_off_without_adaptive_polling():
+    adaptive = AdaptiveInterval.from_config(20, None)
+    assert [adaptive.failure() for _ in range(5)] == [40, 80, 160, 160, 160]
+    assert adaptive.success({'co2': 400}) == 20
+    # Flat or jumping readings leave the interval alone
+    for co2 in (400, 400, 400, 400, 900, 400):
+        assert adaptive.success({'co2': co2}) == 20
+
+
+def test_disabled_section_keeps_failure_backoff():
+    adaptive = AdaptiveInterval.from_config(20, {'enabled': False, 'max_interval': 60})
+    assert [adaptive.failure() for _ in range(3)] == [40, 60, 60]
+    assert adaptive.success({'co2': 400}) == 20
+    assert adaptive.success({'co2': 900}) == 20
+
+
+def test_adaptive_interval_follows_the_data():
+    adaptive = AdaptiveInterval.from_config(20, {'flat_samples': 2})
+    values = {'co2': 400, 'temperature': 20, 'humidity': 40}
+    assert adaptive.success(values) == 20
+    assert adaptive.success(values) == 20
+    assert adaptive.success(values) == 30
+    assert adaptive.success(dict(values, co2=600)) == 15
+    assert adaptive.success(dict(values, co2=900)) == 10
+    assert adaptive.success(dict(values, co2=950)) == 15
+
+
+def test_repeated_observation_is_not_classified():
+    adaptive = AdaptiveInterval.from_config(20, {'flat_samples': 1})
+    values = {'co2': 400, 'temperature': 20, 'humidity': 40}
+    adaptive.success(values, observed=1)
+    assert adaptive.success(values, observed=1) == 20
+    assert adaptive.success(values, observed=1) == 20
+    assert adaptive.success(values, observed=2) == 30
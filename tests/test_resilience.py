@@ -0,0 +1,132 @@
+"""The circuit breaker state machine."""
+import pytest
+
+import resilience
+from metrics import MetricsRegistry
+from resilience import Backoff, CircuitBreaker, CircuitBreakers, CircuitOpen
+
+
+@pytest.fixture(autouse=True)
+def fake_time(monkeypatch, clock):
+    monkeypatch.setattr(resilience, 'time', clock)
+
+
+def make_breaker(**kwargs):
+    kwargs.setdefault('jitter', 0)
+    return CircuitBreaker('api', base_backoff=5, max_backoff=20, registry=MetricsRegistry(), **kwargs)
+
+
+def trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before()
+        breaker.failure()
+
+
+def test_opens_after_consecutive_failures():
+    breaker = make_breaker(failure_threshold=3)
+    breaker.failure()
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    breaker.failure()
+    assert breaker.state == breaker.CLOSED
+    breaker.failure()
+    assert breaker.state == breaker.OPEN
+    assert breaker.opened.value == 1
+    assert breaker.retry_in() == pytest.approx(5)
+
+
+def test_open_circuit_fails_fast_until_backoff(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    with pytest.raises(CircuitOpen):
+        breaker.before()
+    assert breaker.fast_failed.value == 1
+    clock.advance(5)
+    breaker.before()
+    assert breaker.state == breaker.HALF_OPEN
+
+
+def test_half_open_lets_one_trial_through(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.advance(5)
+    breaker.before()
+    with pytest.raises(CircuitOpen):
+        breaker.before()
+    breaker.success()
+    assert breaker.state == breaker.CLOSED
+    assert breaker.backoff.attempts == 0
+    breaker.before()
+
+
+def test_failed_trial_reopens_for_longer(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    for expected in (10, 20, 20):
+        clock.advance(breaker.retry_in())
+        breaker.before()
+        breaker.failure()
+        assert breaker.state == breaker.OPEN
+        assert breaker.retry_in() == pytest.approx(expected)
+    assert breaker.opened.value == 4
+
+
+def test_late_failures_do_not_extend_the_backoff():
+    breaker = make_breaker()
+    trip(breaker)
+    breaker.failure()
+    assert breaker.retry_in() == pytest.approx(5)
+
+
+def test_lost_trial_is_given_up(clock):
+    breaker = make_breaker(trial_timeout=30)
+    trip(breaker)
+    clock.advance(5)
+    breaker.before()
+    clock.advance(29)
+    with pytest.raises(CircuitOpen):
+        breaker.before()
+    clock.advance(1)
+    breaker.before()
+
+
+def test_abandoned_trial_lets_the_next_caller_try(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.advance(5)
+    breaker.before()
+    breaker.abandon()
+    breaker.before()
+    assert breaker.state == breaker.HALF_OPEN
+
+
+def test_state_gauge_follows_transitions(clock):
+    registry = MetricsRegistry()
+    breaker = CircuitBreaker('api', failure_threshold=1, jitter=0, registry=registry)
+    gauge = registry.gauge('circuit.api.state')
+    breaker.failure()
+    assert gauge.value == 2
+    clock.advance(breaker.retry_in())
+    breaker.before()
+    assert gauge.value == 1
+    breaker.success()
+    assert gauge.value == 0
+
+
+def test_backoff_is_jittered_below_the_cap():
+    backoff = Backoff(base=1, maximum=8, jitter=0.5)
+    for expected in (1, 2, 4, 8, 8):
+        delay = backoff.next()
+        assert expected / 2 <= delay <= expected
+    backoff.reset()
+    assert backoff.peek() == 1
+
+
+def test_breakers_are_per_endpoint():
+    breakers = CircuitBreakers(failure_threshold=1, registry=MetricsRegistry())
+    breakers.breaker('a').failure()
+    assert breakers.breaker('a') is breakers.breaker('a')
+    assert breakers.states() == {'a': 'open'}
+    breakers.breaker('b').before()
+    assert breakers.states() == {'a': 'open', 'b': 'closed'}
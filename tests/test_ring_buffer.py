@@ -0,0 +1,100 @@
+"""Ring buffers and the shared recent history read by the dashboards."""
+import math
+import uuid
+
+import pytest
+
+from ring_buffer import DeviceHistory, DeviceHistoryReader, RingBuffer
+
+NOW = 1700000000
+
+
+def test_ring_keeps_the_newest_points():
+    ring = RingBuffer(4)
+    for i in range(6):
+        ring.append(NOW + i, {'co2': 400 + i, 'temperature': 20, 'humidity': None})
+    assert len(ring) == 4
+    result = ring.query()
+    assert result['timestamps'] == [NOW + i for i in range(2, 6)]
+    assert result['co2'] == [402, 403, 404, 405]
+    assert result['humidity'] == [None] * 4
+    assert ring.nbytes == 4 * (8 + 4 * 3)
+
+
+def test_ring_ignores_points_going_back_in_time():
+    ring = RingBuffer(4)
+    assert ring.append(NOW, {'co2': 1})
+    assert not ring.append(NOW, {'co2': 2})
+    assert not ring.append(NOW - 1, {'co2': 3})
+    assert ring.query()['co2'] == [1]
+
+
+def test_query_since_and_downsampling():
+    ring = RingBuffer(100)
+    for i in range(10):
+        ring.append(NOW + i, {'co2': i, 'temperature': 0, 'humidity': 0})
+    assert ring.query(since=NOW + 7)['co2'] == [7, 8, 9]
+    result = ring.query(max_points=3)
+    assert result['co2'] == [1, 4, 7.5]
+    assert result['timestamps'] == [NOW + 1, NOW + 4, NOW + 7.5]
+
+
+def test_values_are_float32():
+    ring = RingBuffer(2)
+    ring.append(NOW, {'temperature': 21.1})
+    assert ring.values['temperature'][0] == pytest.approx(21.1, rel=1e-6)
+    assert math.isnan(ring.values['co2'][0])
+
+
+def test_from_config_sizes_for_every_device():
+    config = {'devices': [{'name': f"dev{i}"} for i in range(300)]}
+    assert DeviceHistory.from_config(config).slot_count == 300
+    assert DeviceHistory.from_config({}).slot_count == 64
+    assert DeviceHistory.from_config(dict(config, history={'recent_devices': 10})).slot_count == 10
+
+
+@pytest.fixture
+def name():
+    return f"test-{uuid.uuid4().hex[:8]}"
+
+
+def test_reader_in_another_process(child, name):
+    child(f"""
+import time
+from ring_buffer import DeviceHistory
+history = DeviceHistory({name!r}, slots=2, capacity=16)
+now = time.time()
+for i in range(20):
+    for device in ('a', 'b', 'c'):
+        history.add({{'device': device, 'epoch': now - 20 + i, 'co2': 400 + i,
+                     'temperature': 20, 'humidity': 40}})
+print('ready', flush=True)
+__import__('sys').stdin.read()
+history.close()
+""")
+    reader = DeviceHistoryReader(name)
+    assert reader.devices() == ['a', 'b']
+    points = reader.query('b')
+    assert points['co2'] == [400 + i for i in range(4, 20)]
+    assert len(reader.query('a', max_points=4)['co2']) == 4
+    # Past the slots, only the writer process has it
+    assert reader.query('c') is None
+
+
+def test_reader_without_a_writer(name):
+    reader = DeviceHistoryReader(name)
+    assert reader.devices() == []
+    assert reader.query('a') is None
+
+
+def test_second_writer_keeps_private_rings(name, capsys):
+    first = DeviceHistory(name, slots=2, capacity=8)
+    second = DeviceHistory(name, slots=2, capacity=8)
+    try:
+        first.add({'device': 'a', 'epoch': NOW, 'co2': 1})
+        second.add({'device': 'b', 'epoch': NOW, 'co2': 2})
+        assert 'already has a writer in this process' in capsys.readouterr().out
+        assert DeviceHistoryReader(name, max_age=10 ** 10).devices() == ['a']
+    finally:
+        second.close()
+        first.close()
@@ -0,0 +1,99 @@
+"""Rule parsing, tiers, duration/rate windows and the legacy *_limit mapping."""
+import pytest
+
+from rules import Rule, RuleSet, rules_for
+
+T0 = 1700000000
+
+
+def names(evaluation):
+    return sorted(rule.name for rule, _ in evaluation.matches)
+
+
+def test_legacy_limits_become_warning_and_danger_rules():
+    rules = RuleSet.from_config({'temperature_limit': 30})
+
+    assert names(rules.evaluate('Office', {'co2': 999, 'temperature': 30})) == []
+    assert names(rules.evaluate('Office', {'co2': 1100, 'temperature': 31})) == ['co2_limit', 'temperature_limit']
+    result = rules.evaluate('Office', {'co2': 1300, 'temperature': 40})
+    assert names(result) == ['co2_limit_danger', 'temperature_limit_danger']
+    assert result.status == 'danger'
+    assert result.limits == {'co2': 1000, 'temperature': 30}
+    assert result.conditions == ['co2_limit_danger', 'temperature_limit_danger']
+
+
+def test_legacy_co2_limit_applies_to_every_device_unless_disabled():
+    rules = RuleSet.from_config({})
+    assert names(rules.evaluate('csv-1', {'co2': 1100})) == ['co2_limit']
+
+    rules = RuleSet.from_config({'co2_limit': None, 'rules': [
+        {'metric': 'co2', 'above': 1000, 'devices': ['Weather Station']}]})
+    assert names(rules.evaluate('csv-1', {'co2': 1100})) == []
+    assert names(rules.evaluate('Weather Station', {'co2': 1100})) == ['co2_above_1000']
+
+
+def test_only_the_most_severe_rule_of_a_tier_matches():
+    rules = RuleSet.from_config({'co2_limit': None, 'rules': [
+        {'metric': 'humidity', 'below': 30},
+        {'metric': 'humidity', 'below': 20, 'severity': 'danger'},
+        {'metric': 'humidity', 'above': 70},
+    ]})
+
+    assert names(rules.evaluate('d', {'humidity': 25})) == ['humidity_below_30']
+    assert names(rules.evaluate('d', {'humidity': 10})) == ['humidity_below_20']
+    assert names(rules.evaluate('d', {'humidity': 50})) == []
+    assert rules.status('humidity', 10, 'd') == 'danger'
+
+
+def test_for_window_needs_the_condition_held_for_its_length():
+    rules = RuleSet.from_config({'co2_limit': None, 'rules': [{'metric': 'co2', 'above': 1000, 'for': 300}]})
+
+    assert [names(rules.evaluate('d', {'co2': 1200}, T0 + t)) for t in (0, 100, 200, 300, 400)] == [
+        [], [], [], ['co2_above_1000_300s'], ['co2_above_1000_300s']]
+    # One sample back under the threshold restarts the wait
+    assert names(rules.evaluate('d', {'co2': 900}, T0 + 500)) == []
+    assert names(rules.evaluate('d', {'co2': 1200}, T0 + 600)) == []
+    assert names(rules.evaluate('d', {'co2': 1200}, T0 + 800)) == []
+    assert names(rules.evaluate('d', {'co2': 1200}, T0 + 900)) == ['co2_above_1000_300s']
+
+
+def test_rate_window_compares_the_change_over_its_length():
+    rules = RuleSet.from_config({'co2_limit': None, 'rules': [
+        {'metric': 'temperature', 'rate_above': 2, 'per': 60}]})
+
+    assert names(rules.evaluate('d', {'temperature': 20}, T0)) == []
+    assert names(rules.evaluate('d', {'temperature': 21}, T0 + 30)) == []
+    result = rules.evaluate('d', {'temperature': 23}, T0 + 60)
+    assert names(result) == ['temperature_rate_above_2_60s']
+    assert result.warnings == ['Temperature rising fast: +3.0°C per 1 min']
+    assert names(rules.evaluate('d', {'temperature': 23.5}, T0 + 120)) == []
+
+
+def test_windows_are_kept_per_device():
+    rules = RuleSet.from_config({'co2_limit': None, 'rules': [{'metric': 'co2', 'above': 1000, 'for': 60}]})
+    rules.evaluate('a', {'co2': 1200}, T0)
+    rules.evaluate('b', {'co2': 1200}, T0 + 50)
+
+    assert names(rules.evaluate('a', {'co2': 1200}, T0 + 60)) == ['co2_above_1000_60s']
+    assert names(rules.evaluate('b', {'co2': 1200}, T0 + 60)) == []
+
+
+def test_rules_for_keeps_window_state_across_unrelated_config_changes():
+    config = {'rules': [{'metric': 'co2', 'above': 1000, 'for': 60}]}
+    rules = rules_for(config)
+    rules.evaluate('d', {'co2': 1200}, T0)
+
+    assert rules_for(dict(config, update_interval=5)) is rules
+    assert rules_for(dict(config, co2_limit=900)) is not rules
+
+
+@pytest.mark.parametrize('spec', [
+    {'metric': 'pressure', 'above': 1},
+    {'metric': 'co2'},
+    {'metric': 'co2', 'above': 1, 'below': 2},
+    {'metric': 'co2', 'above': 1, 'severity': 'fatal'},
+    {'metric': 'co2', 'rate_above': 1, 'per': 0},
+])
+def test_invalid_rules_are_rejected(spec):
+    with pytest.raises(ValueError):
+        Rule(spec)
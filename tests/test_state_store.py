@@ -0,0 +1,124 @@
+"""Latest-reading snapshots in shared memory, read here and from another process."""
+import json
+
+import pytest
+
+from state_store import StateStore, StateWriter
+
+
+@pytest.fixture
+def state_file(tmp_path):
+    return str(tmp_path / 'current_state.json')
+
+
+def reading(device, co2):
+    return {'device': device, 'co2': co2, 'temperature': 21.5, 'humidity': 40}
+
+
+def test_each_device_keeps_its_latest_reading(state_file):
+    writer = StateWriter(state_file)
+    store = StateStore(state_file)
+    try:
+        writer.publish(reading('a', 400))
+        writer.publish(reading('b', 500))
+        writer.publish(reading('a', 410))
+
+        assert store.devices() == ['a', 'b']
+        assert store.read('a')[1]['co2'] == 410
+        assert store.read('b')[1]['co2'] == 500
+        assert store.read()[1]['device'] == 'a'
+        with open(state_file) as f:
+            assert json.load(f)['co2'] == 410
+    finally:
+        store.close()
+        writer.close()
+
+
+def test_version_changes_only_with_the_reading(state_file):
+    writer = StateWriter(state_file)
+    store = StateStore(state_file)
+    try:
+        writer.publish(reading('a', 400))
+        version, data = store.read('a')
+        assert store.read('a') == (version, data)
+        assert store.read('a')[1] is data
+        writer.publish(reading('a', 400))
+        assert store.read('a')[0] != version
+    finally:
+        store.close()
+        writer.close()
+
+
+def test_without_a_segment_the_file_has_the_newest_reading(state_file):
+    writer = StateWriter(state_file)
+    writer.publish(reading('a', 400))
+    writer.publish(reading('b', 500))
+    writer.close()
+
+    store = StateStore(state_file)
+    assert store.devices() == []
+    assert store.read('b')[1]['co2'] == 500
+    # Only the newest reading is in the file
+    assert store.read('a') == (None, None)
+    store.close()
+
+
+def test_devices_past_the_slots_go_to_the_file_only(state_file, capsys):
+    writer = StateWriter(state_file, slots=1)
+    store = StateStore(state_file)
+    try:
+        writer.publish(reading('a', 400))
+        writer.publish(reading('b', 500))
+        assert 'All 1 shared state slots in use' in capsys.readouterr().out
+        assert store.devices() == ['a']
+        assert store.read('b')[1]['co2'] == 500
+    finally:
+        store.close()
+        writer.close()
+
+
+WRITER = """
+import json, sys
+from state_store import StateWriter
+writer = StateWriter({state_file!r})
+print('ready', flush=True)
+for line in sys.stdin:
+    writer.publish(json.loads(line))
+    print('ok', flush=True)
+writer.close()
+"""
+
+
+def test_reader_in_another_process(child, state_file, capsys):
+    proc = child(WRITER.format(state_file=state_file))
+
+    def publish(data):
+        proc.stdin.write(json.dumps(data) + '\n')
+        proc.stdin.flush()
+        assert proc.stdout.readline().strip() == 'ok'
+
+    store = StateStore(state_file, retry_interval=0)
+    try:
+        publish(reading('a', 400))
+        publish(reading('b', 500))
+        assert store.devices() == ['a', 'b']
+        version, data = store.read('a')
+        assert data['co2'] == 400 and version.startswith('shm-')
+        publish(reading('a', 420))
+        assert store.read('a')[1]['co2'] == 420
+
+        # A second writer while the first is alive leaves its segment alone
+        second = StateWriter(state_file, write_file=False)
+        assert 'is being written by process' in capsys.readouterr().out
+        second.publish(reading('a', 999))
+        second.close()
+        assert store.read('a')[1]['co2'] == 420
+
+        # Once the writer has exited, readers fall back to the state file
+        proc.stdin.close()
+        proc.wait(timeout=10)
+        version, data = store.read()
+        assert version.startswith('file-') and data['co2'] == 420
+        assert store.devices() == []
+    finally:
+        store.close()
@@ -0,0 +1,201 @@
+"""ThingSpeak bulk uploads and the outbox hand-off, against the local stub."""
+from types import SimpleNamespace
+
+import pytest
+
+from http_client import HttpClient
+from metrics import MetricsRegistry
+from outbox import Outbox, OutboxReplayer
+from rate_limit import RateLimiter
+from resilience import CircuitBreakers
+from sinks import ThingSpeakSink
+from stub_servers import ThingSpeakStub
+from thingspeak import ThingSpeakUploader, to_update
+
+START = 1700000000
+
+
+def reading(i):
+    return {'co2': 400 + i, 'temperature': 20.5, 'humidity': 40, 'epoch': START + i * 20}
+
+
+@pytest.fixture
+def stub():
+    with ThingSpeakStub() as stub:
+        yield stub
+
+
+@pytest.fixture
+def client():
+    # No quotas and a breaker that never opens, so failures reach the uploader
+    client = HttpClient(rate_limiter=RateLimiter({}, registry=MetricsRegistry()),
+                        breakers=CircuitBreakers(failure_threshold=10 ** 9, registry=MetricsRegistry()),
+                        registry=MetricsRegistry())
+    yield client
+    client.close()
+
+
+def make_uploader(stub, client, **kwargs):
+    kwargs.setdefault('max_batch', 5)
+    kwargs.setdefault('max_age', 3600)
+    kwargs.setdefault('min_interval', 0)
+    return ThingSpeakUploader(base_url=stub.url, client=client, registry=MetricsRegistry(), **kwargs)
+
+
+def test_full_batches_go_out_in_order(stub, client):
+    uploader = make_uploader(stub, client)
+    for i in range(12):
+        uploader.add('42', 'key', reading(i))
+    assert stub.bulk_requests == 2
+    assert uploader.pending() == 2
+
+    uploader.flush(force=True)
+    assert stub.bulk_requests == 3
+    assert uploader.pending() == 0
+    assert stub.entries['42'] == [to_update(reading(i)) for i in range(12)]
+    assert uploader.batch_size.count == 3
+    assert uploader.uploaded.value == 12
+
+
+def test_partial_batch_waits_for_max_age(stub, client):
+    uploader = make_uploader(stub, client)
+    uploader.add('42', 'key', reading(0))
+    uploader.flush()
+    assert stub.bulk_requests == 0
+
+    uploader.max_age = 0
+    uploader.flush()
+    assert stub.bulk_requests == 1
+
+
+def test_min_interval_spaces_batches_per_channel(stub, client):
+    uploader = make_uploader(stub, client, max_batch=2, min_interval=3600)
+    for i in range(4):
+        uploader.add('42', 'key', reading(i))
+    for i in range(2):
+        uploader.add('43', 'key', reading(i))
+    # One batch per channel; the second full batch of 42 has to wait
+    assert stub.bulk_requests == 2
+    assert uploader.pending() == 2
+
+
+def test_batch_size_is_capped_at_the_bulk_limit():
+    uploader = ThingSpeakUploader(max_batch=5000, registry=MetricsRegistry())
+    assert uploader.max_batch == ThingSpeakUploader.MAX_BULK
+
+
+def test_failed_batch_is_retried_in_order(stub, client):
+    uploader = make_uploader(stub, client)
+    stub.fail_status = 503
+    for i in range(3):
+        uploader.add('42', 'key', reading(i))
+    uploader.flush(force=True)
+    assert uploader.failed.value == 1
+    assert uploader.pending() == 3
+    assert '42' not in stub.entries
+
+    uploader.add('42', 'key', reading(3))
+    stub.fail_status = None
+    uploader.flush(force=True)
+    assert uploader.pending() == 0
+    assert stub.entries['42'] == [to_update(reading(i)) for i in range(4)]
+
+
+def test_overflowing_buffer_drops_oldest(stub, client):
+    uploader = make_uploader(stub, client, max_batch=100, max_buffer=3)
+    for i in range(5):
+        uploader.add('42', 'key', reading(i))
+    assert uploader.dropped.value == 2
+    uploader.flush(force=True)
+    assert stub.entries['42'] == [to_update(reading(i)) for i in range(2, 5)]
+
+
+def test_outbox_keeps_readings_until_acked(stub, client, tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'), registry=MetricsRegistry())
+    replayer = OutboxReplayer(outbox, make_uploader(stub, client), single_rate=1000)
+    for i in range(7):
+        outbox.append('42', 'key', to_update(reading(i)))
+    outbox.append(None, 'solo-key', to_update(reading(7)))
+
+    stub.fail_status = 503
+    assert not replayer.drain_once(force=True)
+    assert outbox.pending() == 8
+
+    stub.fail_status = None
+    assert replayer.drain_once(force=True)
+    assert replayer.drain_once(force=True)
+    assert outbox.pending() == 0
+    assert stub.entries['42'] == [to_update(reading(i)) for i in range(7)]
+    # Channel-less rows go one by one through the update endpoint
+    assert stub.single_requests == 1
+    assert stub.entries['solo-key'][0]['field1'] == str(reading(7)['co2'])
+    outbox.close()
+
+
+def test_outbox_survives_restart(tmp_path):
+    path = str(tmp_path / 'outbox.db')
+    outbox = Outbox(path, registry=MetricsRegistry())
+    for i in range(3):
+        outbox.append('42', 'key', to_update(reading(i)))
+    outbox.ack([row_id for row_id, _, _ in outbox.peek('42', 1)])
+    outbox.close()
+
+    outbox = Outbox(path, registry=MetricsRegistry())
+    assert outbox.pending() == 2
+    assert [update for _, _, update in outbox.peek('42', 10)] == [to_update(reading(i)) for i in (1, 2)]
+    outbox.close()
+
+
+def test_sink_hands_readings_to_the_outbox(stub, client, tmp_path):
+    path = str(tmp_path / 'outbox.db')
+    sink = ThingSpeakSink(make_uploader(stub, client), Outbox(path, registry=MetricsRegistry()))
+    sensor = SimpleNamespace(channel_id='42', api_key='key')
+    for i in range(3):
+        sink.handle(sensor, reading(i), {})
+    sink.close()
+
+    # Not due yet (max_age), so everything is still on disk for the next start
+    assert stub.bulk_requests == 0
+    outbox = Outbox(path, registry=MetricsRegistry())
+    assert outbox.pending() == 3
+    outbox.close()
+
+
+def test_outbox_bound_holds_on_every_append_and_restart(tmp_path):
+    path = str(tmp_path / 'outbox.db')
+    outbox = Outbox(path, max_entries=5, registry=MetricsRegistry())
+    for i in range(8):
+        outbox.append('42', 'key', to_update(reading(i)))
+        assert outbox.pending() == min(i + 1, 5)
+    assert outbox.dropped.value == 3
+    assert outbox.depth.value == 5
+    outbox.close()
+
+    outbox = Outbox(path, max_entries=2, registry=MetricsRegistry())
+    assert outbox.pending() == 2
+    assert outbox.dropped.value == 3
+    outbox.append('42', 'key', to_update(reading(8)))
+    assert [update for _, _, update in outbox.peek('42', 10)] == [to_update(reading(i)) for i in (7, 8)]
+    outbox.close()
+
+
+def test_outbox_channels_track_pending_rows(tmp_path):
+    path = str(tmp_path / 'outbox.db')
+    outbox = Outbox(path, registry=MetricsRegistry())
+    for channel in ('b', 'a', None, 'b'):
+        outbox.append(channel, 'key', to_update(reading(0)))
+    assert [channel for channel, _ in outbox.channels()] == ['', 'a', 'b']
+    outbox.ack([row_id for row_id, _, _ in outbox.peek('a', 10)])
+    assert [channel for channel, _ in outbox.channels()] == ['', 'b']
+    outbox.close()
+
+    outbox = Outbox(path, registry=MetricsRegistry())
+    assert [channel for channel, _ in outbox.channels()] == ['', 'b']
+    outbox.close()
+
+
+def test_sink_blocks_rather_than_drops_with_an_outbox(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'), registry=MetricsRegistry())
+    assert ThingSpeakSink(outbox=outbox).default_policy == 'block'
+    assert ThingSpeakSink().default_policy == 'drop_oldest'
+    outbox.close()
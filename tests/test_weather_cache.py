@@ -0,0 +1,177 @@
+"""WeatherCache, the bulk WeatherFetcher and WeatherSensor publishing, against the local stub."""
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+import weather_cache
+from api_weather_device import WeatherSensor
+from async_runtime import AsyncWeatherSensor
+from http_client import HttpClient
+from metrics import MetricsRegistry
+from rate_limit import RateLimiter
+from resilience import CircuitBreakers
+from stub_servers import WeatherApiStub
+from weather_cache import WeatherCache, location_key
+from weather_fetcher import WeatherFetcher
+
+
+@pytest.fixture
+def stub():
+    with WeatherApiStub() as stub:
+        yield stub
+
+
+@pytest.fixture
+def client():
+    # No quotas and a breaker that never opens, so every answer reaches the cache
+    client = HttpClient(rate_limiter=RateLimiter({}, registry=MetricsRegistry()),
+                        breakers=CircuitBreakers(failure_threshold=10 ** 9, registry=MetricsRegistry()),
+                        registry=MetricsRegistry())
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def cache(stub, client):
+    cache = WeatherCache(client=client, registry=MetricsRegistry())
+    cache.bulk = WeatherFetcher(cache, base_url=f"{stub.url}/v1", concurrency=4, client=client,
+                                registry=MetricsRegistry())
+    yield cache
+    cache.bulk.close()
+
+
+def register(stub, cache, query, api_key='k'):
+    key = location_key(*query.split(','))
+    url = f"{stub.url}/v1/current.json?key={api_key}&q={query}&aqi=yes"
+    cache.bulk.register(key, api_key, query, url)
+    return key, url
+
+
+def test_one_lookup_refreshes_every_location_in_batches(stub, cache):
+    locations = [register(stub, cache, f"City{i},C{i % 7}") for i in range(120)]
+
+    status, data = cache.fetch(*reversed(locations[0]))
+
+    assert status == 200
+    assert data['current'] == stub.conditions('City0,C0')['current']
+    assert (stub.bulk_requests, stub.single_requests) == (3, 0)
+    for i, (key, url) in enumerate(locations):
+        assert cache.fetch(url, key)[1]['current'] == stub.conditions(f"City{i},C{i % 7}")['current']
+    assert stub.requests == 3
+
+
+def test_bulk_refusal_falls_back_to_single_requests(stub, cache):
+    stub.bulk_enabled = False
+    locations = [register(stub, cache, f"City{i},C1") for i in range(5)]
+
+    assert cache.fetch(*reversed(locations[0]))[0] == 200
+    assert (stub.bulk_requests, stub.single_requests) == (0, 5)
+
+    # Bulk stays off until reprobe_interval has passed
+    cache._entries.clear()
+    cache.fetch(*reversed(locations[0]))
+    assert stub.requests == 1 + 5 + 5
+
+
+def test_bulk_outage_backs_off_instead_of_single_requests(stub, cache):
+    locations = [register(stub, cache, f"City{i},C1") for i in range(5)]
+    cache.fetch(*reversed(locations[0]))
+    stub.fail_status = 503
+    cache._entries.clear()
+    cache.fetch(*reversed(locations[0]))
+    assert cache.bulk._outage_until > 0
+
+    assert cache.fetch(*reversed(locations[0])) == (503, None)
+    assert (stub.bulk_requests, stub.single_requests) == (1, 0)
+    assert stub.requests == 2
+
+    # Once the backoff has passed, the next round asks again
+    stub.fail_status = None
+    cache.bulk._outage_until = 0
+    assert cache.fetch(*reversed(locations[1]))[0] == 200
+    assert (stub.bulk_requests, stub.single_requests) == (2, 0)
+
+
+def test_bulk_outage_serves_stale_data(stub, cache):
+    key, url = register(stub, cache, 'Pune,IN')
+    _, data = cache.fetch(url, key)
+    cache._entries[key].expires = 0
+    cache.bulk.base_url = 'http://127.0.0.1:9/v1'   # nothing listens there
+
+    assert cache.fetch(url, key) == (200, data)
+    assert cache.fetch(url, key) == (200, data)
+    assert cache.bulk.errors.value == 1
+
+
+def test_shared_location_falls_back_to_another_api_key(stub, cache):
+    stub.bulk_enabled = False
+    stub.refused_keys = {'expired'}
+    register(stub, cache, 'Pune,IN', api_key='expired')
+    key, url = register(stub, cache, 'Pune,IN', api_key='valid')
+
+    status, data = cache.fetch(url, key)
+
+    assert status == 200
+    assert data['current'] == stub.conditions('Pune,IN')['current']
+    assert stub.single_requests == 1
+
+
+class Recorder:
+
+    def __init__(self):
+        self.readings = []
+
+    def publish(self, device, reading, config):
+        self.readings.append(reading)
+
+
+def test_sensor_publishes_each_observation_once(stub, client, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(weather_cache, '_cache', WeatherCache(client=client, registry=MetricsRegistry()))
+    pipeline = Recorder()
+    sensor = WeatherSensor('Pune', 'ts-key', 60, 'k', 'Pune', pipeline=pipeline,
+                           base_url=f"{stub.url}/v1")
+
+    assert sensor.step() and sensor.step()
+    assert stub.requests == 1
+    assert len(pipeline.readings) == 1
+
+    # WeatherAPI updated the conditions: the next reading is published
+    conditions = stub.conditions
+
+    def updated(location):
+        data = conditions(location)
+        data['current']['last_updated_epoch'] += stub.update_every
+        return data
+
+    monkeypatch.setattr(stub, 'conditions', updated)
+    weather_cache._cache._entries.clear()
+    assert sensor.step()
+    assert len(pipeline.readings) == 2
+
+
+def test_fetch_async_never_takes_the_thread_lock(stub, cache):
+    key, url = register(stub, cache, 'Pune,IN')
+    data = stub.conditions('Pune,IN')
+
+    async def get(url, headers):
+        await asyncio.sleep(0)
+        return 200, {}, json.dumps(data)
+
+    # A worker thread holding the entry's lock must not stall the event loop
+    lock = cache._entry(key).lock
+    lock.acquire()
+    threading.Timer(1.0, lock.release).start()
+    started = time.monotonic()
+    assert asyncio.run(cache.fetch_async(url, key, get)) == (200, data)
+    assert time.monotonic() - started < 0.5
+
+
+def test_async_sensor_leaves_the_bulk_fetcher_alone(cache, monkeypatch):
+    monkeypatch.setattr(weather_cache, '_cache', cache)
+    AsyncWeatherSensor('Pune', 'ts-key', 60, 'k', 'Pune', pipeline=Recorder())
+    WeatherSensor('Delhi', 'ts-key', 60, 'k', 'Delhi', pipeline=Recorder())
+    assert list(cache.bulk._locations) == [location_key('Delhi', 'IN')]
@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from http_client import get_client
+from metrics import REGISTRY
+
+THINGSPEAK_URL = 'https://api.thingspeak.com'
+
+
+def to_update(reading):
+    """One bulk_update entry for a reading, keeping the time it was sampled."""
+    created = datetime.fromtimestamp(reading['epoch'], timezone.utc)
+    return {
+        'created_at': created.strftime('%Y-%m-%d %H:%M:%S +0000'),
+        'field1': reading['co2'],
+        'field2': reading['temperature'],
+        'field3': reading['humidity'],
+    }
+
+
+class ChannelBuffer:
+    """Pending updates for one ThingSpeak channel."""
+
+    def __init__(self, channel_id, write_key):
+        self.channel_id = channel_id
+        self.write_key = write_key
+        self.updates = deque()
+        self.oldest = None        # monotonic time the oldest pending update was added
+        self.last_post = 0.0      # monotonic time of the last bulk request
+
+
+class ThingSpeakUploader:
+    """
+    Buffers readings per channel and uploads them with the bulk JSON endpoint.
+
+    A channel is flushed when it has ``max_batch`` pending updates or its
+    oldest update is ``max_age`` seconds old, but never more often than
+    ``min_interval`` (ThingSpeak rate-limits bulk updates per channel). Each
+    update carries its original ``created_at``, so batching doesn't shift
+    timestamps. Failed batches go back to the front of the buffer in order;
+    a buffer over ``max_buffer`` drops its oldest updates.
+    """
+
+    MAX_BULK = 960  # ThingSpeak's limit per bulk_update request
+
+    def __init__(self, base_url=THINGSPEAK_URL, max_batch=100, max_age=15,
+                 min_interval=15, max_buffer=10000, client=None, registry=REGISTRY):
+        self.base_url = base_url.rstrip('/')
+        self.max_batch = min(max_batch, self.MAX_BULK)
+        self.max_age = max_age
+        self.min_interval = min_interval
+        self.max_buffer = max_buffer
+        self.client = client
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.batches = registry.counter('thingspeak.batches')
+        self.uploaded = registry.counter('thingspeak.uploaded')
+        self.failed = registry.counter('thingspeak.failed_batches')
+        self.dropped = registry.counter('thingspeak.dropped')
+        self.batch_size = registry.histogram('thingspeak.batch_size',
+                                             bounds=(1, 2, 5, 10, 25, 50, 100, 250, 500, 960))
+
+    @classmethod
+    def from_config(cls, config):
+        opts = (config or {}).get('thingspeak') or {}
+        return cls(
+            base_url=opts.get('base_url', THINGSPEAK_URL),
+            max_batch=opts.get('max_batch', 100),
+            max_age=opts.get('max_age', 15),
+            min_interval=opts.get('min_interval', 15),
+            max_buffer=opts.get('max_buffer', 10000),
+        )
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='thingspeak-flusher', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the flusher and push out everything still buffered."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.flush(force=True)
+
+    def add(self, channel_id, write_key, reading):
+        with self._lock:
+            buf = self._channels.get(channel_id)
+            if buf is None:
+                buf = self._channels[channel_id] = ChannelBuffer(channel_id, write_key)
+            buf.write_key = write_key
+            if not buf.updates:
+                buf.oldest = time.monotonic()
+            buf.updates.append(to_update(reading))
+            overflow = len(buf.updates) - self.max_buffer
+            for _ in range(max(0, overflow)):
+                buf.updates.popleft()
+                self.dropped.inc()
+            full = len(buf.updates) >= self.max_batch
+        if full:
+            self.flush()
+
+    def pending(self):
+        with self._lock:
+            return sum(len(b.updates) for b in self._channels.values())
+
+    def flush(self, force=False):
+        """Send every channel whose batch is due (or all of them with ``force``)."""
+        now = time.monotonic()
+        with self._lock:
+            due = []
+            for buf in self._channels.values():
+                if not buf.updates:
+                    continue
+                ready = (len(buf.updates) >= self.max_batch
+                         or now - buf.oldest >= self.max_age)
+                if force or (ready and now - buf.last_post >= self.min_interval):
+                    batch = [buf.updates.popleft() for _ in range(min(self.max_batch, len(buf.updates)))]
+                    buf.last_post = now
+                    buf.oldest = now if buf.updates else None
+                    due.append((buf, batch))
+
+        for buf, batch in due:
+            if self.send_batch(buf.channel_id, buf.write_key, batch):
+                continue
+            with self._lock:
+                # Put the batch back in front, preserving order
+                buf.updates.extendleft(reversed(batch))
+                buf.oldest = buf.oldest or now
+
+    def send_batch(self, channel_id, write_key, updates):
+        """POST one bulk_update request. Returns True when ThingSpeak accepted it."""
+        url = f"{self.base_url}/channels/{channel_id}/bulk_update.json"
+        try:
+            response = (self.client or get_client()).post(
+                url, json={'write_api_key': write_key, 'updates': updates})
+            ok = response.status_code in (200, 202) and response.json().get('success', False)
+        except Exception as e:
+            print(f"[ThingSpeak]   > Bulk upload to channel {channel_id} failed: {e}")
+            ok = False
+        else:
+            if not ok:
+                print(f"[ThingSpeak]   > Bulk upload to channel {channel_id} rejected "
+                      f"(code {response.status_code}: {response.text[:100]})")
+        if ok:
+            self.batches.inc()
+            self.uploaded.inc(len(updates))
+            self.batch_size.observe(len(updates))
+            print(f"[ThingSpeak]   > Uploaded {len(updates)} reading(s) to channel {channel_id}")
+        else:
+            self.failed.inc()
+        return ok
+
+    def send_single(self, write_key, update):
+        """GET one update (with its ``created_at``). Returns True when ThingSpeak accepted it."""
+        params = dict(update, api_key=write_key)
+        try:
+            response = (self.client or get_client()).get(f"{self.base_url}/update", params=params)
+            # ThingSpeak answers 200 with entry id "0" when it rejects an update
+            ok = response.status_code == 200 and response.text.strip() not in ('', '0')
+        except Exception as e:
+            print(f"[ThingSpeak]   > Update failed: {e}")
+            ok = False
+        if ok:
+            self.uploaded.inc()
+        else:
+            self.failed.inc()
+        return ok
+
+    def _run(self):
+        while not self._stop.wait(1.0):
+            self.flush()
@@ -0,0 +1,313 @@
+import asyncio
+import json
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from http_client import get_client
+from metrics import REGISTRY
+
+
+def location_key(city, country_code=None):
+    """Cache key for a WeatherAPI location: devices naming the same place share it."""
+    location = f"{city},{country_code}" if country_code else f"{city}"
+    return ','.join(part.strip() for part in location.lower().split(','))
+
+
+def freshness(headers, now=None):
+    """
+    Seconds a response may be served from cache according to its HTTP
+    headers: 0 for ``no-cache``/``no-store`` (check every time), None when
+    the headers say nothing.
+    """
+    directives = {}
+    for part in (headers.get('Cache-Control') or '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    try:
+        if 'max-age' in directives:
+            return max(0, int(directives['max-age']) - int(headers.get('Age') or 0))
+        if headers.get('Expires'):
+            expires = parsedate_to_datetime(headers['Expires']).timestamp()
+            date = parsedate_to_datetime(headers['Date']).timestamp() if headers.get('Date') else now or time.time()
+            return max(0, expires - date)
+    except (TypeError, ValueError):
+        return 0
+    return None
+
+
+class _Entry:
+    def __init__(self):
+        self.lock = threading.Lock()   # single-flight: one fetch per key at a time
+        self.data = None
+        self.expires = 0.0             # monotonic
+        self.fetched = 0.0             # monotonic
+        self.etag = None
+        self.last_modified = None
+        self.error = None              # status code or exception of the last failed fetch
+        self.failed = 0.0              # monotonic time of that failure
+
+
+class WeatherCache:
+    """
+    Shared cache of WeatherAPI ``current.json`` responses, keyed by location.
+
+    WeatherAPI refreshes current conditions only every ``refresh_interval``
+    seconds, so a response stays fresh until the payload's
+    ``last_updated_epoch`` plus that interval; once that has passed without
+    an update the cache re-checks every ``min_ttl`` seconds. HTTP headers
+    cap the lifetime (``max-age``/``Expires``; ``no-cache``/``no-store``
+    force a check on every lookup), and checks are conditional
+    (``If-None-Match`` / ``If-Modified-Since``) so an unchanged response is
+    a cheap 304. Nothing is kept longer than ``max_ttl``.
+
+    Concurrent lookups of one location wait for a single fetch. With a
+    ``bulk`` fetcher (weather_fetcher.py), a lookup that has to go to
+    WeatherAPI refreshes all of the fetcher's due locations at once. When a
+    fetch fails, data up to ``stale_if_error`` seconds old is served
+    instead of nothing.
+
+    Metrics: ``weather_cache.hits``, ``misses``, ``coalesced`` (waited for
+    another device's fetch), ``revalidated`` (304), ``stale`` (served after
+    an error) and ``data_age_seconds`` (age of the conditions served).
+    """
+
+    def __init__(self, refresh_interval=900, min_ttl=60, max_ttl=900, stale_if_error=3600,
+                 client=None, registry=REGISTRY):
+        self.refresh_interval = refresh_interval
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.stale_if_error = stale_if_error
+        self.client = client
+        # Optional WeatherFetcher that refreshes many locations per round trip
+        self.bulk = None
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._async_locks = {}         # key -> asyncio.Lock, used from the event loop only
+        self.hits = registry.counter('weather_cache.hits')
+        self.misses = registry.counter('weather_cache.misses')
+        self.coalesced = registry.counter('weather_cache.coalesced')
+        self.revalidated = registry.counter('weather_cache.revalidated')
+        self.stale = registry.counter('weather_cache.stale')
+        self.data_age = registry.histogram('weather_cache.data_age_seconds',
+                                           bounds=(30, 60, 120, 300, 600, 900, 1800, 3600))
+
+    @classmethod
+    def from_config(cls, config):
+        opts = ((config or {}).get('weather_api') or {}).get('cache') or {}
+        return cls(
+            refresh_interval=opts.get('refresh_interval', 900),
+            min_ttl=opts.get('min_ttl', 60),
+            max_ttl=opts.get('max_ttl', 900),
+            stale_if_error=opts.get('stale_if_error', 3600),
+        )
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            return entry
+
+    def ttl(self, data, headers=None):
+        """Seconds to serve ``data`` without asking WeatherAPI again."""
+        header_ttl = freshness(headers or {})
+        try:
+            updated = data['current']['last_updated_epoch']
+            ttl = updated + self.refresh_interval - time.time()
+            if ttl <= 0:
+                ttl = self.min_ttl     # update overdue: keep checking, but not every tick
+        except (KeyError, TypeError):
+            ttl = self.min_ttl
+        if header_ttl is not None:
+            ttl = min(ttl, header_ttl)
+        return max(0, min(ttl, self.max_ttl))
+
+    def _served(self, data):
+        try:
+            self.data_age.observe(max(0, time.time() - data['current']['last_updated_epoch']))
+        except (KeyError, TypeError):
+            pass
+        return 200, data
+
+    def put(self, key, data, headers=None):
+        """Store a response fetched elsewhere (e.g. in bulk) under ``key``."""
+        entry = self._entry(key)
+        with entry.lock:
+            self._store(entry, data, headers or {})
+
+    def failed(self, key, error):
+        """Record that fetching ``key`` elsewhere failed with ``error`` (status code or exception)."""
+        entry = self._entry(key)
+        with entry.lock:
+            entry.error, entry.failed = error, time.monotonic()
+
+    def _store(self, entry, data, headers):
+        headers = CaseInsensitiveDict(headers)
+        now = time.monotonic()
+        entry.data = data
+        entry.fetched = now
+        entry.expires = now + self.ttl(data, headers)
+        entry.etag = headers.get('ETag')
+        entry.last_modified = headers.get('Last-Modified')
+        entry.error = None
+
+    def get(self, key):
+        """Fresh cached data for ``key``, or None."""
+        entry = self._entries.get(key)
+        if entry is not None and entry.data is not None and time.monotonic() < entry.expires:
+            return entry.data
+        return None
+
+    def expires_in(self, key):
+        """Seconds until ``key`` has to be fetched again (0 when it has to now)."""
+        entry = self._entries.get(key)
+        if entry is None or entry.data is None:
+            return 0
+        return max(0, entry.expires - time.monotonic())
+
+    def fetch(self, url, key):
+        """
+        ``(status_code, data)`` for the location ``key``, from cache when
+        fresh, else from ``url``. Non-200 answers are returned (with None
+        data) unless stale data can be served; network errors are re-raised
+        in that case.
+        """
+        entry = self._entry(key)
+        if entry.data is not None and time.monotonic() < entry.expires:
+            self.hits.inc()
+            return self._served(entry.data)
+        if self.bulk is not None and self.bulk.knows(key):
+            # Refresh every location that is (nearly) due in one go; this one is among them
+            started = time.monotonic()
+            refreshed = self.bulk.refresh(key)
+            if entry.data is not None and (not refreshed or entry.fetched >= started):
+                (self.misses if refreshed else self.coalesced).inc()
+                return self._served(entry.data)
+            if entry.error is not None and entry.failed >= started:
+                # The round already asked for this location and failed: don't ask again this tick
+                self.misses.inc()
+                if self._usable_stale(entry):
+                    return self._served(entry.data)
+                if isinstance(entry.error, Exception):
+                    raise entry.error
+                return entry.error, None
+        waited = not entry.lock.acquire(blocking=False)
+        if waited:
+            entry.lock.acquire()
+        try:
+            if entry.data is not None and time.monotonic() < entry.expires:
+                # Another device sharing this location just fetched it
+                (self.coalesced if waited else self.hits).inc()
+                return self._served(entry.data)
+            self.misses.inc()
+            return self._load(entry, url)
+        finally:
+            entry.lock.release()
+
+    def refresh(self, url, key):
+        """Fetch ``key`` from ``url`` now, fresh or not (conditionally when cached)."""
+        entry = self._entry(key)
+        with entry.lock:
+            return self._load(entry, url)
+
+    def _validators(self, entry):
+        headers = {}
+        if entry.data is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def _load(self, entry, url):
+        try:
+            response = (self.client or get_client()).get(url, headers=self._validators(entry))
+            data = response.json() if response.status_code == 200 else None
+        except (requests.exceptions.RequestException, ValueError) as e:
+            entry.error, entry.failed = e, time.monotonic()
+            if self._usable_stale(entry):
+                return self._served(entry.data)
+            raise
+        return self._complete(entry, response.status_code, response.headers, data)
+
+    def _complete(self, entry, status_code, headers, data):
+        if status_code == 304 and entry.data is not None:
+            self.revalidated.inc()
+            # A 304 may carry updated freshness headers
+            validators = CaseInsensitiveDict({'ETag': entry.etag, 'Last-Modified': entry.last_modified})
+            validators.update(headers)
+            self._store(entry, entry.data, validators)
+            return self._served(entry.data)
+        if status_code == 200:
+            self._store(entry, data, headers)
+            return self._served(entry.data)
+        entry.error, entry.failed = status_code, time.monotonic()
+        if self._usable_stale(entry):
+            return self._served(entry.data)
+        return status_code, None
+
+    async def fetch_async(self, url, key, get):
+        """
+        Coroutine version of ``fetch`` for the asyncio runtime (async_runtime.py).
+
+        ``get(url, headers)`` is a coroutine returning ``(status, headers,
+        body)``. Devices sharing a location wait on an asyncio lock instead of
+        the entry's thread lock, so a fetch in flight never blocks the event
+        loop. The bulk fetcher (threads) is not used here, so these entries
+        are only ever updated from the loop and the thread lock isn't taken.
+        """
+        entry = self._entry(key)
+        if entry.data is not None and time.monotonic() < entry.expires:
+            self.hits.inc()
+            return self._served(entry.data)
+        lock = self._async_locks.get(key)
+        if lock is None:
+            lock = self._async_locks[key] = asyncio.Lock()
+        waited = lock.locked()
+        async with lock:
+            if entry.data is not None and time.monotonic() < entry.expires:
+                (self.coalesced if waited else self.hits).inc()
+                return self._served(entry.data)
+            self.misses.inc()
+            try:
+                status_code, headers, body = await get(url, self._validators(entry))
+                data = json.loads(body) if status_code == 200 else None
+            except (OSError, asyncio.TimeoutError, ValueError):
+                if self._usable_stale(entry):
+                    return self._served(entry.data)
+                raise
+            return self._complete(entry, status_code, headers, data)
+
+    def _usable_stale(self, entry):
+        if entry.data is not None and time.monotonic() - entry.fetched <= self.stale_if_error:
+            self.stale.inc()
+            return True
+        return False
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_weather_cache(config=None):
+    """
+    Process-wide WeatherCache, created from config.json's ``weather_api.cache``
+    section on first use, with a bulk fetcher unless ``weather_api.bulk.enabled``
+    is false.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = WeatherCache.from_config(config)
+            bulk_opts = ((config or {}).get('weather_api') or {}).get('bulk') or {}
+            if bulk_opts.get('enabled', True):
+                from weather_fetcher import WeatherFetcher
+                _cache.bulk = WeatherFetcher.from_config(config, _cache)
+        return _cache
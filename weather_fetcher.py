@@ -0,0 +1,206 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from http_client import get_client
+from metrics import REGISTRY
+from resilience import Backoff
+
+
+class WeatherFetcher:
+    """
+    Refreshes every registered WeatherAPI location in as few round trips as
+    possible and stores the results in a WeatherCache.
+
+    Locations are registered by the devices (``register``). When one of them
+    has to be fetched, ``refresh`` also takes every other location that is
+    due within ``lookahead`` seconds and asks for all of them at once with
+    WeatherAPI's bulk request (``POST current.json?q=bulk``, up to
+    ``batch_size`` locations per request, requests sent concurrently). If
+    the plan has no bulk access, or for locations a bulk answer left out,
+    they are fetched one by one, ``concurrency`` at a time. Devices then read
+    their location from the cache.
+
+    A bulk request refused with 401/403 (no bulk access on the plan) turns
+    bulk off for ``reprobe_interval`` seconds, and a 400 (which may be one
+    bad location) sends that batch one by one. A network error, 429 or 5xx
+    means WeatherAPI itself is in trouble: its locations are marked failed
+    (devices get stale data or the error) and no request is made until a
+    jittered backoff, doubling up to ``max_backoff``, has passed.
+
+    Devices with different API keys may share a location: it is fetched
+    once, with the key registered first, and a single request refused with
+    401/403 is retried with the location's other keys.
+    """
+
+    def __init__(self, cache, base_url='http://api.weatherapi.com/v1', use_bulk=True, batch_size=50,
+                 concurrency=8, lookahead=60, reprobe_interval=3600, max_backoff=300, client=None,
+                 registry=REGISTRY):
+        self.cache = cache
+        self.base_url = base_url.rstrip('/')
+        self.use_bulk = use_bulk
+        self.reprobe_interval = reprobe_interval
+        self._bulk_refused_until = 0.0   # monotonic
+        self._backoff = Backoff(30, max_backoff)
+        self._outage_until = 0.0         # monotonic
+        self._outage_error = None
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.lookahead = lookahead
+        self.client = client
+        self._locations = {}             # key -> {api_key: (query, url)}, in registration order
+        self._lock = threading.Lock()    # one refresh round at a time
+        self._state_lock = threading.Lock()
+        self._executor = None
+        self.rounds = registry.counter('weather_fetch.rounds')
+        self.bulk_requests = registry.counter('weather_fetch.bulk_requests')
+        self.locations_fetched = registry.counter('weather_fetch.locations')
+        self.errors = registry.counter('weather_fetch.errors')
+        self.round_seconds = registry.histogram('weather_fetch.round_seconds')
+
+    @classmethod
+    def from_config(cls, config, cache):
+        weather_opts = (config or {}).get('weather_api') or {}
+        opts = weather_opts.get('bulk') or {}
+        return cls(
+            cache,
+            base_url=weather_opts.get('base_url', 'http://api.weatherapi.com/v1'),
+            use_bulk=opts.get('bulk_request', True),
+            batch_size=opts.get('batch_size', 50),
+            concurrency=opts.get('concurrency', 8),
+            lookahead=opts.get('lookahead', 60),
+            reprobe_interval=opts.get('reprobe_interval', 3600),
+            max_backoff=opts.get('max_backoff', 300),
+        )
+
+    def register(self, key, api_key, query, url=None):
+        """Include a location (cache ``key``) in the refresh rounds; ``url`` is its single request."""
+        url = url or f"{self.base_url}/current.json?key={api_key}&q={query}&aqi=yes"
+        with self._lock:
+            self._locations.setdefault(key, {}).setdefault(api_key, (query, url))
+
+    def knows(self, key):
+        return key in self._locations
+
+    def due(self):
+        """Keys of the locations that expire within ``lookahead`` seconds."""
+        return [key for key in list(self._locations) if self.cache.expires_in(key) <= self.lookahead]
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='weather-fetch')
+        return self._executor
+
+    def refresh(self, key=None):
+        """
+        Fetch every due location. Returns False (without fetching) when
+        ``key`` became fresh while another thread's round was running.
+        """
+        with self._lock:
+            if key is not None and self.cache.get(key) is not None:
+                return False
+            due = self.due()
+            if not due:
+                return True
+            started = time.monotonic()
+            if self.use_bulk and started < self._outage_until:
+                # WeatherAPI failed the last bulk round: don't ask again until the backoff ends
+                for key in due:
+                    self.cache.failed(key, self._outage_error)
+                return True
+            bulk = self.use_bulk and started >= self._bulk_refused_until
+            remaining = self._fetch_bulk(due) if bulk else due
+            if remaining:
+                self._fetch_each(remaining)
+            self.rounds.inc()
+            self.locations_fetched.inc(len(due))
+            self.round_seconds.observe(time.monotonic() - started)
+            return True
+
+    def _fetch_bulk(self, keys):
+        """Bulk-request ``keys``; returns the keys that still need a single request."""
+        by_api_key = {}
+        for key in keys:
+            by_api_key.setdefault(next(iter(self._locations[key])), []).append(key)
+        batches = [(api_key, group[i:i + self.batch_size])
+                   for api_key, group in by_api_key.items()
+                   for i in range(0, len(group), self.batch_size)]
+        missing = []
+        for left in self._pool().map(lambda batch: self._post_bulk(*batch), batches):
+            missing.extend(left)
+        return missing
+
+    def _post_bulk(self, api_key, keys):
+        body = {'locations': [{'q': self._locations[key][api_key][0], 'custom_id': key} for key in keys]}
+        try:
+            self.bulk_requests.inc()
+            response = (self.client or get_client()).post(
+                f"{self.base_url}/current.json", params={'key': api_key, 'q': 'bulk', 'aqi': 'yes'}, json=body)
+            if response.status_code in (401, 403):
+                # Bulk requests need a paid plan; ask again after a while in case it changes
+                with self._state_lock:
+                    now = time.monotonic()
+                    if now >= self._bulk_refused_until:
+                        print(f"[WeatherFetcher]   > Bulk request refused ({response.status_code}), "
+                              f"fetching locations one by one for {self.reprobe_interval:.0f}s")
+                    self._bulk_refused_until = now + self.reprobe_interval
+                return keys
+            if response.status_code == 429 or response.status_code >= 500:
+                self._outage(keys, response.status_code)
+                return []
+            if response.status_code != 200:
+                # A 400 may be a single bad location: send this batch one by one
+                self.errors.inc()
+                return keys
+            data = response.json()
+            served = set()
+            for item in data.get('bulk', []):
+                query = item.get('query') or {}
+                key = query.get('custom_id')
+                if key in self._locations and 'current' in query:
+                    self.cache.put(key, {'location': query.get('location'), 'current': query['current']},
+                                   response.headers)
+                    served.add(key)
+            with self._state_lock:
+                self._backoff.reset()
+            return [key for key in keys if key not in served]
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self._outage(keys, e)
+            return []
+
+    def _outage(self, keys, error):
+        """
+        A bulk request failed with ``error`` (status code or exception):
+        back off rather than sending its locations one by one.
+        """
+        self.errors.inc()
+        with self._state_lock:
+            now = time.monotonic()
+            if now >= self._outage_until:
+                delay = self._backoff.next()
+                self._outage_until = now + delay
+                print(f"[WeatherFetcher]   > Bulk request failed ({error}), "
+                      f"not asking WeatherAPI again for {delay:.0f}s")
+            self._outage_error = error
+        for key in keys:
+            self.cache.failed(key, error)
+
+    def _fetch_each(self, keys):
+        def fetch(key):
+            try:
+                for query, url in list(self._locations[key].values()):
+                    # Another device's key may still work for a shared location
+                    if self.cache.refresh(url, key)[0] not in (401, 403):
+                        break
+            except Exception as e:
+                self.errors.inc()
+                print(f"[WeatherFetcher]   > Could not fetch {key}: {e}")
+
+        list(self._pool().map(fetch, keys))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -1,12 +1,41 @@
-from flask import Flask, render_template, jsonify
+from flask import Flask, Response, render_template, jsonify, request
+import gzip
 import json
 import os
 from datetime import datetime
+from state_store import StateStore
+from stream_hub import StateBroadcaster
+from ring_buffer import DeviceHistoryReader
 
 app = Flask(__name__)
 
 # Shared state file to store current readings
 STATE_FILE = 'current_state.json'
+# Scheduler/runtime metrics dumped by the device orchestrator
+METRICS_FILE = 'metrics.json'
+
+state_store = StateStore(STATE_FILE)
+# One producer pushes new readings to every /api/stream client
+broadcaster = StateBroadcaster(state_store)
+# Comment line sent to idle stream clients so dead connections get noticed
+KEEPALIVE_SECONDS = 15
+# Recent readings per device for trend charts, recorded by the sensor
+# process's pipeline into shared ring buffers (last 6 hours)
+HISTORY_HOURS = 6
+MAX_HISTORY_POINTS = 2000
+
+history = DeviceHistoryReader(max_age=HISTORY_HOURS * 3600)
+# Serialized (and gzipped) /api/current body for the latest state version
+_current_cache = (None, None, None)
+
+def _current_body(version, data):
+    """(etag, body, gzipped body) for a state version, built once per version"""
+    global _current_cache
+    cached = _current_cache
+    if cached[0] != version:
+        body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        cached = _current_cache = (version, body, gzip.compress(body, 6))
+    return cached
 
 @app.route('/')
 def index():
@@ -14,12 +43,23 @@ def index():
 
 @app.route('/api/current')
 def get_current_data():
-    """API endpoint to get current sensor readings"""
+    """API endpoint to get current sensor readings (?device= for one device, else the newest)"""
     try:
-        if os.path.exists(STATE_FILE):
-            with open(STATE_FILE, 'r') as f:
-                data = json.load(f)
-                return jsonify(data)
+        # Shared memory when the sensor process runs, else the state file
+        version, data = state_store.read(request.args.get('device'))
+        if data is not None:
+            # Polls of an unchanged reading get a bodiless 304
+            _, body, gzipped = _current_body(version, data)
+            # Quality-aware: 'gzip;q=0' refuses gzip, '*' accepts it
+            use_gzip = request.accept_encodings['gzip'] > 0
+            etag = f"{version}-gz" if use_gzip else version
+            headers = {'ETag': f'"{etag}"', 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+            if request.if_none_match.contains_weak(etag):
+                return Response(status=304, headers=headers)
+            if use_gzip:
+                headers['Content-Encoding'] = 'gzip'
+                body = gzipped
+            return Response(body, mimetype='application/json', headers=headers)
         else:
             return jsonify({
                 'co2': 0,
@@ -32,6 +72,53 @@ def get_current_data():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/stream')
+def stream_readings():
+    """Server-Sent Events: one 'reading' event per new reading"""
+    client = broadcaster.subscribe()
+
+    def events():
+        try:
+            yield 'retry: 3000\n\n'
+            while not client.closed:
+                item = client.get(timeout=KEEPALIVE_SECONDS)
+                if item is None:
+                    yield ': keepalive\n\n'
+                    continue
+                version, _, payload = item
+                yield f"id: {version}\nevent: reading\ndata: {payload}\n\n"
+        finally:
+            broadcaster.unsubscribe(client)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/history')
+def get_history():
+    """Recent readings of one device: ?device=&since=<epoch seconds>&max_points="""
+    devices = history.devices()
+    device = request.args.get('device') or (devices[0] if len(devices) == 1 else None)
+    if device is None:
+        return jsonify({'error': 'device is required', 'devices': devices}), 400
+    # Malformed numbers fall back to the defaults
+    since = request.args.get('since', type=float)
+    max_points = min(request.args.get('max_points', 500, type=int), MAX_HISTORY_POINTS)
+    points = history.query(device, since, max(1, max_points))
+    if points is None:
+        return jsonify({'error': f"no history for device '{device}'", 'devices': devices}), 404
+    return jsonify(dict(points, device=device, points=len(points['timestamps'])))
+
+@app.route('/api/metrics')
+def get_metrics():
+    """API endpoint exposing the orchestrator's latest metrics snapshot"""
+    try:
+        if os.path.exists(METRICS_FILE):
+            with open(METRICS_FILE, 'r') as f:
+                return jsonify(json.load(f))
+        return jsonify({'metrics': {}, 'timestamp': None})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 if __name__ == '__main__':
     print("=" * 60)
     print("🌐 Web Dashboard Starting...")